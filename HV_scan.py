@@ -6,190 +6,211 @@ Created on Thu May 22 07:50:58 2025
 @author: danielvalmassei
 """
 
-from CAENpy.CAENDigitizer import CAEN_DT5742_Digitizer
-from CAENpy.CAENDesktopHighVoltagePowerSupply import CAENDesktopHighVoltagePowerSupply
-import pandas as pd
-import numpy as np
+from hardware import open_hv_supply, open_digitizer, ramp_together
 import time
 #from ctypes import CDLL
 import sys
+from event_builder import build_data_frame
+from run_format import RunWriter, export_csv
+from waveform_store import WaveformStoreWriter
+import os
+from acquisition import AcquisitionEngine, ReadoutScheduler, split_args
+from online_gain import OnlineGain
+from metrics import AcquisitionMetrics
+from functools import partial
+from config_digitizer import configure_digitizer
+from registers import configure_self_trigger
+from features import RegionOfInterest
+from calibration import load_profile
+from hv_monitor import HVMonitor
+from scan_plan import scan_voltages, ramp_distance
+from checkpoint import ScanCheckpoint
 
 
-def configure_digitizer(digitizer:CAEN_DT5742_Digitizer):
-   	digitizer.set_sampling_frequency(MHz=2500)
-   	digitizer.set_record_length(1024)
-   	digitizer.set_max_num_events_BLT(1024)
-   	digitizer.set_acquisition_mode('sw_controlled')
-   	digitizer.set_ext_trigger_input_mode('disabled')
-   	digitizer.write_register(0x811C, 0x000D0001) # Enable busy signal on GPO.
-   	#digitizer.set_fast_trigger_mode(enabled=True)
-   	digitizer.set_fast_trigger_digitizing(enabled=True)
-   	digitizer.enable_channels(group_1=True, group_2=False)
-   	#digitizer.set_fast_trigger_threshold(22222)
-   	#digitizer.set_fast_trigger_DC_offset(V=0)
-   	digitizer.set_post_trigger_size(0)
-   	for ch in [0]:
-           digitizer.set_trigger_polarity(channel=ch, edge='falling')
-          
-   	print('Digitizer connected with:',digitizer.idn)
+# saved in the checkpoint and re-applied by resume()
+SCAN_SETTINGS = ('dc_offset', 'self_trigger_threshold', 'n_events', 'low_HV', 'high_HV', 'n_steps', 'n_passes', 'order', 'store',
+                 'target_rel_error', 'min_events', 'adc', 'features', 'prescale', 'roi', 'signal_window', 'trigger_sample',
+                 'zero_suppression', 'ramp_speed', 'settle_tolerance', 'settle_time', 'start', 'channels')
 
-        
-def convert_dicitonaries_to_data_frame(waveforms:dict,voltage):
-	data = []
-	for n_event,event_waveforms in enumerate(waveforms):
-		for n_channel in event_waveforms:
- 			df = pd.DataFrame(event_waveforms[n_channel])
- 			df['n_event'] = n_event
- 			df['voltage'] = voltage
- 			df['n_channel'] = n_channel
- 			df.set_index(['n_event','n_channel'], inplace=True)
- 			data.append(df)
-            
-	return pd.concat(data)
-
-def edit_bit(hex_value, bit_position, set_bit=True):
-    """
-    Edit a single bit in a 32-bit hexadecimal value.
-
-    Args:
-        hex_value (str): A string representing the 32-bit hex value (e.g., '0x12345678').
-        bit_position (int): Bit position to modify (0 = least significant bit, 31 = most significant).
-        set_bit (bool): If True, set the bit to 1. If False, clear the bit to 0.
-
-    Returns:
-        str: New 32-bit hexadecimal value as a string (e.g., '0x123456F8').
-    """
-    if not (0 <= bit_position < 32):
-        raise ValueError("bit_position must be between 0 and 31")
-
-    value = hex_value
-
-    if set_bit:
-        value |= (1 << bit_position) #bitwise OR comparisson
-    else:
-        value &= ~(1 << bit_position) #bitwise AND comparisson
 
-    return value
+def convert_dicitonaries_to_data_frame(waveforms:dict,voltage):
+    return build_data_frame(waveforms, voltage)
 
 def check_error_code(code):
     if code != 0:
         raise RuntimeError(f'libCAENDigitizer has returned error code {code}.')
     
     
-def main(dc_offset=-0.3, self_trigger_threshold=2870, n_events=100, low_HV=800, high_HV=1200, n_steps=10):
+def main(dc_offset=-0.3, self_trigger_threshold=2870, n_events=100, low_HV=800, high_HV=1200, n_steps=10, output='out.h5', csv=False, queue_size=8, pipeline=False, store=False, target_rel_error=None, min_events=100, backend='real', metrics=None,
+         poll_interval=None, poll_min=0.01, poll_max=1.0, occupancy_low=0.25, occupancy_high=0.5, profile=None, adc=True,
+         features=False, prescale=100, roi=False, signal_window='-50,150', trigger_sample=None, zero_suppression=None,
+         hv_monitor=1.0, n_passes=1, order='up', ramp_speed=15, settle_tolerance=1.0, settle_time=0.5,
+         start=None, channels=None, checkpoint=None):
+    #channels=['CH0'] writes only those channels of every event (HV_scan_smaller_data.py), None all of them
     
     #libCAENDigitizer = CDLL('/usr/lib/libCAENDigitizer.so')
     
     ########## setup ##########
-    HV = CAENDesktopHighVoltagePowerSupply(port='/dev/ttyACM0') # Open the connection.
+    if profile is not None: #DC offset and threshold from calibration.py
+        calibration = load_profile(profile)
+        dc_offset = calibration['dc_offset']
+        self_trigger_threshold = calibration['self_trigger_threshold']
+        print(f'Loaded {profile}: DC offset {dc_offset:.4f} V, self trigger threshold {self_trigger_threshold}.')
+    
+    #every completed step is recorded in out.h5.scan.json, resume() continues from the first incomplete one
+    resumed = checkpoint is not None
+    if not resumed:
+        checkpoint = ScanCheckpoint(output, {name: value for name, value in locals().items() if name in SCAN_SETTINGS})
+    first_step = checkpoint.n_completed
+    HV = open_hv_supply(backend, port='/dev/ttyACM0') # Open the connection. backend='sim' for simulated hardware
     print('HV connected with:',HV.idn)
+    if start is None and not resumed: #the present HV, a serpentine scan starts at the end closest to it
+        start = float(HV.get_single_channel_parameter('VMON', 0))
+        checkpoint.settings['start'] = start #so a resumed scan keeps the same order
+    
+    #order='serpentine' with n_passes > 1 scans up and down instead of ramping back to low_HV for every pass
+    voltages = scan_voltages(low_HV, high_HV, n_steps, n_passes, order, start)
+    print(f'Scan of {len(voltages)} steps, ramping {ramp_distance(voltages, voltages[0] if start is None else start):.0f} V in total.')
+    if first_step >= len(voltages):
+        print(f'All {len(voltages)} steps of {output} are already complete.')
+        return
+    if resumed:
+        print(f'Resuming at step {first_step} ({voltages[first_step]} V), {first_step} steps are already complete.')
     print('Ramping voltage. This will take a moment...')
     time.sleep(0.5)
-    HV.send_command('SET', 'VSET', CH=0, VAL=low_HV)
+    HV.send_command('SET', 'VSET', CH=0, VAL=voltages[first_step])
     HV.send_command('SET','ON',CH=0)
-    digitizer = CAEN_DT5742_Digitizer(LinkNum=0)
-    configure_digitizer(digitizer)
+    digitizer = open_digitizer(backend, LinkNum=0, hv_supply=HV)
+    registers = configure_digitizer(digitizer) #register settings are staged, not written yet
     digitizer.set_channel_DC_offset(channel=0,V=dc_offset) #set the DC offset to 0 V
     
-        ##### Set Self Trigger Threshold #####
-    old_0x1080_value = digitizer.read_register(0x1080)
-    print(f'Old value of register 0x1080: {old_0x1080_value:08X}')
-    digitizer.write_register(0x1080, self_trigger_threshold) #NOTE: this is a quick trick that we can use right now because we are only working with Ch.0 read register descriptions for more info
-    print(f'0x1080 now: {digitizer.read_register(0x1080):08X} ')
-    
-        ##### Enable Self Trigger #####
-    old_0x10A8_value = digitizer.read_register(0x10A8)
-    print(f'Old value of register 0x10A8: {old_0x10A8_value:08X}')
-    new_0x10A8_value = edit_bit(old_0x10A8_value, 0, set_bit=True)
-    print(f'Writing {new_0x10A8_value:08X} at register 0x10A8.')
-    digitizer.write_register(0x80A8,new_0x10A8_value)
-    print(f'0x10A8 now: {digitizer.read_register(0x10A8):08X} ')
-    print('Self trigger enabled for Ch.0')
-    
-        ##### Revert to Output Mode #####
-    old_0x8000_value = digitizer.read_register(0X8000)
-    print(f'Old value of register 0x8000: {old_0x8000_value:08X}')
-    new_0x8000_value = edit_bit(old_0x8000_value, 13, set_bit=False)
-    print(f'Writing {new_0x8000_value:08X} at register 0x8000.')
-    digitizer.write_register(0x8000, new_0x8000_value)
-    print(f'0x8000 now: {digitizer.read_register(0x8000):08X} ')
+        ##### Self Trigger on Ch.0 in Output Mode #####
+    configure_self_trigger(registers, self_trigger_threshold, transparent_mode=False)
+    registers.commit() #only registers that changed are written, then all are read back once
     print('Ready for Self-Triggered acquisition in Output Mode')
     digitizer.set_max_num_events_BLT(1024) # Override the maximum number of events to be stored in the digitizer's self buffer.
 
 
     ########## Turn on HV ##########
-    HV.channels[0].ramp_voltage(low_HV, ramp_speed_VperSec=50, timeout = low_HV/50 + 30) #Ramp voltage to 800 V and wait for HV to finish
+    HV.channels[0].ramp_voltage(voltages[first_step], ramp_speed_VperSec=50, timeout = voltages[first_step]/50 + 30) #Ramp voltage to the first step and wait for HV to finish
     print('HV ready.')
     
     
     ########## Acquisition ##########
-    collected_events = 0
-    ACQUIRE_AT_LEAST_THIS_NUMBER_OF_EVENTS = n_events
-    data = pd.DataFrame() #Pandas DataFrame
     timeout = n_events*0.5 #timeout if it is taking more than 0.5s/event
     
    
     
     time.sleep(0.1)
-    voltages = np.linspace(low_HV,high_HV,n_steps,endpoint=True)
-    data = []
-    for i in range(len(voltages)):
-        temp_data = [] #List of dict
-        start_time = time.time()
-        collected_events = 0
-        HV.channels[0].ramp_voltage(voltages[i],ramp_speed_VperSec=15)
-        v = HV.get_single_channel_parameter('VMON', 0)
-        current = HV.get_single_channel_parameter('IMON', 0)
-        print(f'Voltage measured at {v} V and is drawing {current} uA and and reset event count...')
-        with digitizer:
-            print('Digitizer is enabled!')
-            while collected_events < ACQUIRE_AT_LEAST_THIS_NUMBER_OF_EVENTS:
-                if time.time()-start_time > timeout:
-                    wf = digitizer.get_waveforms()
-                    collected_events += len(wf)
-                    print(f'Timeout: acquired {collected_events} of {ACQUIRE_AT_LEAST_THIS_NUMBER_OF_EVENTS} at {voltages[i]} V...')
-                    temp_data += wf
-                    break
-                else:
-                    time.sleep(0.5) #ask for data every ~500 ms
-                    wf = digitizer.get_waveforms()
-                    collected_events += len(wf)
-                    print(f'acquired {collected_events} of {ACQUIRE_AT_LEAST_THIS_NUMBER_OF_EVENTS} at {voltages[i]} V...')
-                    temp_data += wf
-                
-        print(f'Collected {collected_events} at {voltages[i]} V.')
-        if len(temp_data) > 0:
-            print('Digitizer Closed. Now converting dictionaries to DataFrame...')
-            temp_data = convert_dicitonaries_to_data_frame(temp_data,voltages[i])
-            print('Appending lists...')
-            data.append(temp_data)
-            print('Increasing voltage...')
-        else:
-            print('No data. Increasing voltage...')
+    run_metrics = AcquisitionMetrics(metrics, buffer_size=1024, run=os.path.basename(output)) #metrics=None only prints a summary per step
+    if roi and store:
+        raise ValueError('The waveform store needs full waveforms, it cannot be written in region-of-interest mode.')
+    store_writer = WaveformStoreWriter(os.path.splitext(output)[0] + '.wfs', resume_steps=first_step if resumed else None) if store else None
+    writer = RunWriter(output, store=store_writer, channels=channels, dc_offset=dc_offset, self_trigger_threshold=self_trigger_threshold,
+                       sampling_frequency_MHz=2500, record_length=1024, n_events=n_events, metrics=run_metrics,
+                       calibration_profile=profile, adc=adc, prescale=prescale,
+                       roi=RegionOfInterest(signal_window, trigger_sample, threshold=zero_suppression) if roi else None,
+                       resume_steps=first_step if resumed else None)
+    checkpoint.save()
+    #poll_interval=None adapts the polling to the trigger rate, a number keeps it fixed
+    scheduler = ReadoutScheduler(1024, (occupancy_low, occupancy_high), poll_min, poll_max) if poll_interval is None else None
+    #VMON, IMON and the status are polled every hv_monitor s on their own thread (0: once per step)
+    monitor = HVMonitor(HV, channels=[0], interval=hv_monitor)
+    engine = AcquisitionEngine(digitizer, queue_size=queue_size, metrics=run_metrics, scheduler=scheduler,
+                               poll_interval=poll_interval if poll_interval is not None else 0.5, hv_monitor=monitor)
+    engine.start()
+    monitor.start()
+    online = OnlineGain('CH0', target_rel_error=target_rel_error, min_events=min_events) #gain of every batch while acquiring
+    scan_start_time = time.time()
+    try:
+        for i in range(first_step, len(voltages)):
+            run_metrics.begin_step(i, voltages[i])
+            ramp_start_time = time.time()
+            with run_metrics.timer('ramp'), monitor.lock: #the monitor shares the serial port
+                #acquisition starts once VMON has stayed within settle_tolerance V for settle_time s
+                ramp_together(HV, [0], voltages[i], ramp_speed_VperSec=ramp_speed, tolerance=settle_tolerance,
+                              hold_time=settle_time) #in pipeline mode the worker is still writing the previous step
+            print(f'Ramped to {voltages[i]} V and settled in {time.time()-ramp_start_time:.1f} s.')
+            readback = monitor.poll()
+            v = readback['VMON'][0]
+            current = readback['IMON'][0]
+            run_metrics.record_hv(v, current)
+            print(f'Voltage measured at {v} V and is drawing {current} uA and and reset event count...')
+            engine.submit(writer.begin_step, voltages[i], VMON=v, IMON=current)
+            online.begin_step(i, voltages[i])
+            #the readout only queues batches, a worker thread converts and writes them
+            #with target_rel_error set, the step also stops once the online gain is precise enough
+            #features=True stores per-event features and only one waveform in `prescale`, roi=True only the pedestal and signal windows
+            if features:
+                handlers = [partial(writer.append_features, voltage=voltages[i]), partial(online.update_features, step=i, writer=writer)]
+            elif roi:
+                handlers = [partial(writer.append_roi, voltage=voltages[i]), partial(online.update, step=i)]
+            else:
+                handlers = [partial(writer.append_waveforms, voltage=voltages[i]), partial(online.update, step=i)]
+            collected_events = engine.acquire(handlers, n_events, timeout, label=f'at {voltages[i]} V',
+                                              stop=partial(online.done, i), hv_handler=writer.append_hv_readings)
+            engine.submit(online.finish_step, i, writer)
+            engine.submit(run_metrics.end_step, i)
+            engine.submit(checkpoint.complete_step, i, voltages[i], collected_events, writer) #after the step's last batch, skipped if one of its writes failed
+            if not pipeline:
+                engine.join() #otherwise this step is converted and written while ramping to the next one
+            print(f'Collected {collected_events} at {voltages[i]} V. Next step...')
+    except BaseException: #crash, serial glitch or Ctrl-C
+        monitor.stop()
+        try:
+            engine.stop() #write what was already read out
+        finally:
+            writer.close()
+            run_metrics.close()
+            print(f'Scan interrupted with {checkpoint.n_completed} of {len(voltages)} steps complete. '
+                  f'Continue it with --resume --output={output}')
+        raise
         
-    print('Acquisition complete.')
-    data = pd.concat(data)
-    
     
     ########## Turn off HV ##########
+    monitor.stop()
     HV.send_command('SET', 'VSET', CH=0, VAL=0) #set HV to 0V, but don't wait
     HV.send_command('SET','OFF',CH=0) #HV will now disable after it ramps down, but we can keep working
     
-    ########## Save the data to a file ##########
-    print('Saving df as .csv')
+    engine.stop()
+    checkpoint.finish()
+    print(f'Acquisition complete in {time.time()-scan_start_time:.1f} s.', engine.stats)
+    writer.close()
+    run_metrics.close()
     
-    data.to_csv('out.csv')
+    ########## Optional .csv export ##########
+    if csv:
+        print('Exporting run as .csv')
+        export_csv(output, 'out.csv')
     
     print('Ramping HV down...')
     HV.channels[0].ramp_voltage(0,ramp_speed_VperSec=50, timeout = high_HV/50 + 30)
     print('Done.')
     
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        main()
-    elif len(sys.argv) == 7:
-        args = sys.argv[1:]
-        main(dc_offset=float(args[0]), self_trigger_threshold=int(args[1]), n_events=int(args[2]), low_HV=float(args[3]), high_HV=float(args[4]), n_steps=int(args[5]))
+def resume(output='out.h5', **options):
+    """
+    Continue the interrupted scan written to `output` from its first
+    incomplete step, with the settings saved in its checkpoint. Other options
+    (backend, metrics, pipeline, ...) are taken as given.
+    """
+    checkpoint = ScanCheckpoint.load(output)
+    print(f'Resuming {output} with the settings of the interrupted scan: {checkpoint.settings}')
+    main(**dict(options, **checkpoint.settings, profile=None), output=output, checkpoint=checkpoint)
+
+
+def cli(argv, **defaults):
+    """Run HV_scan.py with command line `argv`; `defaults` (e.g. channels) apply unless given on it."""
+    args, options = split_args(argv)
+    options = dict(defaults, **options)
+    if options.pop('resume', False):
+        resume(**options)
+    elif len(args) == 0:
+        main(**options)
+    elif len(args) == 6:
+        main(dc_offset=float(args[0]), self_trigger_threshold=int(args[1]), n_events=int(args[2]), low_HV=float(args[3]), high_HV=float(args[4]), n_steps=int(args[5]), **options)
     else:
         print('Too many or too few arguments passed. Please pass dc offset, self trigger threshold, n_events per measurement, low HV, high HV, and n steps.')
-        
\ No newline at end of file
+
+
+if __name__ == '__main__':
+    cli(sys.argv[1:])
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:48:33 2026
+
+@author: danielvalmassei
+
+Gain scan of several PMTs at once: PMT n sits on HV channel hv_channels[n]
+and digitizer channel pmts[n]. All HV channels are ramped together, every PMT
+channel gets its own DC offset and self trigger threshold, and every event is
+labeled with the PMT that triggered it (/step_XXX/trigger_channel in the run
+file). Lists are given comma separated, e.g.
+
+    python HV_scan_multi.py --pmts=0,1,2,3 --thresholds=2870,2865,2880,2870 --n-events=4000
+"""
+
+from hardware import open_hv_supply, open_digitizer, ramp_together
+import numpy as np
+import time
+import sys
+import os
+from run_format import RunWriter, export_csv
+from acquisition import AcquisitionEngine, ReadoutScheduler, split_args
+from online_gain import OnlineGain
+from metrics import AcquisitionMetrics
+from analysis import trigger_channels
+from functools import partial
+from config_digitizer import configure_digitizer
+from registers import configure_channel_self_triggers
+from hv_monitor import HVMonitor
+from scan_plan import scan_voltages, ramp_distance
+from checkpoint import ScanCheckpoint
+
+# saved in the checkpoint and re-applied by resume()
+SCAN_SETTINGS = ('pmts', 'hv_channels', 'dc_offsets', 'thresholds', 'n_events', 'low_HV', 'high_HV', 'n_steps', 'n_passes',
+                 'order', 'target_rel_error', 'min_events', 'adc', 'ramp_speed', 'settle_tolerance', 'settle_time', 'start')
+
+
+def parse_list(value, n, cast=float):
+    """'0,1,2' or a single number (as given by split_args) -> list of n values."""
+    values = [cast(float(v)) for v in str(value).split(',')]
+    if len(values) == 1:
+        values = values*n
+    if len(values) != n:
+        raise ValueError(f'Expected 1 or {n} values, got {value}.')
+    return values
+
+
+def label_batch(waveforms, step, writer, online_gains):
+    """Label the batch just written with the PMT that triggered and feed each PMT's online gain its events."""
+    builder = writer.last_batch
+    labels = trigger_channels(builder.amplitudes)
+    writer.append_column('trigger_channel', np.array([int(builder.channels[label][2:]) for label in labels], dtype=np.int16))
+    for position, online in enumerate(online_gains):
+        online.update_amplitudes(builder.amplitudes[labels == position, position, :], builder.time, step)
+
+
+def main(pmts='0,1,2,3', hv_channels=None, dc_offsets=-0.3, thresholds=2870, n_events=1000, low_HV=800, high_HV=1200,
+         n_steps=10, output='out.h5', csv=False, queue_size=8, pipeline=False, target_rel_error=None, min_events=100,
+         backend='real', metrics=None, poll_interval=None, poll_min=0.01, poll_max=1.0, occupancy_low=0.25,
+         occupancy_high=0.5, adc=True, hv_monitor=1.0, n_passes=1, order='up', ramp_speed=15,
+         settle_tolerance=1.0, settle_time=0.5, start=None, checkpoint=None):
+    #every completed step is recorded in out.h5.scan.json, resume() continues from the first incomplete one
+    resumed = checkpoint is not None
+    if not resumed:
+        checkpoint = ScanCheckpoint(output, {name: value for name, value in locals().items() if name in SCAN_SETTINGS})
+    first_step = checkpoint.n_completed
+    pmts = parse_list(pmts, len(str(pmts).split(',')), int)
+    hv_channels = pmts if hv_channels is None else parse_list(hv_channels, len(pmts), int)
+    dc_offsets = parse_list(dc_offsets, len(pmts))
+    thresholds = parse_list(thresholds, len(pmts), int)
+    n_events = int(n_events)
+    channels = [f'CH{pmt}' for pmt in pmts]
+    HV = open_hv_supply(backend, port='/dev/ttyACM0') # Open the connection. backend='sim' for simulated hardware
+    print('HV connected with:',HV.idn)
+    if start is None and not resumed: #the present HV, a serpentine scan starts at the end closest to it
+        start = float(np.mean([float(HV.get_single_channel_parameter('VMON', channel)) for channel in hv_channels]))
+        checkpoint.settings['start'] = start #so a resumed scan keeps the same order
+    voltages = scan_voltages(low_HV, high_HV, n_steps, n_passes, order, start) #order='serpentine' for up and down passes
+    print(f'Scan of {len(voltages)} steps, ramping {ramp_distance(voltages, voltages[0] if start is None else start):.0f} V in total.')
+    if first_step >= len(voltages):
+        print(f'All {len(voltages)} steps of {output} are already complete.')
+        return
+    if resumed:
+        print(f'Resuming at step {first_step} ({voltages[first_step]} V), {first_step} steps are already complete.')
+
+    ########## setup ##########
+    sim_options = {'pmt_channels': dict(zip(pmts, hv_channels))} if backend == 'sim' else {}
+    digitizer = open_digitizer(backend, LinkNum=0, hv_supply=HV, **sim_options)
+    registers = configure_digitizer(digitizer, channels=pmts) #falling edge self trigger on every PMT channel
+    for pmt, dc_offset in zip(pmts, dc_offsets):
+        digitizer.set_channel_DC_offset(channel=pmt, V=dc_offset)
+        if pmt >= 8:
+            digitizer.enable_channels(group_1=True, group_2=True)
+
+        ##### Self Trigger on every PMT channel in Output Mode #####
+    configure_channel_self_triggers(registers, dict(zip(pmts, thresholds)), transparent_mode=False)
+    registers.commit()
+    print(f'Ready for Self-Triggered acquisition on {channels} in Output Mode')
+    digitizer.set_max_num_events_BLT(1024)
+
+
+    ########## Turn on HV ##########
+    print('Ramping voltage. This will take a moment...')
+    ramp_together(HV, hv_channels, voltages[first_step], ramp_speed_VperSec=50)
+    print('HV ready.')
+
+
+    ########## Acquisition ##########
+    timeout = n_events*0.5 #timeout if it is taking more than 0.5s/event
+    run_metrics = AcquisitionMetrics(metrics, buffer_size=1024, run=os.path.basename(output))
+    writer = RunWriter(output, channels=channels, dc_offset=dc_offsets, self_trigger_threshold=thresholds,
+                       hv_channels=hv_channels, sampling_frequency_MHz=2500, record_length=1024, n_events=n_events,
+                       metrics=run_metrics, adc=adc, resume_steps=first_step if resumed else None)
+    checkpoint.save()
+    scheduler = ReadoutScheduler(1024, (occupancy_low, occupancy_high), poll_min, poll_max) if poll_interval is None else None
+    monitor = HVMonitor(HV, channels=hv_channels, interval=hv_monitor) #polls VMON, IMON and the status while acquiring
+    engine = AcquisitionEngine(digitizer, queue_size=queue_size, metrics=run_metrics, scheduler=scheduler,
+                               poll_interval=poll_interval if poll_interval is not None else 0.5, hv_monitor=monitor)
+    engine.start()
+    monitor.start()
+    online_gains = [OnlineGain(channel, target_rel_error=target_rel_error, min_events=min_events, suffix=f'_{channel}')
+                    for channel in channels]
+    scan_start_time = time.time()
+    try:
+        for i in range(first_step, len(voltages)):
+            run_metrics.begin_step(i, voltages[i])
+            ramp_start_time = time.time()
+            with run_metrics.timer('ramp'), monitor.lock: #the monitor shares the serial port
+                ramp_together(HV, hv_channels, voltages[i], ramp_speed_VperSec=ramp_speed, tolerance=settle_tolerance,
+                              hold_time=settle_time)
+            print(f'Ramped {len(hv_channels)} channels to {voltages[i]} V and settled in {time.time()-ramp_start_time:.1f} s.')
+            readback = monitor.poll()
+            v = readback['VMON']
+            current = readback['IMON']
+            run_metrics.record_hv(v, current)
+            print(f'Voltages measured at {np.round(v, 2).tolist()} V, drawing {np.round(current, 3).tolist()} uA.')
+            engine.submit(writer.begin_step, voltages[i], VMON=v, IMON=current)
+            for online in online_gains:
+                online.begin_step(i, voltages[i])
+            #a step stops early only once every PMT has reached target_rel_error
+            collected_events = engine.acquire([partial(writer.append_waveforms, voltage=voltages[i]),
+                                               partial(label_batch, step=i, writer=writer, online_gains=online_gains)],
+                                              n_events, timeout, label=f'at {voltages[i]} V',
+                                              stop=lambda: all(online.done(i) for online in online_gains),
+                                              hv_handler=writer.append_hv_readings)
+            for online in online_gains:
+                engine.submit(online.finish_step, i, writer)
+            engine.submit(run_metrics.end_step, i)
+            engine.submit(checkpoint.complete_step, i, voltages[i], collected_events, writer) #after the step's last batch, skipped if one of its writes failed
+            if not pipeline:
+                engine.join()
+            print(f'Collected {collected_events} at {voltages[i]} V. Next step...')
+    except BaseException: #crash, serial glitch or Ctrl-C
+        monitor.stop()
+        try:
+            engine.stop() #write what was already read out
+        finally:
+            writer.close()
+            run_metrics.close()
+            print(f'Scan interrupted with {checkpoint.n_completed} of {len(voltages)} steps complete. '
+                  f'Continue it with --resume --output={output}')
+        raise
+
+
+    ########## Turn off HV ##########
+    monitor.stop()
+    for ch in hv_channels:
+        HV.send_command('SET', 'VSET', CH=ch, VAL=0)
+        HV.send_command('SET','OFF',CH=ch)
+
+    engine.stop()
+    checkpoint.finish()
+    print(f'Acquisition complete in {time.time()-scan_start_time:.1f} s.', engine.stats)
+    writer.close()
+    run_metrics.close()
+
+    if csv:
+        print('Exporting run as .csv')
+        export_csv(output, 'out.csv')
+
+    print('Ramping HV down...')
+    ramp_together(HV, hv_channels, 0, ramp_speed_VperSec=50)
+    print('Done.')
+
+
+def resume(output='out.h5', **options):
+    """
+    Continue the interrupted scan written to `output` from its first
+    incomplete step, with the settings saved in its checkpoint. Other options
+    (backend, metrics, pipeline, ...) are taken as given.
+    """
+    checkpoint = ScanCheckpoint.load(output)
+    print(f'Resuming {output} with the settings of the interrupted scan: {checkpoint.settings}')
+    main(**dict(options, **checkpoint.settings), output=output, checkpoint=checkpoint)
+
+
+if __name__ == '__main__':
+    args, options = split_args(sys.argv[1:])
+    if options.pop('resume', False):
+        resume(**options)
+    else:
+        main(**options)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:01:38 2026
+
+@author: danielvalmassei
+
+Producer/consumer acquisition. The thread calling acquire() only drains the
+digitizer into a bounded queue; worker thread(s) convert, write and print.
+"""
+
+import queue
+import threading
+import time
+
+
+class AcquisitionStats:
+    """Counters kept by AcquisitionEngine over the whole run."""
+
+    def __init__(self):
+        self.n_batches = 0
+        self.n_events = 0
+        self.n_dropped_batches = 0
+        self.n_dropped_events = 0
+        self.max_queue_depth = 0
+        self.readout_time = 0.0 #s spent in get_waveforms()
+        self.back_pressure_time = 0.0 #s the readout waited for room in the queue
+        self.handling_time = 0.0 #s the workers spent converting/writing
+
+    def __str__(self):
+        return (f'{self.n_events} events in {self.n_batches} batches, '
+                f'dropped {self.n_dropped_events} events in {self.n_dropped_batches} batches, '
+                f'max queue depth {self.max_queue_depth}, readout {self.readout_time:.2f} s, '
+                f'back-pressure {self.back_pressure_time:.2f} s, handling {self.handling_time:.2f} s')
+
+
+class ReadoutScheduler:
+    """
+    Adaptive poll interval. The trigger rate is estimated from the batch
+    sizes (exponential moving average) and the interval is chosen so that a
+    batch fills the digitizer buffer to the middle of target_occupancy. It is
+    only changed when the expected occupancy leaves that band, may shrink at
+    once but at most doubles per readout, and stays within
+    [min_interval, max_interval]. The time a readout cycle takes on top of
+    the sleep (get_waveforms() itself) is taken into account. A batch that
+    emptied a full buffer only gives a lower limit on the rate, so the
+    interval is then cut by 4.
+    """
+
+    def __init__(self, buffer_size=1024, target_occupancy=(0.25, 0.5), min_interval=0.01, max_interval=1.0,
+                 initial_interval=0.5, smoothing=0.5):
+        self.buffer_size = buffer_size
+        self.target_occupancy = target_occupancy
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.rate = None #Hz
+        self.overhead = 0.0 #s per readout cycle spent outside the sleep
+        self.interval = min(max(initial_interval, min_interval), max_interval)
+
+    def update(self, n_events, elapsed, sleep_time=None):
+        """
+        Take the size of the last batch, the time it took to collect it and
+        how much of that was spent sleeping, return the next interval.
+        """
+        if elapsed <= 0:
+            return self.interval
+        if sleep_time is not None:
+            self.overhead = self.smoothing*max(elapsed - sleep_time, 0.0) + (1 - self.smoothing)*self.overhead
+        measured_rate = n_events/elapsed
+        if n_events >= self.buffer_size:
+            self.rate = max(self.rate or 0.0, measured_rate)
+            interval = self.interval/4
+        else:
+            self.rate = measured_rate if self.rate is None else self.smoothing*measured_rate + (1 - self.smoothing)*self.rate
+            occupancy = self.rate*(self.interval + self.overhead)/self.buffer_size
+            low, high = self.target_occupancy
+            if low <= occupancy <= high:
+                return self.interval
+            if self.rate > 0:
+                interval = min((low + high)/2*self.buffer_size/self.rate - self.overhead, 2*self.interval)
+            else:
+                interval = 2*self.interval
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        return self.interval
+
+
+class AcquisitionEngine:
+    """
+    Read batches with digitizer.get_waveforms() and hand them to worker
+    threads through a bounded queue. Tasks are run in submission order when
+    n_workers=1 (the default), which the run writer relies on.
+
+    When the queue is full the readout either waits for room (back-pressure)
+    or, with drop_when_full=True, drops the batch so the digitizer buffer
+    keeps being drained. Both are recorded in `stats`.
+
+    With `metrics` (a metrics.AcquisitionMetrics) the sleep, readout and
+    back-pressure time and the size of every batch are also recorded per step.
+
+    `scheduler` (a ReadoutScheduler) replaces the fixed poll_interval with
+    one adapted to the trigger rate. It is kept across acquire() calls, so
+    each voltage step starts from the interval the previous one ended with.
+
+    With `hv_monitor` (a hv_monitor.HVMonitor) the HV readings taken since
+    the previous batch are drained with every batch; the readout itself
+    never waits for the HV supply.
+
+    After the first task that raises, the tasks still queued are skipped
+    (so nothing is written after a failed write and a checkpoint submitted
+    behind it is never recorded) and acquire() re-raises the error at its
+    next readout instead of reading on.
+    """
+
+    def __init__(self, digitizer, queue_size=8, n_workers=1, poll_interval=0.5, drop_when_full=False, metrics=None,
+                 scheduler=None, hv_monitor=None):
+        self.digitizer = digitizer
+        self.hv_monitor = hv_monitor
+        self.poll_interval = poll_interval
+        self.scheduler = scheduler
+        self.drop_when_full = drop_when_full
+        self.metrics = metrics
+        self.stats = AcquisitionStats()
+        self._queue = queue.Queue(maxsize=int(queue_size))
+        self._n_workers = n_workers
+        self._workers = []
+        self._errors = []
+
+    def start(self):
+        for _ in range(self._n_workers):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._queue.task_done()
+                break
+            if self.error is not None: #the run is already broken, skip what was queued after the failure
+                self._queue.task_done()
+                continue
+            function, args, kwargs = task
+            start_time = time.perf_counter()
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                self._errors.append(e)
+            finally:
+                self.stats.handling_time += time.perf_counter() - start_time
+                self._queue.task_done()
+
+    @property
+    def error(self):
+        """First exception raised by a task, None while all tasks succeeded."""
+        return self._errors[0] if len(self._errors) > 0 else None
+
+    def submit(self, function, *args, **kwargs):
+        """Run function(*args, **kwargs) on a worker, after everything already queued."""
+        self._queue.put((function, args, kwargs))
+
+    def _put_batch(self, task, n_events):
+        if self.drop_when_full:
+            try:
+                self._queue.put_nowait(task)
+            except queue.Full:
+                self.stats.n_dropped_batches += 1
+                self.stats.n_dropped_events += n_events
+                return
+        else:
+            start_time = time.perf_counter()
+            self._queue.put(task)
+            self.stats.back_pressure_time += time.perf_counter() - start_time
+            if self.metrics is not None:
+                self.metrics.add_time('back_pressure', time.perf_counter() - start_time)
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self._queue.qsize())
+
+    def _report(self, handlers, waveforms, collected_events, n_events, label, poll_interval, hv_handler=None, hv_readings=None):
+        for handler in handlers:
+            handler(waveforms)
+        if hv_handler is not None and len(hv_readings) > 0:
+            hv_handler(hv_readings)
+        print(f'acquired {collected_events} of {n_events} {label}... (polling every {poll_interval:.3g} s)')
+
+    def acquire(self, handler, n_events, timeout=None, label='', stop=None, hv_handler=None):
+        """
+        Enable the digitizer and read until `n_events` have been collected,
+        stop() returns True or `timeout` (s) has passed, then read one last
+        time. Every non-empty batch is passed to handler(waveforms) on a
+        worker thread; `handler` may also be a list of callables, called in
+        order. With an hv_monitor, hv_handler(readings) gets the HV readings
+        drained with the batch after it. Returns the number of events read
+        out, whether or not they have been handled yet. Raises the first
+        worker error as soon as one has occurred.
+        """
+        handlers = handler if isinstance(handler, (list, tuple)) else [handler]
+        collected_events = 0
+        with self.digitizer:
+            print('Digitizer is enabled!')
+            start_time = time.time()
+            last_readout = time.perf_counter()
+            while collected_events < n_events:
+                if self.error is not None:
+                    raise self.error
+                if stop is not None and stop():
+                    print(f'Stop criterion reached after {collected_events} events {label}.')
+                    break
+                poll_interval = self.scheduler.interval if self.scheduler is not None else self.poll_interval
+                timed_out = timeout is not None and time.time() - start_time > timeout
+                sleep_start = time.perf_counter()
+                if not timed_out:
+                    if timeout is not None:
+                        poll_interval = min(poll_interval, max(timeout - (time.time() - start_time), 0))
+                    time.sleep(poll_interval)
+                readout_start = time.perf_counter()
+                waveforms = self.digitizer.get_waveforms()
+                readout_end = time.perf_counter()
+                self.stats.readout_time += readout_end - readout_start
+                if self.scheduler is not None:
+                    self.scheduler.update(len(waveforms), readout_end - last_readout, readout_start - sleep_start)
+                last_readout = readout_end
+                hv = self.hv_monitor.latest() if self.hv_monitor is not None else None #no serial access here
+                if self.metrics is not None:
+                    self.metrics.record_batch(len(waveforms), readout_start - sleep_start, readout_end - readout_start,
+                                              self._queue.qsize(), poll_interval, hv)
+                if len(waveforms) > 0:
+                    #readings taken while this batch was collected, tagged with its first event
+                    hv_readings = self.hv_monitor.drain(collected_events) if self.hv_monitor is not None else None
+                    collected_events += len(waveforms)
+                    self.stats.n_batches += 1
+                    self.stats.n_events += len(waveforms)
+                    self._put_batch((self._report, (handlers, waveforms, collected_events, n_events, label, poll_interval,
+                                                    hv_handler, hv_readings), {}),
+                                    len(waveforms))
+                if timed_out:
+                    print(f'Timeout: acquired {collected_events} of {n_events} {label}...')
+                    break
+        if self.hv_monitor is not None and hv_handler is not None:
+            hv_readings = self.hv_monitor.drain(collected_events) #taken after the last batch, not left for the next step
+            if len(hv_readings) > 0:
+                self.submit(hv_handler, hv_readings)
+        if self.scheduler is not None and self.scheduler.rate is not None:
+            print(f'Poll interval {self.scheduler.interval:.3g} s for an estimated trigger rate of {self.scheduler.rate:.0f} Hz {label}.')
+        return collected_events
+
+    def join(self):
+        """Wait until every queued task has been handled and re-raise the first worker error."""
+        self._queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def split_args(argv):
+    """
+    Split command line arguments into positional arguments and --options.
+    '--name' gives name=True, '--name=value' gives name=value (as an int or a
+    float when possible) and dashes in names become underscores.
+    """
+    args = []
+    options = {}
+    for arg in argv:
+        if not arg.startswith('--'):
+            args.append(arg)
+            continue
+        key, _, value = arg[2:].partition('=')
+        if value == '':
+            value = True
+        else:
+            for number in (int, float):
+                try:
+                    value = number(value)
+                    break
+                except ValueError:
+                    pass
+        options[key.replace('-', '_')] = value
+    return args, options
@@ -10,51 +10,408 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import sys
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from run_format import (read_run, iter_blocks, list_steps, read_step, read_features, has_features, read_roi, has_roi,
+                        has_trigger_channels, read_trigger_channels, list_channels)
+from features import trapezoid, ELEMENTARY_CHARGE, PEDESTAL_WINDOW, parse_window
+from event_builder import sample_times
+from waveform_store import WaveformStore
+from acquisition import split_args
+from analysis_cache import AnalysisCache, CACHE_DIR, CACHE_MAX_BYTES
+from spe_fit import fit_histograms
 #import mplhep as hep
 
+HIST_BINS = 64
+HIST_RANGE = (-0.1E8, 7E8)
+SPECTRUM_BINS = 2**14 #fine charge histogram of every step for the spectrum fit, 128 kB per step
+STREAM_CHUNK_ROWS = 1000000 #rows of out.csv read at a time in streaming mode
+STREAM_BLOCK_EVENTS = 1024 #events of a run file read at a time in streaming mode
 
 
-def main(filename='out.csv'):
-    #plt.style.use(hep.style.LHCb2)
-    gain = 1 #additional gain provided by base or circuit
-    data = pd.read_csv(filename)
-    
-    data = data[data['n_channel'] == 'CH0']
-    plt.plot(data['Amplitude (V)'])
+
+def load_run(filename):
+    # .h5 run files are read directly, anything else is treated as a legacy out.csv
+    if filename.endswith(('.h5', '.hdf5')):
+        return read_run(filename, channels=['CH0']).reset_index()
+    return pd.read_csv(filename)
+
+
+def step_arrays(voltage_events):
+    """
+    Reshape the rows of one voltage step into (events, samples) arrays of
+    amplitude and time. Missing samples are filled with 1.0 as before.
+    """
+    if not voltage_events['n_event'].is_monotonic_increasing:
+        voltage_events = voltage_events.sort_values('n_event', kind='stable')
+    n_events = voltage_events['n_event'].nunique()
+    amplitudes = voltage_events['Amplitude (V)'].fillna(1.0).to_numpy().reshape(n_events, -1)
+    times = voltage_events['Time (s)'].fillna(1.0).to_numpy().reshape(n_events, -1)
+    return amplitudes, times
+
+
+def compute_charges(amplitudes, times, pedestal_window=PEDESTAL_WINDOW, signal_window=None):
+    """
+    Pedestal-corrected charge of every event, in units of the electron charge,
+    for a (events, samples) amplitude array terminated in 50 Ohm. With a
+    signal_window (first, last sample) only the pulse region is integrated
+    instead of the whole record.
+    """
+    pedestal = np.mean(amplitudes[:, pedestal_window[0]:pedestal_window[1]], axis=1, keepdims=True)
+    if signal_window is not None:
+        amplitudes = amplitudes[:, signal_window[0]:signal_window[1]]
+        times = times[..., signal_window[0]:signal_window[1]] #1-D for run files, (events, samples) for out.csv
+    pedestal_corrected_amps = -(amplitudes - pedestal)
+    return trapezoid(pedestal_corrected_amps, times, axis=-1)/(50*ELEMENTARY_CHARGE)
+
+
+def trigger_channels(amplitudes, pedestal_window=PEDESTAL_WINDOW):
+    """
+    Position of the channel with the deepest pulse below its own pedestal for
+    every event of an (events, channels, samples) array, i.e. the PMT that
+    most likely triggered the event in a multi-PMT run.
+    """
+    pedestal = np.mean(amplitudes[:, :, pedestal_window[0]:pedestal_window[1]], axis=2)
+    return np.argmax(pedestal - amplitudes.min(axis=2), axis=1)
+
+
+class StepStatistics:
+    """
+    Running count, mean and std (Welford, merged batch by batch) and a fixed
+    binning charge histogram for one voltage step. With spectrum_bins a
+    finer histogram over the same range is kept for the spectrum fit
+    (spe_fit.py), so memory stays constant however many events are added.
+    """
+
+    def __init__(self, gain=1, bins=HIST_BINS, range=HIST_RANGE, spectrum_bins=None):
+        self.gain = gain
+        self.n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.bins = np.histogram_bin_edges([], bins=bins, range=range)
+        self.counts = np.zeros(len(self.bins) - 1, dtype=np.int64)
+        self.spectrum_bins = np.histogram_bin_edges([], bins=spectrum_bins, range=range) if spectrum_bins else None
+        self.spectrum = np.zeros(spectrum_bins, dtype=np.int64) if spectrum_bins else None
+
+    def update(self, charge):
+        n_batch = len(charge)
+        if n_batch == 0:
+            return
+        batch_mean = np.mean(charge)
+        batch_m2 = np.sum((charge - batch_mean)**2)
+        n = self.n + n_batch
+        delta = batch_mean - self._mean
+        self._mean += delta*n_batch/n
+        self._m2 += batch_m2 + delta**2*self.n*n_batch/n
+        self.n = n
+        self.counts += np.histogram(charge/self.gain, bins=self.bins)[0]
+        if self.spectrum is not None:
+            self.spectrum += np.histogram(charge/self.gain, bins=len(self.spectrum), range=self.spectrum_bins[[0, -1]])[0]
+
+    @property
+    def mean(self):
+        return self._mean if self.n > 0 else np.nan #a step without events has no gain, not gain 0
+
+    @property
+    def std(self):
+        return np.sqrt(self._m2/self.n) if self.n > 0 else np.nan
+
+    @property
+    def err(self):
+        return self.std/np.sqrt(self.n) if self.n > 0 else np.nan
+
+
+def is_waveform_store(filename):
+    return filename.rstrip('/').endswith('.wfs')
+
+
+def is_reduced_run(filename):
+    """True for a run holding feature tables or region-of-interest samples instead of waveforms."""
+    return filename.endswith(('.h5', '.hdf5')) and (has_features(filename) or has_roi(filename))
+
+
+def is_multi_pmt_run(filename):
+    """True for a run of HV_scan_multi.py, whose events are labeled with the PMT that triggered them."""
+    return filename.endswith(('.h5', '.hdf5')) and has_trigger_channels(filename)
+
+
+def pmt_channels(filename):
+    """Channels analyzed separately: every PMT channel of a multi-PMT run, ['CH0'] for any other run."""
+    return list_channels(filename) if is_multi_pmt_run(filename) else ['CH0']
+
+
+def analyze_in_memory(filename, gain=1, signal_window=None, channel='CH0'):
+    """Load the whole run and return (`channel` amplitudes for the preview plots, {voltage: StepStatistics})."""
+    if is_waveform_store(filename):
+        return analyze_streaming(filename, gain, signal_window=signal_window, channel=channel) #memory-mapped, never needs loading
+    if filename.endswith(('.h5', '.hdf5')): #step by step, a scan with several passes has several steps at the same voltage
+        return analyze_files([filename], gain, signal_window=signal_window, channel=channel)
+    data = load_run(filename)
+    data = data[data['n_channel'] == channel]
+    steps = {}
+    for voltage in data['voltage'].unique():
+        voltage_events = data[data['voltage']==voltage]
+        amplitudes, times = step_arrays(voltage_events)
+        steps[voltage] = StepStatistics(gain, spectrum_bins=SPECTRUM_BINS)
+        steps[voltage].update(compute_charges(amplitudes, times, signal_window=signal_window))
+    return data['Amplitude (V)'].to_numpy(), steps
+
+
+def analyze_streaming(filename, gain=1, chunksize=STREAM_CHUNK_ROWS, block_events=STREAM_BLOCK_EVENTS, signal_window=None,
+                      channel='CH0'):
+    """
+    Same as analyze_in_memory, but the run is read in bounded chunks so memory
+    stays constant whatever the file size. The preview amplitudes are those
+    of the first chunk only.
+    """
+    if is_reduced_run(filename):
+        return analyze_files([filename], gain, signal_window=signal_window, channel=channel) #feature tables and ROI samples are small, no need to stream them
+    if is_multi_pmt_run(filename): #one channel and its own events at a time, a step at most
+        return analyze_files([filename], gain, signal_window=signal_window, channel=channel)
+    steps = {}
+    preview = None
+
+    def accumulate(voltage, amplitudes, times):
+        if voltage not in steps:
+            steps[voltage] = StepStatistics(gain, spectrum_bins=SPECTRUM_BINS)
+        steps[voltage].update(compute_charges(amplitudes, times, signal_window=signal_window))
+
+    if filename.endswith(('.h5', '.hdf5')) or is_waveform_store(filename):
+        if is_waveform_store(filename):
+            blocks = WaveformStore(filename).iter_blocks([channel], block_events)
+        else:
+            blocks = iter_blocks(filename, [channel], block_events)
+        for voltage, _, amplitudes, time, _ in blocks:
+            if preview is None:
+                preview = amplitudes[:, 0, :].reshape(-1)
+            accumulate(voltage, amplitudes[:, 0, :], time)
+        return preview, steps
+
+    carry = None #rows of the last, possibly incomplete, event of the previous chunk
+    for chunk in pd.read_csv(filename, chunksize=chunksize):
+        chunk = chunk[chunk['n_channel'] == channel]
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        if len(chunk) == 0:
+            continue
+        if preview is None:
+            preview = chunk['Amplitude (V)'].to_numpy()
+        last = (chunk['voltage'].to_numpy() == chunk['voltage'].iloc[-1]) & (chunk['n_event'].to_numpy() == chunk['n_event'].iloc[-1])
+        carry = chunk[last]
+        complete = chunk[~last]
+        for voltage in complete['voltage'].unique():
+            accumulate(voltage, *step_arrays(complete[complete['voltage']==voltage]))
+    if carry is not None and len(carry) > 0:
+        accumulate(carry['voltage'].iloc[0], *step_arrays(carry))
+    return preview, steps
+
+
+def expand_filenames(patterns):
+    """Run files from a list of names and/or glob patterns ('runs/*.h5'), in order, without duplicates."""
+    filenames = []
+    for pattern in [patterns] if isinstance(patterns, str) else patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if len(matches) == 0:
+            raise FileNotFoundError(f'No run file matches {pattern}.')
+        filenames += [match for match in matches if match not in filenames]
+    return filenames
+
+
+def analysis_tasks(filename, signal_window=None, preview=False, channel='CH0'):
+    """
+    Split one run into independent (function, args) tasks: one per step for
+    .h5/.wfs, one per .csv file. Every task returns (preview, [(voltage,
+    charges)]) of `channel`; with preview=True the first task also returns
+    the amplitudes it read for the preview plots, None otherwise.
+    """
+    if is_waveform_store(filename):
+        return [(_store_step_charges, (filename, step, signal_window, preview and n == 0, channel))
+                for n, step in enumerate(WaveformStore(filename).steps)]
+    if filename.endswith(('.h5', '.hdf5')):
+        return [(_run_step_charges, (filename, step, signal_window, preview and n == 0, channel))
+                for n, step in enumerate(list_steps(filename))]
+    return [(_csv_charges, (filename, signal_window, preview, channel))]
+
+
+def _run_step_charges(filename, step, signal_window=None, preview=False, channel='CH0'):
+    labels = read_trigger_channels(filename, step)
+    triggered = slice(None) if labels is None else labels == int(channel[2:]) #multi-PMT run: only the events this PMT triggered
+    attrs, features = read_features(filename, step, channel)
+    if features is not None: #reduced run, the charges were computed while acquiring
+        return None, [(attrs['voltage'], features['charge'][triggered])]
+    if has_roi(filename): #only the region of interest was kept, integrate its signal window
+        attrs, samples, _, _, n_pedestal, sampling_period = read_roi(filename, step, channel)
+        if samples is None: #every event of the step was suppressed, keep it as an empty row
+            return None, [(attrs['voltage'], np.empty(0))]
+        time = sample_times(samples.shape[1], sampling_period)
+        return None, [(attrs['voltage'], compute_charges(samples, time, (0, n_pedestal), (n_pedestal, samples.shape[1])))]
+    attrs, amplitudes, time, _ = read_step(filename, step, [channel])
+    if amplitudes is None:
+        return None, [(attrs['voltage'], np.empty(0))]
+    amplitudes = amplitudes[triggered, 0, :]
+    return (amplitudes.reshape(-1) if preview else None,
+            [(attrs['voltage'], compute_charges(amplitudes, time, signal_window=signal_window))])
+
+
+def _store_step_charges(filename, step, signal_window=None, preview=False, channel='CH0'):
+    store = WaveformStore(filename)
+    amplitudes = np.asarray(store.channel(step, channel))
+    return (amplitudes.reshape(-1) if preview else None,
+            [(store.voltages[step], compute_charges(amplitudes, store.time, signal_window=signal_window))])
+
+
+def _csv_charges(filename, signal_window=None, preview=False, channel='CH0'):
+    data = load_run(filename)
+    data = data[data['n_channel'] == channel]
+    voltages = data['voltage'].unique()
+    # only the first step is plotted, as for run files, and only it goes into the cache
+    return (data.loc[data['voltage'] == voltages[0], 'Amplitude (V)'].to_numpy() if preview and len(voltages) > 0 else None,
+            [(voltage, compute_charges(*step_arrays(data[data['voltage']==voltage]), signal_window=signal_window))
+             for voltage in voltages])
+
+
+def _run_task(task):
+    function, args = task
+    return function(*args)
+
+
+def analyze_files(filenames, gain=1, jobs=1, cache=None, signal_window=None, channel='CH0'):
+    """
+    Analyze one or more run files with `jobs` worker processes (jobs=1 runs
+    in this process). Every step of every file is a separate task returning
+    its charges; they are merged in task order and steps at the same voltage
+    are combined, so the statistics do not depend on `jobs`. Returns
+    (`channel` amplitudes of the first step for the preview plots,
+    {voltage: StepStatistics}). In a multi-PMT run only the events
+    triggered by the PMT on `channel` are analyzed.
+
+    With an analysis_cache.AnalysisCache, files already analyzed with the
+    same parameters are loaded from it and only the others are recomputed.
+    signal_window (first, last sample) limits the integration to the pulse;
+    it does not apply to reduced runs, whose charges are already windowed.
+    """
+    filenames = expand_filenames(filenames)
+    results = {}
+    keys = {}
+    if cache is not None:
+        for filename in filenames:
+            keys[filename] = cache.key(filename, pedestal_window=PEDESTAL_WINDOW, gain=gain, bins=HIST_BINS,
+                                       range=HIST_RANGE, channel=channel, signal_window=signal_window)
+            entry = cache.load(keys[filename])
+            if entry is not None:
+                results[filename] = entry
+    # only the first file's preview is plotted, but every cached file keeps its own
+    tasks = [(filename, task) for filename in filenames if filename not in results
+             for task in analysis_tasks(filename, signal_window, cache is not None or filename == filenames[0], channel)]
+    file_charges = {filename: [] for filename in filenames if filename not in results}
+    previews = {}
+    if jobs == 1:
+        task_results = list(map(_run_task, [task for _, task in tasks]))
+    else:
+        # the with block also shuts the workers down when a task raises
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            task_results = list(executor.map(_run_task, [task for _, task in tasks]))
+    for (filename, _), (preview, result) in zip(tasks, task_results):
+        if preview is not None:
+            previews[filename] = preview
+        file_charges[filename].extend(result)
+    for filename in file_charges:
+        results[filename] = (previews.get(filename), file_charges[filename])
+        if cache is not None:
+            cache.save(keys[filename], *results[filename])
+    if cache is not None:
+        print(f'{cache.n_hits} of {len(filenames)} file(s) loaded from the analysis cache.')
+
+    charges = []
+    for filename in filenames:
+        charges += results[filename][1]
+    return results[filenames[0]][0], _combine(charges, gain)
+
+
+def _combine(charges, gain):
+    """{voltage: StepStatistics} of (voltage, charges) pairs, one update per voltage."""
+    by_voltage = {}
+    for voltage, step_charges in charges:
+        by_voltage.setdefault(voltage, []).append(step_charges)
+    steps = {}
+    for voltage, step_charges in by_voltage.items():
+        steps[voltage] = StepStatistics(gain, spectrum_bins=SPECTRUM_BINS)
+        steps[voltage].update(np.concatenate(step_charges))
+    return steps
+
+
+def fit_steps(steps, initial=None):
+    """
+    spe_fit.SPEFit of the charge spectra of {voltage: StepStatistics} (with
+    spectrum_bins), in order of increasing voltage. `initial` (the parameters
+    of an earlier fit of the same steps) makes a refit start where that one
+    ended.
+    """
+    voltages = np.sort(np.array(list(steps), dtype=float))
+    spectra = np.array([steps[voltage].spectrum for voltage in voltages])
+    return fit_histograms(spectra, steps[voltages[0]].spectrum_bins, voltages, initial=initial)
+
+
+def plot_event(filename='out.wfs', voltage=None, n_event=0, channel='CH0', step=0):
+    """
+    Event display straight from a waveform store, e.g. plot_event('out.wfs', 1100, 5123).
+    Only the requested record is read from disk.
+    """
+    store = WaveformStore(filename)
+    if voltage is not None:
+        step = store.step_at(voltage)
+    amplitudes = store.event(step, n_event, channel)
+    plt.plot(store.time, amplitudes)
+    plt.title(f'Event {n_event}, {channel} at {store.voltages[step]:.5}V')
+    plt.ylabel('Amplitude (V)')
+    plt.xlabel('Time (s)')
     plt.show()
+
+
+def report(amplitudes, steps, gain=1, fit=True, table='gain_table.txt', label=''):
+    """Plots of one channel's analysis and its gain table, written to `table`."""
+    if amplitudes is not None: #a reduced run may have no waveforms
+        plt.plot(amplitudes)
+        plt.title(label)
+        plt.show()
+        
+        pedestal_corrected_amps = -(amplitudes - np.mean(amplitudes[PEDESTAL_WINDOW[0]:PEDESTAL_WINDOW[1]]))
+        
+        plt.plot(pedestal_corrected_amps[:1023])
+        plt.ylabel('Voltage (V)')
+        plt.xlabel('Sample No.')
+        plt.title(label)
+        plt.show()
     
-    #print(data[data['n_channel'] == 'CH0'])
-    
-    pedestal_corrected_amps = -(data['Amplitude (V)'] - np.mean(np.mean(data['Amplitude (V)'][10:210])))
-    
-    plt.plot(pedestal_corrected_amps[:1023])
-    plt.ylabel('Voltage (V)')
-    plt.xlabel('Sample No.')
-    plt.show()
+    voltages = np.array(list(steps))
     
-    voltages = data['voltage'].unique()
+    mean_charge = np.array([steps[voltage].mean for voltage in voltages])
+    std_charge = np.array([steps[voltage].std for voltage in voltages])
+    err_charge = np.array([steps[voltage].err for voltage in voltages])
     
-    mean_charge = np.zeros(len(voltages))
-    std_charge = np.zeros(len(voltages))
-    err_charge = np.zeros(len(voltages))
+    if fit: #gain from the spacing of the p.e. peaks
+        spe = fit_steps(steps)
+        order = np.searchsorted(spe.voltages, voltages)
+        # fits that did not converge, fit badly or leave the gain undetermined are left out of the table
+        valid = spe.valid[order]
+        fit_gain = np.where(valid, spe.gain[order], np.nan)
+        fit_err = np.where(valid, spe.gain_err[order], np.nan)
+        fit_chi2_ndf = spe.chi2_ndf[order]
+        print(f'Fitted the spectra of {len(voltages)} steps, {np.sum(spe.converged)} converged, {np.sum(valid)} valid.')
+        for n_step in sorted({0, len(spe.voltages)//2, len(spe.voltages) - 1}):
+            plt.stairs(spe.counts[n_step], spe.edges[n_step], label=f'{spe.voltages[n_step]:.5}V')
+            centers = (spe.edges[n_step, 1:] + spe.edges[n_step, :-1])/2
+            plt.plot(centers, spe.model(n_step), color='k')
+        plt.legend()
+        plt.grid(True,which='both',axis='both')
+        plt.ylabel('Events')
+        plt.xlabel('Gain')
+        plt.title(label)
+        plt.show()
     
-    for voltage in range(len(voltages)):
-        voltage_events = data[data['voltage']==voltages[voltage]]
-        n_events = len(voltage_events['n_event'].unique())
-        charge = np.zeros(n_events)
-        for i in range(n_events):
-            event = voltage_events[voltage_events['n_event'] == i].fillna(1.0)
-            pedestal_corrected_amps = -(event['Amplitude (V)'] - np.mean(event['Amplitude (V)'][10:210]))
-            charge[i] = np.trapz(pedestal_corrected_amps,event['Time (s)'])/(50*1.602*10**(-19))
-
-                
-        counts,bins = np.histogram(charge/gain,bins=64,range=(-0.1E8,7E8))
-        plt.stairs(counts,bins,label=f'{voltages[voltage]:.5}V')
-        
-        
-        mean_charge[voltage] = np.mean(charge)
-        std_charge[voltage] = np.std(charge)
-        err_charge[voltage] = std_charge[voltage]/np.sqrt(n_events)
+    for voltage in voltages:
+        plt.stairs(steps[voltage].counts,steps[voltage].bins,label=f'{voltage:.5}V')
         
     #print(voltages,mean_charge,std_charge,err_charge)
     
@@ -63,31 +420,75 @@ def main(filename='out.csv'):
     plt.grid(True,which='both',axis='both')
     plt.ylabel('Events')
     plt.xlabel('Gain')
+    plt.title(label)
     plt.show()
         
-    plt.errorbar(voltages, mean_charge/gain, yerr = err_charge,marker = '.',capsize=5,color='Maroon')
+    plt.errorbar(voltages, mean_charge/gain, yerr = err_charge,marker = '.',capsize=5,color='Maroon',label='mean charge')
+    if fit:
+        plt.errorbar(voltages, fit_gain, yerr = fit_err,marker = '.',capsize=5,color='Navy',label='SPE fit')
+        plt.legend()
     #plt.yscale('log')
     plt.grid(True,which='both',axis='both')
     plt.ylabel('Gain')
     plt.xlabel('Voltage (V)')
+    plt.title(label)
     plt.show()
     
-    plt.errorbar(voltages, mean_charge/gain, yerr = err_charge,marker = '.',capsize=5,color='Maroon')
+    plt.errorbar(voltages, mean_charge/gain, yerr = err_charge,marker = '.',capsize=5,color='Maroon',label='mean charge')
+    if fit:
+        plt.errorbar(voltages, fit_gain, yerr = fit_err,marker = '.',capsize=5,color='Navy',label='SPE fit')
+        plt.legend()
     plt.yscale('log')
     plt.grid(True,which='both',axis='both')
     plt.ylabel('Gain')
     plt.xlabel('Voltage (V)')
+    plt.title(label)
     plt.show()
     
     df = pd.DataFrame(np.array([voltages,mean_charge,std_charge,err_charge]).T,columns = ['voltage','gain','std','err'])
-    df.to_csv('gain_table.txt',sep='|',float_format='%.6g',index=False)
+    if fit:
+        df['fit_gain'], df['fit_err'], df['fit_chi2_ndf'] = fit_gain, fit_err, fit_chi2_ndf
+    df.to_csv(table,sep='|',float_format='%.6g',index=False)
         
+
+
+def main(filename='out.h5', stream=False, jobs=None, cache=True, cache_dir=CACHE_DIR, cache_max_bytes=CACHE_MAX_BYTES,
+         signal_window=None, fit=True):
+    """
+    `filename` may also be a list of run files and/or glob patterns. Several
+    files, or jobs=N, use the multi-process analyze_files() and combine steps
+    taken at the same voltage. Results are cached in `cache_dir` (see
+    analysis_cache.py) unless cache=False or stream=True. signal_window='300,500'
+    integrates only those samples of every record. fit=True also fits the
+    single photoelectron spectrum of every step (spe_fit.py) for the gain.
+
+    The table is written to gain_table.txt. Each PMT of a multi-PMT run
+    (HV_scan_multi.py) is analyzed from the events it triggered and gets
+    its own gain_table_CHn.txt, like the per-PMT online gain.
+    """
+    #plt.style.use(hep.style.LHCb2)
+    gain = 1 #additional gain provided by base or circuit
+    filenames = expand_filenames(filename)
+    signal_window = parse_window(signal_window) if signal_window is not None else None
+    channels = pmt_channels(filenames[0])
+    for channel in channels:
+        if len(channels) > 1:
+            print(f'{channel}: events triggered by the PMT on {channel}')
+        if stream and len(filenames) == 1 and jobs is None:
+            amplitudes, steps = analyze_streaming(filenames[0], gain, signal_window=signal_window, channel=channel)
+        elif len(filenames) > 1 or jobs is not None or cache:
+            n_jobs = jobs if jobs is not None else os.cpu_count() if len(filenames) > 1 else 1
+            analysis_cache = AnalysisCache(cache_dir, cache_max_bytes) if cache and not stream else None
+            amplitudes, steps = analyze_files(filenames, gain, jobs=int(n_jobs), cache=analysis_cache, signal_window=signal_window,
+                                              channel=channel)
+        else:
+            amplitudes, steps = analyze_in_memory(filenames[0], gain, signal_window=signal_window, channel=channel)
+        report(amplitudes, steps, gain, fit, 'gain_table.txt' if len(channels) == 1 else f'gain_table_{channel}.txt',
+               channel if len(channels) > 1 else '')
+
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        main()
-    elif len(sys.argv) == 2:
-        args = sys.argv[1:]
-        main(str(args[0]))
+    args, options = split_args(sys.argv[1:])
+    if len(args) == 0:
+        main(**options)
     else:
-        print('Too many arguments.')
-        
\ No newline at end of file
+        main(args, **options)
\ No newline at end of file
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:55:05 2026
+
+@author: danielvalmassei
+
+Content-addressed cache of analysis results. An entry holds the per-event
+charges of every step of one run file and the preview amplitudes of its
+first step, and is keyed by the SHA-256 of the file contents plus the
+analysis parameters, so a renamed or copied run still hits and a rewritten
+one (or a different pedestal window, gain or binning) misses. The per-step
+gain table is not stored: it is rebuilt from the cached charges in
+milliseconds, and combining files or fitting the spectra needs the charges
+anyway.
+
+Hashing a large run still means reading it once, so the hash of every file
+is remembered together with its size and modification time and only
+recomputed when one of them changes. The cache directory is kept under
+max_bytes by deleting the least recently used entries.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+
+CACHE_DIR = '.analysis_cache'
+CACHE_MAX_BYTES = 2*1024**3
+CACHE_VERSION = 5 #bump when the cached quantities change meaning
+HASH_BLOCK_BYTES = 8*1024**2
+
+
+def _content_files(filename):
+    # a .wfs waveform store is a directory, hash every file in it
+    if os.path.isdir(filename):
+        return [os.path.join(filename, name) for name in sorted(os.listdir(filename))]
+    return [filename]
+
+
+def content_hash(filename):
+    """SHA-256 of the contents of a run file (or of every file of a waveform store)."""
+    digest = hashlib.sha256()
+    for path in _content_files(filename):
+        digest.update(os.path.basename(path).encode() + b'\0')
+        with open(path, 'rb') as f:
+            while block := f.read(HASH_BLOCK_BYTES):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Cache of analysis.analyze_files() results in `directory`: per run file
+    and parameter set, a .npz of charges and a .npy of the first step's
+    preview amplitudes. load() returns None on a miss.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.n_hits = 0
+        self.n_misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._hashes_file = os.path.join(directory, 'hashes.json')
+        try:
+            with open(self._hashes_file) as f:
+                self._hashes = json.load(f)
+        except (OSError, ValueError):
+            self._hashes = {}
+
+    def file_hash(self, filename):
+        """Content hash of a run file, recomputed only if its size or modification time changed."""
+        stats = [os.stat(path) for path in _content_files(filename)]
+        signature = [[stat.st_size, stat.st_mtime_ns] for stat in stats]
+        path = os.path.abspath(filename)
+        if path in self._hashes and self._hashes[path][0] == signature:
+            return self._hashes[path][1]
+        file_hash = content_hash(filename)
+        self._hashes[path] = [signature, file_hash]
+        with open(self._hashes_file + '.tmp', 'w') as f:
+            json.dump(self._hashes, f)
+        os.replace(self._hashes_file + '.tmp', self._hashes_file)
+        return file_hash
+
+    def key(self, filename, **parameters):
+        """Cache key of a run file analyzed with `parameters` (any JSON-serializable values)."""
+        parameters = json.dumps(dict(parameters, version=CACHE_VERSION), sort_keys=True, default=str)
+        return hashlib.sha256((self.file_hash(filename) + parameters).encode()).hexdigest()
+
+    def _path(self, key, extension='.npz'):
+        return os.path.join(self.directory, key + extension)
+
+    def load(self, key):
+        """
+        (preview, [(voltage, charges) per step]) of a cached run
+        file, or None. The preview is memory-mapped, so it costs nothing
+        unless it is plotted.
+        """
+        try:
+            with np.load(self._path(key)) as entry:
+                voltages = entry['voltages']
+                charges = [(voltage, entry[f'charges_{n}']) for n, voltage in enumerate(voltages.tolist())]
+            preview = np.load(self._path(key, '.npy'), mmap_mode='r') if os.path.exists(self._path(key, '.npy')) else None
+        except (OSError, KeyError, ValueError):
+            self.n_misses += 1
+            return None
+        os.utime(self._path(key)) #the modification time orders the entries for eviction
+        self.n_hits += 1
+        return preview, charges
+
+    def save(self, key, preview, charges):
+        """Store the results of one run file, then evict old entries above max_bytes."""
+        arrays = {f'charges_{n}': step_charges for n, (_, step_charges) in enumerate(charges)}
+        arrays['voltages'] = np.array([voltage for voltage, _ in charges], dtype=float)
+        # write and rename, so an interrupted save never leaves half an entry
+        if preview is not None:
+            np.save(self._path(key + '.tmp', '.npy'), preview)
+            os.replace(self._path(key + '.tmp', '.npy'), self._path(key, '.npy'))
+        np.savez(self._path(key + '.tmp'), **arrays)
+        os.replace(self._path(key + '.tmp'), self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        entries = {}
+        for name in os.listdir(self.directory):
+            key, extension = os.path.splitext(name)
+            if extension in ('.npz', '.npy'):
+                stat = os.stat(os.path.join(self.directory, name))
+                last_used, size = entries.get(key, (0, 0))
+                entries[key] = (max(last_used, stat.st_mtime_ns) if extension == '.npz' else last_used, size + stat.st_size)
+        total = sum(size for _, size in entries.values())
+        for key, (_, size) in sorted(entries.items(), key=lambda entry: entry[1][0]):
+            if total <= self.max_bytes:
+                break
+            for extension in ('.npz', '.npy'):
+                if os.path.exists(self._path(key, extension)):
+                    os.remove(self._path(key, extension))
+            total -= size
+            print(f'Evicted {key[:12]} from the analysis cache.')
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        self._hashes = {}
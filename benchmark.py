@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:40:12 2026
+
+@author: danielvalmassei
+"""
+
+import numpy as np
+import pandas as pd
+import time
+import sys
+import os
+import tempfile
+import json
+import platform
+import tracemalloc
+from functools import partial
+from event_builder import EventBuilder, build_data_frame
+from analysis import step_arrays, compute_charges, trapezoid
+from acquisition import AcquisitionEngine, split_args
+from run_format import RunWriter, iter_blocks
+from simulated_hardware import SimulatedDT5742Digitizer
+from features import RegionOfInterest
+
+
+def make_waveforms(n_events, n_channels=8, record_length=1024, sampling_MHz=2500, seed=0):
+    """
+    Synthetic get_waveforms() output: a list of dicts {'CHn': {'Time (s)', 'Amplitude (V)'}}
+    with a noisy baseline and a negative PMT-like pulse on every channel.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(record_length)/(sampling_MHz*1e6)
+    amplitudes = 0.1 + 0.002*rng.standard_normal((n_events, n_channels, record_length))
+    pulse_height = rng.exponential(0.05, size=(n_events, n_channels, 1))
+    pulse = np.exp(-0.5*((np.arange(record_length) - 400)/6)**2)
+    amplitudes -= pulse_height*pulse
+    amplitudes = np.round((amplitudes + 0.5)*4096)/4096 - 0.5 #on the 12 bit ADC grid, like the digitizer output
+    return [{f'CH{ch}': {'Time (s)': t, 'Amplitude (V)': amplitudes[n, ch]} for ch in range(n_channels)} for n in range(n_events)]
+
+
+def legacy_convert_dicitonaries_to_data_frame(waveforms:dict,voltage):
+    # Reference copy of the per-event DataFrame conversion used before event_builder.
+    data = []
+    for n_event,event_waveforms in enumerate(waveforms):
+        for n_channel in event_waveforms:
+            df = pd.DataFrame(event_waveforms[n_channel])
+            df['n_event'] = n_event
+            df['voltage'] = voltage
+            df['n_channel'] = n_channel
+            df.set_index(['n_event','n_channel'], inplace=True)
+            data.append(df)
+
+    return pd.concat(data)
+
+
+def time_it(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+def benchmark_event_builder(n_events=1000, n_channels=8, record_length=1024):
+    waveforms = make_waveforms(n_events, n_channels, record_length)
+    voltage = 1000.0
+
+    legacy, legacy_time = time_it(legacy_convert_dicitonaries_to_data_frame, waveforms, voltage)
+    built, built_time = time_it(build_data_frame, waveforms, voltage)
+    pd.testing.assert_frame_equal(legacy, built)
+    builder = EventBuilder(n_events, list(waveforms[0]), record_length)
+    _, fill_time = time_it(builder.add, waveforms, voltage)
+
+    print(f'{n_events} events x {n_channels} channels x {record_length} samples')
+    print(f'  convert_dicitonaries_to_data_frame: {legacy_time:.3f} s ({n_events/legacy_time:.0f} events/s)')
+    print(f'  EventBuilder + to_data_frame:       {built_time:.3f} s ({n_events/built_time:.0f} events/s)')
+    print(f'  EventBuilder.add only:              {fill_time:.3f} s ({n_events/fill_time:.0f} events/s)')
+    print(f'  speedup: {legacy_time/built_time:.1f}x')
+
+
+def legacy_charges(data):
+    # Reference copy of the per-event charge loop used in analysis.main before it was vectorized.
+    voltage_events = data
+    n_events = len(voltage_events['n_event'].unique())
+    charge = np.zeros(n_events)
+    for i in range(n_events):
+        event = voltage_events[voltage_events['n_event'] == i].fillna(1.0)
+        pedestal_corrected_amps = -(event['Amplitude (V)'] - np.mean(event['Amplitude (V)'][10:210]))
+        charge[i] = trapezoid(pedestal_corrected_amps,event['Time (s)'])/(50*1.602*10**(-19))
+    return charge
+
+
+def vectorized_charges(data):
+    amplitudes, times = step_arrays(data)
+    return compute_charges(amplitudes, times)
+
+
+def benchmark_charge(n_events=100000, record_length=1024, n_legacy_events=2000):
+    """
+    Check that the vectorized charge calculation gives the same numbers as the
+    old per-event loop and time both. The loop is O(N^2) in events, so it is
+    only timed on the first n_legacy_events and extrapolated to n_events.
+    """
+    builder = EventBuilder(n_events, ['CH0'], record_length)
+    for start in range(0, n_events, 1024):
+        builder.add(make_waveforms(min(1024, n_events - start), 1, record_length, seed=start), 1000.0)
+    data = builder.to_data_frame().reset_index()
+
+    n_legacy_events = min(n_legacy_events, n_events)
+    legacy_data = data[data['n_event'] < n_legacy_events]
+    legacy, legacy_time = time_it(legacy_charges, legacy_data)
+    vectorized = vectorized_charges(legacy_data)
+    np.testing.assert_allclose(vectorized, legacy, rtol=1e-9, atol=1e-3)
+    print(f'Vectorized charges match the per-event loop on {n_legacy_events} events.')
+
+    vectorized, vectorized_time = time_it(vectorized_charges, data)
+    legacy_time_estimate = legacy_time*(n_events/n_legacy_events)**2
+    print(f'{n_events} events x {record_length} samples')
+    print(f'  per-event loop: ~{legacy_time_estimate:.0f} s (extrapolated from {legacy_time:.3f} s at {n_legacy_events} events)')
+    print(f'  vectorized:     {vectorized_time:.3f} s ({n_events/vectorized_time:.0f} events/s)')
+    print(f'  speedup: ~{legacy_time_estimate/vectorized_time:.0f}x')
+
+
+def benchmark_acquisition(trigger_rate_Hz=2000, duration=10, n_channels=8, poll_interval=0.5):
+    """
+    Run the acquisition engine against the simulated digitizer for `duration`
+    seconds and report throughput and the fraction of triggers lost to a
+    full digitizer buffer (dead time).
+    """
+    digitizer = SimulatedDT5742Digitizer(trigger_rate_Hz=trigger_rate_Hz, seed=0)
+    digitizer.enable_channels(group_1=True, group_2=False)
+    channels = [f'CH{ch}' for ch in range(n_channels)]
+    with tempfile.TemporaryDirectory() as directory:
+        with RunWriter(os.path.join(directory, 'bench.h5'), channels=channels) as writer:
+            with AcquisitionEngine(digitizer, poll_interval=poll_interval) as engine:
+                engine.submit(writer.begin_step, 1000.0)
+                start_time = time.perf_counter()
+                collected_events = engine.acquire(partial(writer.append_waveforms, voltage=1000.0), np.inf, timeout=duration)
+                engine.join()
+                elapsed = time.perf_counter() - start_time
+            size_MB = os.path.getsize(writer.filename)/1e6
+
+    print(f'Simulated acquisition: {trigger_rate_Hz} Hz trigger rate, {n_channels} channels, {poll_interval} s poll interval')
+    print(f'  {collected_events} events in {elapsed:.1f} s ({collected_events/elapsed:.0f} events/s, {size_MB/elapsed:.1f} MB/s written)')
+    print(f'  lost {digitizer.n_lost_events} of {digitizer.n_triggers} triggers ({digitizer.n_lost_events/max(digitizer.n_triggers, 1):.1%} dead time)')
+    print(f'  {engine.stats}')
+
+
+########## Benchmark suite ##########
+SUITE_SIZES = (1000, 10000, 100000, 1000000)
+SUITE_CHANNELS = (1, 8)
+BLOCK_EVENTS = 1024 #events per synthetic get_waveforms() batch
+RECORD_LENGTH = 1024
+BASELINE_FILE = 'benchmark_baseline.json'
+
+
+def bench_file(workdir, block, n_events, extension):
+    return os.path.join(workdir, f'bench_{n_events}x{len(block[0])}{extension}')
+
+
+def iter_batches(block, n_events):
+    """Yield batches of the synthetic `block` until n_events have been produced."""
+    produced = 0
+    while produced < n_events:
+        batch = block[:min(len(block), n_events - produced)]
+        produced += len(batch)
+        yield batch
+
+
+def stage_convert_legacy(block, n_events, workdir):
+    for batch in iter_batches(block, n_events):
+        legacy_convert_dicitonaries_to_data_frame(batch, 1000.0)
+
+
+def stage_convert_event_builder(block, n_events, workdir):
+    for batch in iter_batches(block, n_events):
+        build_data_frame(batch, 1000.0)
+
+
+def stage_event_builder_add(block, n_events, workdir):
+    builder = EventBuilder(len(block), list(block[0]), RECORD_LENGTH)
+    for batch in iter_batches(block, n_events):
+        builder.clear()
+        builder.add(batch, 1000.0)
+
+
+def stage_event_builder_add_adc(block, n_events, workdir):
+    builder = EventBuilder(len(block), list(block[0]), RECORD_LENGTH, np.uint16)
+    for batch in iter_batches(block, n_events):
+        builder.clear()
+        builder.add(batch, 1000.0)
+
+
+def stage_to_csv(block, n_events, workdir):
+    filename = bench_file(workdir, block, n_events, '.csv')
+    builder = EventBuilder(len(block), list(block[0]), RECORD_LENGTH)
+    header = True
+    for batch in iter_batches(block, n_events):
+        builder.clear()
+        builder.add(batch, 1000.0)
+        builder.to_data_frame().to_csv(filename, mode='w' if header else 'a', header=header)
+        header = False
+    return os.path.getsize(filename)
+
+
+def stage_read_csv(block, n_events, workdir):
+    filename = bench_file(workdir, block, n_events, '.csv')
+    if not os.path.exists(filename):
+        stage_to_csv(block, n_events, workdir)
+    pd.read_csv(filename)
+    return os.path.getsize(filename)
+
+
+def stage_run_format_write(block, n_events, workdir):
+    filename = bench_file(workdir, block, n_events, '.h5')
+    with RunWriter(filename) as writer:
+        writer.begin_step(1000.0)
+        for batch in iter_batches(block, n_events):
+            writer.append_waveforms(batch, 1000.0)
+    return os.path.getsize(filename)
+
+
+def stage_run_format_write_features(block, n_events, workdir):
+    filename = bench_file(workdir, block, n_events, '_features.h5')
+    with RunWriter(filename) as writer:
+        writer.begin_step(1000.0)
+        for batch in iter_batches(block, n_events):
+            writer.append_features(batch, 1000.0)
+    return os.path.getsize(filename)
+
+
+def stage_run_format_write_roi(block, n_events, workdir):
+    filename = bench_file(workdir, block, n_events, '_roi.h5')
+    with RunWriter(filename, roi=RegionOfInterest()) as writer:
+        writer.begin_step(1000.0)
+        for batch in iter_batches(block, n_events):
+            writer.append_roi(batch, 1000.0)
+    return os.path.getsize(filename)
+
+
+def stage_run_format_read(block, n_events, workdir):
+    filename = bench_file(workdir, block, n_events, '.h5')
+    if not os.path.exists(filename):
+        stage_run_format_write(block, n_events, workdir)
+    for _ in iter_blocks(filename, block_events=BLOCK_EVENTS):
+        pass
+    return os.path.getsize(filename)
+
+
+def stage_charge_loop_legacy(block, n_events, workdir):
+    for batch in iter_batches(block, n_events):
+        legacy_charges(build_data_frame(batch, 1000.0, ['CH0']).reset_index())
+
+
+def stage_charge_vectorized(block, n_events, workdir):
+    amplitudes = np.stack([event_waveforms['CH0']['Amplitude (V)'] for event_waveforms in block])
+    time_axis = block[0]['CH0']['Time (s)']
+    for batch in iter_batches(amplitudes, n_events):
+        compute_charges(batch, time_axis)
+
+
+def stage_polling_loop(block, n_events, workdir):
+    digitizer = SimulatedDT5742Digitizer(trigger_rate_Hz=50000, buffer_size=1024, seed=0) #one group, 8 channels
+    with AcquisitionEngine(digitizer, poll_interval=0.01) as engine:
+        engine.acquire(lambda waveforms: None, n_events, label='(benchmark)')
+        engine.join()
+
+
+# name: (function, max events x channels x samples processed, fixed n_channels or None to follow --channels)
+SUITE_STAGES = {
+    'convert_legacy': (stage_convert_legacy, 1e7, None),
+    'convert_event_builder': (stage_convert_event_builder, 5e7, None),
+    'event_builder_add': (stage_event_builder_add, 1e10, None),
+    'event_builder_add_adc': (stage_event_builder_add_adc, 1e10, None),
+    'to_csv': (stage_to_csv, 1e7, None),
+    'read_csv': (stage_read_csv, 1e7, None),
+    'run_format_write': (stage_run_format_write, 2e8, None),
+    'run_format_write_features': (stage_run_format_write_features, 2e8, None),
+    'run_format_write_roi': (stage_run_format_write_roi, 2e8, None),
+    'run_format_read': (stage_run_format_read, 2e8, None),
+    'charge_loop_legacy': (stage_charge_loop_legacy, 3e6, 1),
+    'charge_vectorized': (stage_charge_vectorized, 1e10, 1),
+    'polling_loop': (stage_polling_loop, 1e8, 8),
+}
+
+
+def run_stage(function, block, n_events, workdir, measure_memory=True):
+    """Time one stage, then run it again under tracemalloc for its peak memory."""
+    start_time = time.perf_counter()
+    n_bytes = function(block, n_events, workdir)
+    seconds = time.perf_counter() - start_time
+    peak_MB = None
+    if measure_memory:
+        tracemalloc.start()
+        function(block, n_events, workdir)
+        peak_MB = tracemalloc.get_traced_memory()[1]/1e6
+        tracemalloc.stop()
+    if n_bytes is None:
+        n_bytes = n_events*len(block[0])*RECORD_LENGTH*8 #float64 samples handled in memory
+    return {'seconds': seconds, 'events_per_s': n_events/seconds, 'MB_per_s': n_bytes/1e6/seconds, 'peak_MB': peak_MB}
+
+
+def run_suite(sizes=SUITE_SIZES, channels=SUITE_CHANNELS, stages=None, measure_memory=True):
+    stages = list(SUITE_STAGES) if stages is None else stages
+    results = []
+    blocks = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for suite_channels in channels:
+            for n_events in sizes:
+                for stage in stages:
+                    function, max_samples, n_channels = SUITE_STAGES[stage]
+                    if n_channels is None:
+                        n_channels = suite_channels
+                    elif suite_channels != channels[0]:
+                        continue #runs once per size, at its own channel count
+                    if n_channels not in blocks:
+                        blocks[n_channels] = make_waveforms(BLOCK_EVENTS, n_channels, RECORD_LENGTH)
+                    block = blocks[n_channels]
+                    if n_events*n_channels*RECORD_LENGTH > max_samples:
+                        print(f'{stage:>22} {n_events:>8} events x {n_channels} ch: skipped (too large for this stage)')
+                        continue
+                    result = {'stage': stage, 'n_events': n_events, 'n_channels': n_channels}
+                    result.update(run_stage(function, block, n_events, workdir, measure_memory))
+                    results.append(result)
+                    peak = f"{result['peak_MB']:8.1f} MB peak" if result['peak_MB'] is not None else ''
+                    print(f"{stage:>22} {n_events:>8} events x {n_channels} ch: {result['events_per_s']:10.0f} events/s "
+                          f"{result['MB_per_s']:8.1f} MB/s {peak}")
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    """
+    Return the results that are more than `tolerance` slower, or use more than
+    `tolerance` more peak memory, than the matching baseline entry.
+    """
+    reference = {(r['stage'], r['n_events'], r['n_channels']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        key = (result['stage'], result['n_events'], result['n_channels'])
+        if key not in reference:
+            continue
+        old = reference[key]
+        slower = result['events_per_s'] < old['events_per_s']*(1 - tolerance)
+        bigger = (result['peak_MB'] is not None and old.get('peak_MB') is not None
+                  and result['peak_MB'] > old['peak_MB']*(1 + tolerance) + 1)
+        if slower or bigger:
+            regressions.append((result, old))
+    return regressions
+
+
+def missing_from_baseline(results, baseline):
+    """The results that compare_to_baseline() cannot check because the baseline has no matching entry."""
+    reference = {(r['stage'], r['n_events'], r['n_channels']) for r in baseline['results']}
+    return [result for result in results if (result['stage'], result['n_events'], result['n_channels']) not in reference]
+
+
+def suite(sizes=SUITE_SIZES, channels=SUITE_CHANNELS, stages=None, output='benchmark_results.json',
+          baseline=BASELINE_FILE, update_baseline=False, tolerance=0.25, memory=True):
+    """
+    Run the benchmark suite, save the results as JSON and compare them with
+    the stored baseline. Returns False if any stage regressed.
+    """
+    results = run_suite(sizes, channels, stages, memory)
+    report = {'meta': {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'platform': platform.platform(),
+                       'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__},
+              'results': results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'Results saved to {output}')
+
+    if update_baseline:
+        with open(baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f'Baseline updated: {baseline}')
+        return True
+    if not os.path.exists(baseline):
+        print(f'No baseline found at {baseline}, run with --update-baseline to create one.')
+        return True
+
+    with open(baseline) as f:
+        reference = json.load(f)
+    regressions = compare_to_baseline(results, reference, tolerance)
+    missing = missing_from_baseline(results, reference)
+    for result in missing:
+        print(f"NO BASELINE {result['stage']} {result['n_events']} events x {result['n_channels']} ch: not checked, "
+              f"run with --update-baseline to add it")
+    for result, old in regressions:
+        print(f"REGRESSION {result['stage']} {result['n_events']} events x {result['n_channels']} ch: "
+              f"{result['events_per_s']:.0f} events/s (baseline {old['events_per_s']:.0f}), "
+              f"peak {result['peak_MB']} MB (baseline {old.get('peak_MB')} MB)")
+    if len(regressions) == 0:
+        print(f'No regressions against {baseline}' + (f', {len(missing)} result(s) had no baseline.' if len(missing) > 0 else '.'))
+    return len(regressions) == 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        benchmark_event_builder()
+        benchmark_charge()
+    elif sys.argv[1] == 'event_builder' and len(sys.argv) == 4:
+        args = sys.argv[2:]
+        benchmark_event_builder(n_events=int(args[0]), n_channels=int(args[1]))
+    elif sys.argv[1] == 'charge' and len(sys.argv) == 3:
+        benchmark_charge(n_events=int(sys.argv[2]))
+    elif sys.argv[1] == 'suite':
+        args, options = split_args(sys.argv[2:])
+        for key in ('sizes', 'channels', 'stages'):
+            if key in options:
+                options[key] = [int(float(value)) if key != 'stages' else value for value in str(options[key]).split(',')]
+        sys.exit(0 if suite(**options) else 1)
+    elif sys.argv[1] == 'acquisition' and len(sys.argv) == 4:
+        benchmark_acquisition(trigger_rate_Hz=float(sys.argv[2]), duration=float(sys.argv[3]))
+    else:
+        print('Please pass "event_builder <n_events> <n_channels>", "charge <n_events>", '
+              '"acquisition <trigger_rate_Hz> <duration_s>", "suite [--options]", or nothing for the defaults.')
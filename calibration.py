@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:46:19 2026
+
+@author: danielvalmassei
+
+Unattended replacement for the interactive part of self_trigger_setup.py:
+bisect the Ch.0 DC offset until the baseline sits in TARGET_ADC, measure the
+pedestal noise from software-triggered events, set the self trigger threshold
+(0x1080) to baseline - n_sigma*noise and save both in a profile that
+`HV_scan.py --profile=calibration.json` loads.
+"""
+
+import json
+import sys
+import time
+import numpy as np
+from ctypes import CDLL
+from hardware import open_hv_supply, open_digitizer, send_sw_trigger
+from config_digitizer import configure_digitizer
+from registers import configure_self_trigger
+from acquisition import split_args
+from analysis import PEDESTAL_WINDOW
+
+TARGET_ADC = (3100, 3900) #upper 25% of the 12 bit range, room for negative pulses
+DC_OFFSET_LIMITS = (-0.5, 0.5) #V
+ADC_COUNTS = 4096
+
+
+def to_adc(amplitudes):
+    return (np.asarray(amplitudes) + 0.5)*ADC_COUNTS
+
+
+def acquire_sw_triggered(digitizer, n_events, libCAENDigitizer=None, channel='CH0', settle_time=0.5, timeout=10):
+    """(n_events, record_length) amplitudes in V of `channel` from software triggers."""
+    waveforms = []
+    with digitizer:
+        time.sleep(settle_time) #let the DC offset DAC settle
+        for _ in range(n_events):
+            send_sw_trigger(digitizer, libCAENDigitizer)
+            time.sleep(0.001)
+        start_time = time.time()
+        while len(waveforms) < n_events and time.time() - start_time < timeout:
+            time.sleep(0.01)
+            waveforms += digitizer.get_waveforms()
+    if len(waveforms) == 0:
+        raise RuntimeError('Could not acquire any event with the software trigger.')
+    return np.stack([event_waveforms[channel]['Amplitude (V)'] for event_waveforms in waveforms[:n_events]])
+
+
+def pedestal(amplitudes):
+    """Mean baseline and sample noise (std around each event's own baseline) in ADC counts."""
+    samples = to_adc(amplitudes)[:, PEDESTAL_WINDOW[0]:PEDESTAL_WINDOW[1]]
+    return float(np.mean(samples)), float(np.std(samples - samples.mean(axis=1, keepdims=True)))
+
+
+def bisect_dc_offset(digitizer, target_adc=TARGET_ADC, limits=DC_OFFSET_LIMITS, n_events=10, max_iterations=12,
+                     libCAENDigitizer=None):
+    """
+    Find a Ch.0 DC offset that puts the baseline inside target_adc. The
+    baseline only has to be monotonic in the offset, in either direction.
+    Returns (dc_offset, baseline in ADC counts).
+    """
+    def measure(dc_offset):
+        digitizer.set_channel_DC_offset(channel=0, V=dc_offset)
+        baseline = pedestal(acquire_sw_triggered(digitizer, n_events, libCAENDigitizer))[0]
+        print(f'DC offset {dc_offset:+.4f} V: baseline at {baseline:.0f} ADC')
+        return baseline
+
+    target = np.mean(target_adc)
+    low, high = limits
+    baseline_low = measure(low)
+    baseline_high = measure(high)
+    if (baseline_low - target)*(baseline_high - target) > 0:
+        raise RuntimeError(f'The baseline stays between {baseline_low:.0f} and {baseline_high:.0f} ADC over DC offsets '
+                           f'{limits} V and cannot reach {target_adc}.')
+    for _ in range(max_iterations):
+        middle = (low + high)/2
+        baseline = measure(middle)
+        if target_adc[0] <= baseline <= target_adc[1]:
+            return middle, baseline
+        if (baseline - target)*(baseline_low - target) > 0:
+            low, baseline_low = middle, baseline
+        else:
+            high = middle
+    raise RuntimeError(f'DC offset bisection did not reach {target_adc} in {max_iterations} iterations.')
+
+
+def calibrate(digitizer, registers, n_events=100, n_sigma=2, target_adc=TARGET_ADC, libCAENDigitizer=None):
+    """
+    Bisect the DC offset, measure the pedestal noise in transparent mode and
+    write the self trigger threshold. Returns the profile as a dict.
+    """
+    registers.set_field('ch0_self_trigger', 0) #software triggers only while calibrating
+    registers.set_field('transparent_mode', 0)
+    registers.commit()
+    dc_offset, _ = bisect_dc_offset(digitizer, target_adc, libCAENDigitizer=libCAENDigitizer)
+
+    registers.set_field('transparent_mode', 1)
+    registers.commit()
+    baseline, noise = pedestal(acquire_sw_triggered(digitizer, n_events, libCAENDigitizer))
+    threshold = int(baseline - n_sigma*noise)
+    print(f'Baseline {baseline:.1f} ADC, noise {noise:.2f} ADC, self trigger threshold {threshold}.')
+
+    configure_self_trigger(registers, threshold, transparent_mode=False)
+    registers.commit()
+    return {'dc_offset': dc_offset, 'self_trigger_threshold': threshold, 'baseline_adc': baseline,
+            'noise_adc': noise, 'n_sigma': n_sigma, 'n_events': n_events, 'digitizer': digitizer.idn,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def save_profile(profile, filename='calibration.json'):
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=1)
+
+
+def load_profile(filename='calibration.json'):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def main(profile='calibration.json', backend='real', HV=None, n_events=100, n_sigma=2):
+    libCAENDigitizer = CDLL('/usr/lib/libCAENDigitizer.so') if backend == 'real' else None
+    hv_supply = None
+    if HV is not None: #calibrate with the PMT under voltage
+        hv_supply = open_hv_supply(backend, port='/dev/ttyACM0')
+        print('HV connected with:', hv_supply.idn)
+        hv_supply.send_command('SET','ON',CH=0)
+        hv_supply.channels[0].ramp_voltage(HV, ramp_speed_VperSec=50, timeout=HV/50 + 30)
+    digitizer = open_digitizer(backend, LinkNum=0, hv_supply=hv_supply)
+    registers = configure_digitizer(digitizer)
+    try:
+        result = calibrate(digitizer, registers, int(n_events), n_sigma, libCAENDigitizer=libCAENDigitizer)
+        save_profile(result, profile)
+        print(f'Calibration saved to {profile}: DC offset {result["dc_offset"]:.4f} V, threshold {result["self_trigger_threshold"]}.')
+    finally:
+        if hv_supply is not None:
+            hv_supply.channels[0].ramp_voltage(0, ramp_speed_VperSec=50, timeout=HV/50 + 30)
+
+
+if __name__ == '__main__':
+    args, options = split_args(sys.argv[1:])
+    main(**options)
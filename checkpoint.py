@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:29:37 2026
+
+@author: danielvalmassei
+
+Scan checkpoints. Next to the run file (out.h5.scan.json) a scan keeps its
+settings and the steps completed so far, with their voltages and event
+counts. A step is recorded only after all its batches have been written and
+the run file has been flushed, so after a crash, serial glitch or Ctrl-C the
+scan can be continued from the first incomplete step with `--resume`.
+"""
+
+import json
+import os
+import time
+
+CHECKPOINT_SUFFIX = '.scan.json'
+
+
+def checkpoint_filename(output):
+    return output + CHECKPOINT_SUFFIX
+
+
+def _to_json(value):
+    # numpy scalars and arrays in the settings
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+class ScanCheckpoint:
+    """Settings and completed steps of the scan written to `output`, saved after every change."""
+
+    def __init__(self, output, settings, steps=None, finished=False, created=None):
+        self.output = output
+        self.filename = checkpoint_filename(output)
+        self.settings = settings
+        self.steps = [] if steps is None else steps
+        self.finished = finished
+        self.created = time.time() if created is None else created
+
+    @classmethod
+    def load(cls, output):
+        """Checkpoint of an earlier scan, FileNotFoundError if it was taken without one."""
+        with open(checkpoint_filename(output)) as f:
+            state = json.load(f)
+        return cls(output, state['settings'], state['steps'], state['finished'], state['created'])
+
+    @property
+    def n_completed(self):
+        return len(self.steps)
+
+    def save(self):
+        state = {'output': os.path.basename(self.output), 'created': self.created, 'updated': time.time(),
+                 'finished': self.finished, 'settings': self.settings, 'steps': self.steps}
+        # write and rename, so a crash never leaves half a checkpoint
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(state, f, indent=1, default=_to_json)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def complete_step(self, step, voltage, n_events, writer=None):
+        """
+        Record a completed step. Submit it to the acquisition engine after the
+        step's last batch, so `writer` (flushed first) already holds its data.
+        """
+        if writer is not None:
+            writer.flush()
+        self.steps.append({'step': int(step), 'voltage': float(voltage), 'n_events': int(n_events), 'time': time.time()})
+        self.save()
+
+    def finish(self):
+        self.finished = True
+        self.save()
@@ -6,14 +6,17 @@ Created on Wed Jul 23 13:36:31 2025
 @author: danielvalmassei
 """
 
-from CAENpy.CAENDigitizer import CAEN_DT5742_Digitizer
-from CAENpy.CAENDesktopHighVoltagePowerSupply import CAENDesktopHighVoltagePowerSupply
-from ctypes import CDLL
-import pandas as pd
+from hardware import open_digitizer
 import numpy as np
 import time
-from HV_scan_smaller_data import edit_bit, configure_digitizer
-import matplotlib.pyplot as plt
+from config_digitizer import configure_digitizer
+from event_builder import build_data_frame
+from run_format import RunWriter, export_csv
+from acquisition import AcquisitionEngine, ReadoutScheduler, split_args
+from metrics import AcquisitionMetrics
+from functools import partial
+import sys
+import os
 
 
 def check_error_code(code):
@@ -21,18 +24,10 @@ def check_error_code(code):
         raise RuntimeError(f'libCAENDigitizer has returned error code {code}.')
     
 def convert_dicitonaries_to_data_frame(waveforms:dict,channels):
-    data = []
-    for n_event,event_waveforms in enumerate(waveforms):
-        for n_channel in channels:
-            df = pd.DataFrame(event_waveforms[f'CH{n_channel}'])
-            df['n_event'] = n_event
-            df['n_channel'] = n_channel
-            df.set_index(['n_event','n_channel'], inplace=True)
-            data.append(df)
-            
-            return pd.concat(data)
+    return build_data_frame(waveforms, channels=[f'CH{n_channel}' for n_channel in channels]).drop(columns='voltage')
         
-def main():
+def main(output='out.h5', csv=False, queue_size=8, backend='real', metrics=None,
+         poll_interval=None, poll_min=0.01, poll_max=1.0, occupancy_low=0.25, occupancy_high=0.5, adc=True):
     channels = [0,1]
     dc_offset = [-0.3,-0.3]
     n_events = 10000
@@ -40,59 +35,50 @@ def main():
     #libCAENDigitizer = CDLL('/usr/lib/libCAENDigitizer.so')
     
     ########## setup ##########
-    digitizer = CAEN_DT5742_Digitizer(LinkNum=0)
-    configure_digitizer(digitizer)
-    digitizer.set_fast_trigger_mode(enabled=True)
-    digitizer.set_fast_trigger_threshold(22222)
-    digitizer.set_fast_trigger_DC_offset(V=0)
+    digitizer = open_digitizer(backend, LinkNum=0) #backend='sim' for a simulated digitizer
+    registers = configure_digitizer(digitizer, fast_trigger=True)
     for i in range(len(channels)):
         digitizer.set_channel_DC_offset(channel=channels[i],V=dc_offset[i])
 
     
     ########## Output Mode ##########
-    old_0x8000_value = digitizer.read_register(0X8000)
-    print(f'Old value of register 0x8000: {old_0x8000_value:08X}')
-    new_0x8000_value = edit_bit(old_0x8000_value, 13, set_bit=False)
-    print(f'Writing {new_0x8000_value:08X} at register 0x8000.')
-    digitizer.write_register(0x8000, new_0x8000_value)
-    print(f'0x8000 now: {digitizer.read_register(0x8000):08X} ')
+    registers.set_field('transparent_mode', 0)
+    registers.commit()
     print('Ready for externally triggered acquisition in Output Mode')
     digitizer.set_max_num_events_BLT(1024) # Override the maximum number of events to be stored in the digitizer's self buffer.
 
 
     ########## Acquisition ##########
-    collected_events = 0
-    data = pd.DataFrame() #Pandas DataFrame
-    
-    
     time.sleep(0.1)
-    data = []
-    
-    temp_data = [] #List of dict
+    run_metrics = AcquisitionMetrics(metrics, buffer_size=1024, run=os.path.basename(output))
+    run_metrics.begin_step(0, np.nan)
+    writer = RunWriter(output, channels=[f'CH{n_channel}' for n_channel in channels], dc_offset=dc_offset,
+                       sampling_frequency_MHz=2500, record_length=1024, n_events=n_events, metrics=run_metrics, adc=adc)
+    writer.begin_step(np.nan)
     start_time = time.time()
     print(f'Start: {start_time}')
-    collected_events = 0
+    #poll_interval=None adapts the polling to the trigger rate, a number keeps it fixed
+    scheduler = ReadoutScheduler(1024, (occupancy_low, occupancy_high), poll_min, poll_max) if poll_interval is None else None
+    engine = AcquisitionEngine(digitizer, queue_size=queue_size, metrics=run_metrics, scheduler=scheduler,
+                               poll_interval=poll_interval if poll_interval is not None else 0.5)
+    engine.start()
     try:
-        with digitizer:
-            print('Digitizer is enabled!')
-            while collected_events < n_events:
-                time.sleep(0.5) #ask for data every ~500 ms
-                wf = digitizer.get_waveforms()
-                collected_events += len(wf)
-                print(f'acquired {collected_events} of {n_events}...')
-                temp_data += wf
-                
+        #the readout only queues batches, a worker thread converts and writes them
+        collected_events = engine.acquire(partial(writer.append_waveforms, voltage=np.nan), n_events)
         print(f'Stop: {time.time()}')
-        print('Digitizer Closed. Now converting dictionaries to DataFrame...')
-        temp_data = convert_dicitonaries_to_data_frame(temp_data,channels)
-        print('Appending lists...')
-        data.append(temp_data)
     
     finally:
-        ########## Save the data to a file ##########
-        print('Saving df as .csv')
-        
-        data.to_csv('out.csv')
+        ########## Close the run file ##########
+        engine.stop()
+        print(engine.stats)
+        run_metrics.end_step(0)
+        run_metrics.close()
+        writer.close()
+        print(f'Run saved to {output}')
+        if csv:
+            print('Exporting run as .csv')
+            export_csv(output, 'out.csv')
         
 if __name__ =='__main__':
-    main()
+    args, options = split_args(sys.argv[1:])
+    main(**options)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:12:40 2026
+
+@author: danielvalmassei
+"""
+
+import numpy as np
+import pandas as pd
+
+# DT5742: 12 bit ADC over 1 Vpp, ADC count 0 at -0.5 V
+ADC_BITS = 12
+VOLTS_PER_COUNT = 1/2**ADC_BITS
+VOLTS_OFFSET = -0.5
+ADC_BLOCK_EVENTS = 32 #events converted to ADC counts at a time
+
+
+def to_counts(amplitudes, volts_per_count=VOLTS_PER_COUNT, volts_offset=VOLTS_OFFSET):
+    """Amplitudes in V -> uint16 ADC counts, exact for samples that came from the ADC."""
+    counts = np.rint((np.asarray(amplitudes) - volts_offset)/volts_per_count)
+    return np.clip(counts, 0, 2**ADC_BITS - 1).astype(np.uint16)
+
+
+def to_volts(counts, volts_per_count=VOLTS_PER_COUNT, volts_offset=VOLTS_OFFSET):
+    return counts*volts_per_count + volts_offset
+
+
+def sample_times(record_length, sampling_period):
+    return np.arange(record_length)*sampling_period
+
+
+class EventBuilder:
+    """
+    Collect the list of dicts returned by digitizer.get_waveforms() into a
+    preallocated (n_events, n_channels, record_length) array.
+
+    Per-event metadata (voltage and event number) is kept in side arrays and a
+    DataFrame in the same layout as convert_dicitonaries_to_data_frame is only
+    built when to_data_frame() is called.
+
+    With an integer dtype (np.uint16) the samples are kept as raw ADC counts,
+    a quarter of the memory of float64. `counts` is then the stored array and
+    `amplitudes` the volts, computed on first use after every add(); `time`
+    is rebuilt from sampling_period when given.
+    """
+
+    def __init__(self, n_events, channels=('CH0',), record_length=1024, dtype=np.float64,
+                 volts_per_count=VOLTS_PER_COUNT, volts_offset=VOLTS_OFFSET, sampling_period=None):
+        self.channels = list(channels)
+        self.record_length = record_length
+        self.n_events = 0
+        self.volts_per_count = volts_per_count
+        self.volts_offset = volts_offset
+        self.sampling_period = sampling_period
+        self._time = None
+        self._volts = None
+        self.max_quantization_error = 0.0 #largest |V - V(counts)| seen by add(), in V
+        self._scratch = None
+        self._amplitudes = np.empty((max(int(n_events), 1), len(self.channels), record_length), dtype=dtype)
+        self._voltage = np.empty(self._amplitudes.shape[0])
+        self._n_event = np.empty(self._amplitudes.shape[0], dtype=np.int64)
+        self._events_at_voltage = {}
+
+    @classmethod
+    def from_arrays(cls, amplitudes, time, voltage=np.nan, channels=('CH0',), first_n_event=0, n_event=None, **calibration):
+        """
+        Wrap an existing (n_events, n_channels, record_length) array, e.g. one
+        step read back from a run file. Events are numbered from first_n_event,
+        or by the n_event array if given.
+        ADC counts need the volts_per_count, volts_offset and sampling_period
+        of the run as keyword arguments.
+        """
+        builder = cls(0, channels, amplitudes.shape[-1], amplitudes.dtype, **calibration)
+        builder._amplitudes = amplitudes
+        builder._voltage = np.full(amplitudes.shape[0], voltage, dtype=np.float64)
+        if n_event is None:
+            builder._n_event = np.arange(first_n_event, first_n_event + amplitudes.shape[0])
+        else:
+            builder._n_event = np.asarray(n_event, dtype=np.int64)
+        builder._events_at_voltage = {voltage: int(builder._n_event[-1]) + 1 if len(builder._n_event) > 0 else first_n_event}
+        builder.n_events = amplitudes.shape[0]
+        builder.time = np.asarray(time, dtype=np.float64) if time is not None else None
+        return builder
+
+    @property
+    def adc(self):
+        """True if the samples are stored as ADC counts."""
+        return np.issubdtype(self._amplitudes.dtype, np.integer)
+
+    @property
+    def time(self):
+        if self._time is None and self.sampling_period is not None:
+            self._time = sample_times(self.record_length, self.sampling_period)
+        return self._time
+
+    @time.setter
+    def time(self, time):
+        self._time = time
+
+    def _grow(self, n_needed):
+        capacity = self._amplitudes.shape[0]
+        while capacity < n_needed:
+            capacity *= 2
+        amplitudes = np.empty((capacity,) + self._amplitudes.shape[1:], dtype=self._amplitudes.dtype)
+        amplitudes[:self.n_events] = self._amplitudes[:self.n_events]
+        self._amplitudes = amplitudes
+        self._voltage = np.resize(self._voltage, capacity)
+        self._n_event = np.resize(self._n_event, capacity)
+
+    def add(self, waveforms, voltage=np.nan):
+        """
+        Append one get_waveforms() batch taken at `voltage`. Event numbers
+        continue from the events already added at the same voltage.
+        """
+        n_new = len(waveforms)
+        if n_new == 0:
+            return
+        if self.n_events + n_new > self._amplitudes.shape[0]:
+            self._grow(self.n_events + n_new)
+        if self.time is None:
+            time = np.asarray(waveforms[0][self.channels[0]]['Time (s)'], dtype=np.float64)
+            if self.adc and len(time) > 1:
+                self.sampling_period = float(time[1] - time[0]) #same time axis as the run read back
+            else:
+                self.time = time
+
+        start = self.n_events
+        if not self.adc:
+            for n_event, event_waveforms in enumerate(waveforms, start):
+                for n_channel, channel in enumerate(self.channels):
+                    self._amplitudes[n_event, n_channel] = event_waveforms[channel]['Amplitude (V)']
+        else:
+            # converted ADC_BLOCK_EVENTS events at a time, through reused float buffers
+            if self._scratch is None:
+                self._scratch = np.empty((2, ADC_BLOCK_EVENTS) + self._amplitudes.shape[1:])
+            for block_start in range(0, n_new, ADC_BLOCK_EVENTS):
+                block = waveforms[block_start:block_start + ADC_BLOCK_EVENTS]
+                samples, counts = self._scratch[0, :len(block)], self._scratch[1, :len(block)]
+                for n_event, event_waveforms in enumerate(block):
+                    for n_channel, channel in enumerate(self.channels):
+                        samples[n_event, n_channel] = event_waveforms[channel]['Amplitude (V)']
+                samples -= self.volts_offset
+                samples /= self.volts_per_count
+                np.rint(samples, out=counts)
+                np.clip(counts, 0, 2**ADC_BITS - 1, out=counts)
+                self._amplitudes[start + block_start:start + block_start + len(block)] = counts
+                np.subtract(samples, counts, out=samples)
+                error = float(np.max(np.abs(samples, out=samples)))*self.volts_per_count
+                self.max_quantization_error = max(self.max_quantization_error, error)
+        self._volts = None
+
+        first_n_event = self._events_at_voltage.get(voltage, 0)
+        self._voltage[start:start + n_new] = voltage
+        self._n_event[start:start + n_new] = np.arange(first_n_event, first_n_event + n_new)
+        self._events_at_voltage[voltage] = first_n_event + n_new
+        self.n_events += n_new
+
+    def clear(self):
+        """
+        Forget the buffered events but keep the allocated buffers and the event
+        numbering, so a builder can be reused batch by batch while streaming.
+        """
+        self.n_events = 0
+        self._volts = None
+
+    @property
+    def counts(self):
+        """Stored samples: ADC counts for an integer dtype, otherwise volts."""
+        return self._amplitudes[:self.n_events]
+
+    @property
+    def amplitudes(self):
+        """Samples in V."""
+        if not self.adc:
+            return self._amplitudes[:self.n_events]
+        if self._volts is None:
+            self._volts = to_volts(self._amplitudes[:self.n_events], self.volts_per_count, self.volts_offset)
+        return self._volts
+
+    @property
+    def voltage(self):
+        return self._voltage[:self.n_events]
+
+    @property
+    def n_event(self):
+        return self._n_event[:self.n_events]
+
+    def to_data_frame(self):
+        """
+        Build the long-format DataFrame indexed by (n_event, n_channel) with
+        'Time (s)', 'Amplitude (V)' and 'voltage' columns.
+        """
+        n_channels = len(self.channels)
+        samples_per_event = n_channels*self.record_length
+        index = pd.MultiIndex.from_arrays(
+            [np.repeat(self.n_event, samples_per_event),
+             np.tile(np.repeat(np.array(self.channels, dtype=object), self.record_length), self.n_events)],
+            names=['n_event', 'n_channel'])
+        time = self.time if self.time is not None else np.empty(self.record_length)
+        return pd.DataFrame({
+            'Time (s)': np.tile(time, self.n_events*n_channels),
+            'Amplitude (V)': self.amplitudes.reshape(-1),
+            'voltage': np.repeat(self.voltage, samples_per_event),
+            }, index=index)
+
+
+def build_data_frame(waveforms, voltage=np.nan, channels=None):
+    """
+    Convert one list of get_waveforms() dicts straight to a DataFrame. If
+    `channels` is None every channel found in the first event is kept.
+    """
+    if len(waveforms) == 0:
+        return pd.DataFrame()
+    if channels is None:
+        channels = list(waveforms[0])
+    record_length = len(waveforms[0][channels[0]]['Amplitude (V)'])
+    builder = EventBuilder(len(waveforms), channels, record_length)
+    builder.add(waveforms, voltage)
+    return builder.to_data_frame()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:12:49 2026
+
+@author: danielvalmassei
+
+Per-event features of the PMT pulses (pedestal, charge, peak amplitude and
+peak time), extracted from whole get_waveforms() batches at once. A gain
+curve only needs these, so the scan scripts can store them instead of the
+waveforms (see RunWriter.append_features()).
+"""
+
+import numpy as np
+from event_builder import to_volts
+
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz #np.trapz was renamed in numpy 2.0
+
+ELEMENTARY_CHARGE = 1.602*10**(-19)
+PEDESTAL_WINDOW = (10, 210) #samples used to estimate the pedestal of each event
+
+# one row per event and channel
+FEATURE_DTYPE = np.dtype([('n_event', '<i8'),
+                          ('pedestal', '<f4'), #V
+                          ('charge', '<f8'), #electron charges, as analysis.compute_charges()
+                          ('peak_amplitude', '<f4'), #V below the pedestal
+                          ('peak_time', '<f4')]) #s
+
+
+def extract_features(amplitudes, time, n_event=None, pedestal_window=PEDESTAL_WINDOW, calibration=None):
+    """
+    (n_events, n_channels) FEATURE_DTYPE array of an (n_events, n_channels,
+    record_length) amplitude array in V, or of ADC counts with calibration =
+    (volts_per_count, volts_offset). The charge is computed exactly as
+    analysis.compute_charges() does, so both give the same gain.
+    """
+    n_events, n_channels, _ = amplitudes.shape
+    features = np.empty((n_events, n_channels), dtype=FEATURE_DTYPE)
+    features['n_event'] = np.arange(n_events)[:, None] if n_event is None else np.asarray(n_event)[:, None]
+    # one channel at a time keeps the temporaries at one channel of the batch
+    for n_channel in range(n_channels):
+        channel_amplitudes = np.ascontiguousarray(amplitudes[:, n_channel, :]) #same summation order as compute_charges()
+        if calibration is not None:
+            channel_amplitudes = to_volts(channel_amplitudes, *calibration)
+        pedestal = np.mean(channel_amplitudes[:, pedestal_window[0]:pedestal_window[1]], axis=1, keepdims=True)
+        pedestal_corrected_amps = -(channel_amplitudes - pedestal)
+        peak = np.argmax(pedestal_corrected_amps, axis=1)
+        features['pedestal'][:, n_channel] = pedestal[:, 0]
+        features['charge'][:, n_channel] = trapezoid(pedestal_corrected_amps, time, axis=-1)/(50*ELEMENTARY_CHARGE)
+        features['peak_amplitude'][:, n_channel] = pedestal_corrected_amps[np.arange(n_events), peak]
+        features['peak_time'][:, n_channel] = time[peak]
+    return features
+
+
+def parse_window(window):
+    """(first, last) sample window from a tuple or a 'first,last' string as given on the command line."""
+    if isinstance(window, str):
+        window = window.split(',')
+    first, last = (int(float(sample)) for sample in window)
+    return first, last
+
+
+class RegionOfInterest:
+    """
+    Samples kept per event and channel in region-of-interest mode: the
+    pedestal window and a signal window of signal_window = (first, last)
+    samples around the peak of the event, or around trigger_sample if given
+    (the pulse then sits at a fixed position in the record). With a
+    zero-suppression threshold (V below the pedestal) channels whose signal
+    window does not reach it are dropped.
+    """
+
+    def __init__(self, signal_window=(-50, 150), trigger_sample=None, pedestal_window=PEDESTAL_WINDOW, threshold=None):
+        self.signal_window = parse_window(signal_window)
+        self.trigger_sample = None if trigger_sample is None else int(trigger_sample)
+        self.pedestal_window = parse_window(pedestal_window)
+        self.threshold = threshold
+        if self.signal_window[1] <= self.signal_window[0]:
+            raise ValueError(f'Empty signal window {self.signal_window}.')
+
+    @property
+    def n_pedestal(self):
+        return self.pedestal_window[1] - self.pedestal_window[0]
+
+    @property
+    def n_signal(self):
+        return self.signal_window[1] - self.signal_window[0]
+
+    def attrs(self):
+        """Settings stored with the run, trigger sample -1 for a window around the peak."""
+        return {'roi_pedestal_window': self.pedestal_window, 'roi_signal_window': self.signal_window,
+                'roi_trigger_sample': -1 if self.trigger_sample is None else self.trigger_sample,
+                'roi_threshold': np.nan if self.threshold is None else self.threshold}
+
+    def select(self, samples, volts_per_count=None):
+        """
+        Cut an (n_events, n_channels, record_length) array of volts, or of ADC
+        counts with their volts_per_count, down to the region of interest.
+        Returns (n_events, n_channels, n_pedestal + n_signal) samples of the
+        same dtype, the first sample of every signal window and the
+        (n_events, n_channels) mask of channels above the threshold.
+        """
+        n_events, n_channels, record_length = samples.shape
+        if self.pedestal_window[1] > record_length or self.n_signal > record_length:
+            raise ValueError(f'Region of interest does not fit in a record of {record_length} samples.')
+        # ADC counts grow with the voltage, so pulses are negative in both units
+        threshold = self.threshold if volts_per_count is None or self.threshold is None else self.threshold/volts_per_count
+        roi = np.empty((n_events, n_channels, self.n_pedestal + self.n_signal), dtype=samples.dtype)
+        start = np.empty((n_events, n_channels), dtype=np.int16)
+        keep = np.ones((n_events, n_channels), dtype=bool)
+        # one channel at a time keeps the temporaries at one channel of the batch
+        for n_channel in range(n_channels):
+            channel_samples = samples[:, n_channel, :]
+            pedestal = np.mean(channel_samples[:, self.pedestal_window[0]:self.pedestal_window[1]], axis=1, keepdims=True)
+            if self.trigger_sample is None:
+                reference = np.argmax(pedestal - channel_samples, axis=1)
+            else:
+                reference = np.full(n_events, self.trigger_sample)
+            start[:, n_channel] = np.clip(reference + self.signal_window[0], 0, record_length - self.n_signal)
+            signal = np.take_along_axis(channel_samples, start[:, n_channel, None] + np.arange(self.n_signal), axis=1)
+            roi[:, n_channel, :self.n_pedestal] = channel_samples[:, self.pedestal_window[0]:self.pedestal_window[1]]
+            roi[:, n_channel, self.n_pedestal:] = signal
+            if threshold is not None:
+                keep[:, n_channel] = (pedestal[:, 0] - signal.min(axis=1)) >= threshold
+        return roi, start, keep
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:05:21 2026
+
+@author: danielvalmassei
+
+Backend selector: backend='real' opens the CAENpy devices, backend='sim' the
+simulated ones from simulated_hardware.py. CAENpy is only needed for 'real'.
+"""
+
+import time
+from ctypes import CDLL
+from simulated_hardware import SimulatedDT1470, SimulatedDT5742Digitizer
+
+try:
+    from CAENpy.CAENDigitizer import CAEN_DT5742_Digitizer
+    from CAENpy.CAENDesktopHighVoltagePowerSupply import CAENDesktopHighVoltagePowerSupply
+except ImportError: #only the simulated backend is available
+    CAEN_DT5742_Digitizer = None
+    CAENDesktopHighVoltagePowerSupply = None
+
+BACKENDS = ('real', 'sim')
+
+
+def _check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend!r}, choose one of {BACKENDS}.')
+    if backend == 'real' and CAEN_DT5742_Digitizer is None:
+        raise RuntimeError('CAENpy is not installed, only backend="sim" is available.')
+
+
+def open_hv_supply(backend='real', port='/dev/ttyACM0', **sim_options):
+    _check_backend(backend)
+    if backend == 'sim':
+        return SimulatedDT1470(port=port, **sim_options)
+    return CAENDesktopHighVoltagePowerSupply(port=port)
+
+
+def open_digitizer(backend='real', LinkNum=0, hv_supply=None, **sim_options):
+    """
+    Open the digitizer. The simulated one takes its PMT gain from the HV of
+    `hv_supply` if that is a simulated supply.
+    """
+    _check_backend(backend)
+    if backend == 'sim':
+        if not isinstance(hv_supply, SimulatedDT1470):
+            hv_supply = None
+        return SimulatedDT5742Digitizer(LinkNum=LinkNum, hv_supply=hv_supply, **sim_options)
+    return CAEN_DT5742_Digitizer(LinkNum=LinkNum)
+
+
+def send_sw_trigger(digitizer, libCAENDigitizer=None):
+    """Software trigger, through libCAENDigitizer for the real digitizer."""
+    if isinstance(digitizer, SimulatedDT5742Digitizer):
+        digitizer.send_sw_trigger()
+        return
+    if libCAENDigitizer is None:
+        libCAENDigitizer = CDLL('/usr/lib/libCAENDigitizer.so')
+    code = libCAENDigitizer.CAEN_DGTZ_SendSWtrigger(digitizer._get_handle())
+    if code != 0:
+        raise RuntimeError(f'libCAENDigitizer has returned error code {code}.')
+
+
+def ramp_together(hv_supply, channels, voltage, ramp_speed_VperSec=15, tolerance=1.0, timeout=None, poll_interval=0.2,
+                  hold_time=0.0):
+    """
+    Ramp several HV channels to `voltage` (one value or one per channel) at
+    the same time and wait until every VMON has stayed within `tolerance` V
+    of it for `hold_time` s, so acquisition starts as soon as the HV has
+    settled instead of after a fixed wait. Returns the last VMON readings.
+    """
+    voltages = [voltage]*len(channels) if isinstance(voltage, (int, float)) else list(voltage)
+    for channel, channel_voltage in zip(channels, voltages):
+        hv_supply.send_command('SET', 'RUP', CH=channel, VAL=ramp_speed_VperSec)
+        hv_supply.send_command('SET', 'RDW', CH=channel, VAL=ramp_speed_VperSec)
+        hv_supply.send_command('SET', 'VSET', CH=channel, VAL=channel_voltage)
+        if channel_voltage != 0: #ramping down to 0 V also works on a channel that is already off
+            hv_supply.send_command('SET', 'ON', CH=channel)
+    if timeout is None:
+        timeout = max(abs(v - float(hv_supply.get_single_channel_parameter('VMON', ch))) for ch, v in zip(channels, voltages))/ramp_speed_VperSec + 30 + hold_time
+    start_time = time.time()
+    settled_since = None
+    while True:
+        vmon = [float(hv_supply.get_single_channel_parameter('VMON', channel)) for channel in channels]
+        if all(abs(v - target) <= tolerance for v, target in zip(vmon, voltages)):
+            settled_since = time.time() if settled_since is None else settled_since
+            if time.time() - settled_since >= hold_time:
+                return vmon
+        else:
+            settled_since = None #an overshoot or a glitch restarts the hold time
+        if time.time() - start_time > timeout:
+            raise RuntimeError(f'Timeout while ramping channels {channels} to {voltages} V (VMON {vmon}).')
+        time.sleep(poll_interval)
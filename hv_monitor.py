@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:21:06 2026
+
+@author: danielvalmassei
+
+Background HV monitoring. A thread polls VMON, IMON and the status word of
+every HV channel on its own cadence while the digitizer is read out, so a
+slow serial port never delays get_waveforms(). Readings are timestamped and
+kept until drain()ed; AcquisitionEngine drains them with every batch and
+tags them with the number of the first event of that batch, so the gain of
+every batch can be matched to the HV and current it was taken at.
+
+The serial port is shared with the scan script: hold `lock` while talking
+to the supply yourself (ramps, VSET, ...), the monitor waits for it.
+"""
+
+import threading
+import time
+import numpy as np
+
+# one row per channel and poll
+HV_READING_DTYPE = np.dtype([('time', '<f8'), #s since the epoch
+                             ('n_event', '<i8'), #first event of the batch the reading was drained with
+                             ('channel', '<i2'),
+                             ('VMON', '<f4'), #V
+                             ('IMON', '<f4'), #uA
+                             ('status', '<i4')]) #-1 if it could not be read
+
+# status bits of the CAEN desktop HV supplies (STAT)
+STATUS_BITS = ('ON', 'RUP', 'RDW', 'OVC', 'OVV', 'UNV', 'MAXV', 'TRIP', 'OVP', 'OVT', 'DIS', 'KILL', 'ILK', 'NOCAL')
+ALARM_MASK = sum(1 << STATUS_BITS.index(flag) for flag in ('OVC', 'OVV', 'UNV', 'MAXV', 'TRIP', 'OVP', 'OVT', 'KILL', 'ILK'))
+
+
+def status_flags(status):
+    """Names of the bits set in a status word, e.g. ['ON', 'RUP']."""
+    return [flag for bit, flag in enumerate(STATUS_BITS) if status >= 0 and status & (1 << bit)]
+
+
+class HVMonitor:
+    """
+    Poll `channels` of `hv_supply` every `interval` s on a background thread
+    between start() and stop(). interval=0 starts no thread, poll() then only
+    reads the supply when called.
+    """
+
+    def __init__(self, hv_supply, channels=(0,), interval=1.0):
+        self.hv_supply = hv_supply
+        self.channels = [int(channel) for channel in channels]
+        self.interval = float(interval)
+        self.lock = threading.RLock() #serial port
+        self.n_polls = 0
+        self.n_errors = 0
+        self._readings_lock = threading.Lock()
+        self._readings = []
+        self._latest = None
+        self._alarms = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e: #a serial glitch must not end the monitoring
+                self.n_errors += 1
+                if self.n_errors <= 3:
+                    print(f'HV monitor: reading the supply failed ({e}).')
+
+    def _read(self, parameter, channel, cast=float):
+        try:
+            return cast(float(self.hv_supply.get_single_channel_parameter(parameter, channel)))
+        except (ValueError, TypeError):
+            return cast(-1) if cast is int else np.nan
+
+    def poll(self):
+        """Read every channel now, store the readings and return them as latest() does."""
+        rows = []
+        with self.lock:
+            for channel in self.channels:
+                rows.append((time.time(), 0, channel, self._read('VMON', channel), self._read('IMON', channel),
+                             self._read('STAT', channel, int)))
+        for _, _, channel, vmon, imon, status in rows:
+            alarm = status & ALARM_MASK if status >= 0 else 0
+            if alarm != self._alarms.get(channel, 0):
+                print(f'HV monitor: channel {channel} status {status_flags(status)} at {vmon:.1f} V, {imon:.3f} uA.')
+                self._alarms[channel] = alarm
+        with self._readings_lock:
+            self._readings += rows
+            self._latest = rows
+            self.n_polls += 1
+        return self.latest()
+
+    def latest(self):
+        """{'time', 'VMON', 'IMON', 'status'}: lists with one entry per channel of the last poll, or None."""
+        with self._readings_lock:
+            rows = self._latest
+        if rows is None:
+            return None
+        return {'time': rows[0][0], 'VMON': [row[3] for row in rows], 'IMON': [row[4] for row in rows],
+                'status': [row[5] for row in rows]}
+
+    @property
+    def alarm(self):
+        """True while any channel reports an over-current, trip, interlock or similar status bit."""
+        return any(alarm != 0 for alarm in self._alarms.values())
+
+    def drain(self, n_event=0):
+        """HV_READING_DTYPE array of the readings since the last drain(), tagged with n_event."""
+        with self._readings_lock:
+            rows, self._readings = self._readings, []
+        readings = np.array(rows, dtype=HV_READING_DTYPE)
+        readings['n_event'] = n_event
+        return readings
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:39:47 2026
+
+@author: danielvalmassei
+
+Per-step instrumentation of a scan: time spent in every stage (sleep,
+get_waveforms, back-pressure, conversion, write, ramp), event rate, batch
+sizes, buffer occupancy, estimated dead time and HV readbacks.
+
+The metrics file is either JSON lines (default, one record per batch and one
+per step, so `tail -f` follows the run) or, if it ends in .prom, Prometheus
+text format rewritten in place (e.g. for the node_exporter textfile collector).
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STAGES = ('sleep', 'get_waveforms', 'back_pressure', 'conversion', 'write', 'ramp')
+PROMETHEUS_INTERVAL = 1.0 #s between rewrites of a .prom file while acquiring
+
+
+class StepMetrics:
+    """Counters of one voltage step."""
+
+    def __init__(self, step, voltage):
+        self.step = step
+        self.voltage = voltage
+        self.stage_time = {stage: 0.0 for stage in STAGES}
+        self.n_events = 0
+        self.n_batches = 0
+        self.n_full_batches = 0 #batches that emptied a full buffer, events may have been lost
+        self.max_batch = 0
+        self.max_occupancy = 0.0
+        self.VMON = None
+        self.IMON = None
+        self._batches = [] #(n_events, s since the previous readout)
+
+    @property
+    def live_time(self):
+        return self.stage_time['sleep'] + self.stage_time['get_waveforms'] + self.stage_time['back_pressure']
+
+    @property
+    def event_rate(self):
+        return self.n_events/self.live_time if self.live_time > 0 else 0.0
+
+    def dead_time(self, buffer_size):
+        """
+        Estimated time the buffer was full. The trigger rate is taken from the
+        batches that did not fill the buffer; a full batch is assumed to have
+        been full for the rest of its polling interval.
+        """
+        partial_batches = [(n, interval) for n, interval in self._batches if n < buffer_size]
+        n_partial = sum(n for n, _ in partial_batches)
+        partial_time = sum(interval for _, interval in partial_batches)
+        rate = n_partial/partial_time if n_partial > 0 else self.event_rate
+        if rate <= 0:
+            return 0.0
+        return sum(max(interval - buffer_size/rate, 0.0) for n, interval in self._batches if n >= buffer_size)
+
+    def to_dict(self, buffer_size):
+        record = {'type': 'step', 'time': time.time(), 'step': self.step, 'voltage': self.voltage,
+                  'n_events': self.n_events, 'n_batches': self.n_batches,
+                  'mean_batch': self.n_events/self.n_batches if self.n_batches > 0 else 0.0,
+                  'max_batch': self.max_batch, 'max_occupancy': self.max_occupancy,
+                  'n_full_batches': self.n_full_batches, 'event_rate_Hz': self.event_rate,
+                  'dead_time_s': self.dead_time(buffer_size), 'VMON': self.VMON, 'IMON': self.IMON}
+        record.update({f'{stage}_s': seconds for stage, seconds in self.stage_time.items()})
+        return record
+
+
+class AcquisitionMetrics:
+    """
+    Collect per-step metrics from the scan scripts, AcquisitionEngine and
+    RunWriter. The readout thread works on the step given to begin_step();
+    the worker thread passes its step explicitly, so in pipelined mode the
+    writing of one step and the ramp to the next are not mixed up.
+
+    filename=None keeps the metrics in memory and only prints the step summaries.
+    """
+
+    def __init__(self, filename=None, buffer_size=1024, **labels):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.labels = labels
+        self.prometheus = filename is not None and filename.endswith('.prom')
+        self.steps = {}
+        self.step = None
+        self._lock = threading.Lock()
+        self._last_readout = None
+        self._last_prometheus = 0.0
+        self._file = open(filename, 'a') if filename is not None and not self.prometheus else None
+
+    def begin_step(self, step, voltage):
+        with self._lock:
+            self.steps[step] = StepMetrics(step, voltage)
+            self.step = step
+            self._last_readout = None
+
+    def _get_step(self, step):
+        return self.steps[self.step if step is None else step]
+
+    def add_time(self, stage, seconds, step=None):
+        with self._lock:
+            if self.step is None and step is None:
+                return
+            self._get_step(step).stage_time[stage] += seconds
+
+    @contextmanager
+    def timer(self, stage, step=None):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start_time, step)
+
+    def record_hv(self, VMON, IMON, step=None):
+        with self._lock:
+            step_metrics = self._get_step(step)
+            step_metrics.VMON = VMON
+            step_metrics.IMON = IMON
+
+    def record_batch(self, n_events, sleep_time, readout_time, queue_depth=0, poll_interval=None, hv=None):
+        """Called by the readout thread after every get_waveforms(), hv is the latest HVMonitor reading."""
+        now = time.perf_counter()
+        with self._lock:
+            if self.step is None:
+                return
+            step_metrics = self.steps[self.step]
+            step_metrics.stage_time['sleep'] += sleep_time
+            step_metrics.stage_time['get_waveforms'] += readout_time
+            interval = sleep_time + readout_time if self._last_readout is None else now - self._last_readout
+            self._last_readout = now
+            if n_events == 0:
+                return
+            occupancy = n_events/self.buffer_size
+            step_metrics.n_events += n_events
+            step_metrics.n_batches += 1
+            step_metrics.max_batch = max(step_metrics.max_batch, n_events)
+            step_metrics.max_occupancy = max(step_metrics.max_occupancy, occupancy)
+            step_metrics.n_full_batches += n_events >= self.buffer_size
+            step_metrics._batches.append((n_events, interval))
+            self._write_json({'type': 'batch', 'time': time.time(), 'step': self.step, 'n_events': n_events,
+                              'interval_s': interval, 'sleep_s': sleep_time, 'get_waveforms_s': readout_time,
+                              'occupancy': occupancy, 'queue_depth': queue_depth,
+                              'poll_interval_s': poll_interval,
+                              **({} if hv is None else {'hv_time': hv['time'], 'VMON': hv['VMON'], 'IMON': hv['IMON'],
+                                                        'hv_status': hv['status']})})
+            if self.prometheus and now - self._last_prometheus > PROMETHEUS_INTERVAL:
+                self._write_prometheus()
+                self._last_prometheus = now
+
+    def end_step(self, step):
+        """Print and write the step summary. Submit it to the engine after the step's last batch."""
+        with self._lock:
+            record = self.steps[step].to_dict(self.buffer_size)
+            self._write_json(record)
+            if self.prometheus:
+                self._write_prometheus()
+        print(f"step {step} metrics: {record['event_rate_Hz']:.0f} Hz, batches {record['mean_batch']:.0f} "
+              f"(max {record['max_batch']}, {record['n_full_batches']} full), dead time {record['dead_time_s']:.2f} s, "
+              + ', '.join(f'{stage} {record[stage + "_s"]:.2f} s' for stage in STAGES))
+        return record
+
+    def _write_json(self, record):
+        if self._file is None:
+            return
+        record.update(self.labels)
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def _write_prometheus(self):
+        gauges = [('pmtdaq_stage_seconds', 'Time spent per acquisition stage.', None),
+                  ('pmtdaq_events', 'Events read out.', 'n_events'),
+                  ('pmtdaq_batches', 'Non-empty get_waveforms() batches.', 'n_batches'),
+                  ('pmtdaq_batch_events_max', 'Largest batch.', 'max_batch'),
+                  ('pmtdaq_buffer_occupancy_max', 'Largest batch over the buffer size.', 'max_occupancy'),
+                  ('pmtdaq_full_batches', 'Batches that emptied a full buffer.', 'n_full_batches'),
+                  ('pmtdaq_event_rate_hertz', 'Events over live time.', 'event_rate_Hz'),
+                  ('pmtdaq_dead_time_seconds', 'Estimated time the buffer was full.', 'dead_time_s'),
+                  ('pmtdaq_hv_vmon_volts', 'VMON at the start of the step.', 'VMON'),
+                  ('pmtdaq_hv_imon_microamps', 'IMON at the start of the step.', 'IMON')]
+        records = [step_metrics.to_dict(self.buffer_size) for step_metrics in self.steps.values()]
+        extra_labels = ''.join(f',{key}="{value}"' for key, value in self.labels.items())
+        lines = []
+        for name, help_text, key in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            for record in records:
+                labels = f'step="{record["step"]}",voltage="{record["voltage"]}"{extra_labels}'
+                if key is None:
+                    lines += [f'{name}{{{labels},stage="{stage}"}} {record[stage + "_s"]}' for stage in STAGES]
+                elif isinstance(record[key], (list, tuple)): #one readback per HV channel
+                    lines += [f'{name}{{{labels},hv="{n}"}} {value}' for n, value in enumerate(record[key])]
+                elif record[key] is not None:
+                    lines.append(f'{name}{{{labels}}} {record[key]}')
+        # write and rename, so a scraper never reads half a file
+        with open(self.filename + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:03:52 2026
+
+@author: danielvalmassei
+"""
+
+import numpy as np
+from analysis import StepStatistics, compute_charges
+
+
+class OnlineGain:
+    """
+    Pedestal-corrected charge of every get_waveforms() batch while the scan
+    runs, with Welford running mean/std and a live histogram per step.
+
+    If target_rel_error is set (e.g. 0.01 for 1%), done(step) becomes True
+    once the relative error on the mean gain of that step drops below it, so
+    the step can stop before collecting a fixed number of events.
+    """
+
+    def __init__(self, channel='CH0', target_rel_error=None, min_events=100, gain=1, suffix=''):
+        self.channel = channel
+        self.suffix = suffix #appended to the step attribute names, e.g. '_CH1' with several PMTs
+        self.target_rel_error = target_rel_error
+        self.min_events = min_events
+        self.gain = gain
+        self.steps = {}
+        self.voltages = {}
+
+    def begin_step(self, step, voltage):
+        self.steps[step] = StepStatistics(self.gain)
+        self.voltages[step] = voltage
+
+    def update(self, waveforms, step):
+        if len(waveforms) == 0:
+            return
+        amplitudes = np.stack([event_waveforms[self.channel]['Amplitude (V)'] for event_waveforms in waveforms])
+        time = np.asarray(waveforms[0][self.channel]['Time (s)'])
+        self.update_amplitudes(amplitudes, time, step)
+
+    def update_amplitudes(self, amplitudes, time, step):
+        """Same as update() for an (events, samples) array of this channel."""
+        if len(amplitudes) > 0:
+            self.steps[step].update(compute_charges(amplitudes, time))
+
+    def update_features(self, waveforms, step, writer):
+        """Same as update() for a RunWriter.append_features() handler that ran first: reuses its charges."""
+        if len(waveforms) > 0:
+            self.steps[step].update(writer.last_features['charge'][:, writer.last_batch.channels.index(self.channel)])
+
+    def rel_error(self, step):
+        statistics = self.steps[step]
+        if statistics.n < 2 or statistics.mean == 0:
+            return np.inf
+        return statistics.err/abs(statistics.mean)
+
+    def done(self, step):
+        """Stop criterion for AcquisitionEngine.acquire(stop=...)."""
+        if self.target_rel_error is None or self.steps[step].n < self.min_events:
+            return False
+        return self.rel_error(step) < self.target_rel_error
+
+    def summary(self, step):
+        statistics = self.steps[step]
+        return (f'{self.channel} gain at {self.voltages[step]} V: {statistics.mean/self.gain:.4g} +- {statistics.err:.2g} '
+                f'({self.rel_error(step):.2%}) from {statistics.n} events')
+
+    def finish_step(self, step, writer=None):
+        """Print the step result and store it as step attributes of the run file."""
+        print(self.summary(step))
+        if writer is not None:
+            statistics = self.steps[step]
+            writer.set_step_attrs(**{'online_gain' + self.suffix: statistics.mean/self.gain,
+                                     'online_gain_std' + self.suffix: statistics.std,
+                                     'online_gain_err' + self.suffix: statistics.err,
+                                     'online_n_events' + self.suffix: statistics.n})
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:44:17 2026
+
+@author: danielvalmassei
+
+Register map of the DT5742 registers used by the scripts, with a shadow copy
+of the device registers. Writes only go to the shadow; commit() then writes
+the registers whose value actually changed and verifies all of them with one
+read-back pass, so reconfiguring between runs only costs what changed.
+"""
+
+# name: address
+REGISTERS = {
+    'group_config': 0x8000,
+    'ch0_trigger_enable': 0x10A8,
+    'front_panel_io': 0x811C,
+}
+
+# name: (register, first bit, n bits)
+FIELDS = {
+    'transparent_mode': ('group_config', 13, 1),
+    'ch0_self_trigger': ('ch0_trigger_enable', 0, 1),
+}
+
+BUSY_ON_GPO = 0x000D0001 #front_panel_io value that puts the busy signal on GPO
+THRESHOLD_CHANNEL_SHIFT = 12 #0x1n80 takes the threshold in bits [11:0] and the channel of group n in bits [15:12]
+
+
+def edit_bit(hex_value, bit_position, set_bit=True):
+    """
+    Edit a single bit in a 32-bit hexadecimal value.
+
+    Args:
+        hex_value (str): A string representing the 32-bit hex value (e.g., '0x12345678').
+        bit_position (int): Bit position to modify (0 = least significant bit, 31 = most significant).
+        set_bit (bool): If True, set the bit to 1. If False, clear the bit to 0.
+
+    Returns:
+        str: New 32-bit hexadecimal value as a string (e.g., '0x123456F8').
+    """
+    if not (0 <= bit_position < 32):
+        raise ValueError("bit_position must be between 0 and 31")
+
+    value = hex_value
+
+    if set_bit:
+        value |= (1 << bit_position) #bitwise OR comparisson
+    else:
+        value &= ~(1 << bit_position) #bitwise AND comparisson
+
+    return value
+
+
+def _address(register):
+    if isinstance(register, tuple): #(address, channel) of a per-channel threshold
+        return register
+    return REGISTERS[register] if isinstance(register, str) else int(register)
+
+
+def threshold_register(channel):
+    """Shadow key of the self trigger threshold of any channel: (0x1n80, channel in group n)."""
+    return (0x1080 + 0x100*(channel//8), channel % 8)
+
+
+def trigger_enable_register(channel):
+    """Address of the trigger enable mask of the group of `channel` (bit = channel in the group)."""
+    return 0x10A8 + 0x100*(channel//8)
+
+
+class RegisterMap:
+    """
+    Shadow copy of the digitizer registers. `device` holds the last value
+    known to be in the device (read or written), `shadow` the value wanted.
+    Registers are read at most once, when a field of them is first needed.
+    Keep the same map between runs to only write what changed.
+
+    Self trigger thresholds, Ch.0 included, are staged with set_threshold().
+    They share one indirect address per group (0x1n80), whose bits [15:12]
+    select the channel, so a read-back does not tell which channel it holds:
+    a threshold is only clean if this map wrote that value for that channel
+    itself, and it is written but not verified.
+    """
+
+    def __init__(self, digitizer):
+        self.digitizer = digitizer
+        self.device = {}
+        self.shadow = {}
+        self.n_reads = 0
+        self.n_writes = 0
+
+    def read(self, register, refresh=False):
+        """Value of a register (name or address), from the shadow copy unless refresh=True."""
+        address = _address(register)
+        if refresh or address not in self.device:
+            self.device[address] = self.digitizer.read_register(address)
+            self.n_reads += 1
+            if refresh or address not in self.shadow:
+                self.shadow[address] = self.device[address]
+        return self.shadow[address]
+
+    def write(self, register, value):
+        """Set the whole register in the shadow copy, it is written by commit()."""
+        self.shadow[_address(register)] = int(value) & 0xFFFFFFFF
+
+    def get_field(self, name):
+        register, first_bit, n_bits = FIELDS[name]
+        return (self.read(register) >> first_bit) & ((1 << n_bits) - 1)
+
+    def set_bits(self, register, first_bit, n_bits, value):
+        mask = ((1 << n_bits) - 1) << first_bit
+        if int(value) << first_bit & ~mask:
+            raise ValueError(f'{value} does not fit in {n_bits} bit(s).')
+        self.write(register, (self.read(register) & ~mask) | (int(value) << first_bit))
+
+    def set_field(self, name, value):
+        self.set_bits(*FIELDS[name], value)
+
+    def set_threshold(self, channel, threshold):
+        """Stage the self trigger threshold of any channel."""
+        if not 0 <= int(threshold) < 1 << THRESHOLD_CHANNEL_SHIFT:
+            raise ValueError(f'Threshold {threshold} is not in [0, 4095].')
+        self.shadow[threshold_register(channel)] = int(threshold)
+
+    @property
+    def dirty(self):
+        """Addresses whose shadow value is not known to be in the device."""
+        return [address for address, value in self.shadow.items() if self.device.get(address) != value]
+
+    def commit(self, verify=True):
+        """
+        Write every dirty register, then read all of them back once. Raises
+        RuntimeError if a register does not hold the written value.
+        Returns the addresses written.
+        """
+        written = self.dirty
+        for address in written:
+            old_value = self.device.get(address)
+            if isinstance(address, tuple):
+                address, channel = address
+                self.digitizer.write_register(address, self.shadow[address, channel] | channel << THRESHOLD_CHANNEL_SHIFT)
+                self.device[address, channel] = self.shadow[address, channel]
+                self.n_writes += 1
+                print(f'Writing threshold {self.shadow[address, channel]} for channel {channel} at register 0x{address:04X}' +
+                      (f' (was {old_value}).' if old_value is not None else '.'))
+                continue
+            self.digitizer.write_register(address, self.shadow[address])
+            self.device[address] = self.shadow[address]
+            self.n_writes += 1
+            print(f'Writing {self.shadow[address]:08X} at register 0x{address:04X}' +
+                  (f' (was {old_value:08X}).' if old_value is not None else '.'))
+        if verify:
+            mismatched = []
+            for address in written:
+                if isinstance(address, tuple):
+                    continue
+                value = self.digitizer.read_register(address)
+                self.n_reads += 1
+                if value != self.shadow[address]:
+                    self.device[address] = value
+                    mismatched.append(f'0x{address:04X} reads {value:08X} instead of {self.shadow[address]:08X}')
+            if len(mismatched) > 0:
+                raise RuntimeError('Register verification failed: ' + ', '.join(mismatched))
+        if len(written) > 0:
+            n_thresholds = sum(isinstance(address, tuple) for address in written)
+            print(f'{len(written)} register(s) written' + (' and verified' if verify and n_thresholds < len(written) else '') +
+                  (f', {n_thresholds} threshold(s) not read back.' if n_thresholds > 0 else '.'))
+        else:
+            print('Registers already up to date.')
+        return written
+
+    def invalidate(self):
+        """Forget the device values, e.g. after a reset or when another program may have changed them."""
+        self.device = {}
+        self.shadow = {}
+
+
+def configure_self_trigger(registers:RegisterMap, self_trigger_threshold, transparent_mode=False):
+    """Stage the Ch.0 self trigger registers; call registers.commit() to write them."""
+    registers.set_threshold(0, self_trigger_threshold)
+    registers.set_field('ch0_self_trigger', 1)
+    registers.set_field('transparent_mode', int(transparent_mode))
+
+
+def configure_channel_self_triggers(registers:RegisterMap, thresholds, transparent_mode=False):
+    """Stage self triggers on several channels, `thresholds` maps channel number to threshold."""
+    for channel, threshold in thresholds.items():
+        registers.set_threshold(channel, threshold)
+        registers.set_bits(trigger_enable_register(channel), channel % 8, 1, 1)
+    registers.set_field('transparent_mode', int(transparent_mode))
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:21:05 2026
+
+@author: danielvalmassei
+
+Binary run format. One HDF5 file per run:
+
+    /                  attrs: run metadata (dc_offset, self_trigger_threshold,
+                              sampling_frequency_MHz, record_length, ...)
+                       and, for ADC counts, adc_volts_per_count,
+                       adc_volts_offset and sampling_period_s
+    /time              (record_length,) sample times in s, only for amplitudes
+                       in V (rebuilt from sampling_period_s otherwise)
+    /step_000/CH0      (n_events, record_length) uint16 ADC counts (or float
+                       amplitudes in V), chunked + gzip
+    /step_000/...      one dataset per channel
+    /step_000          attrs: voltage, VMON, IMON, n_events
+    /step_000/trigger_channel  (n_events,) optional per-event labels, e.g. the
+                               PMT that triggered in a multi-PMT scan
+    /step_000/hv_readings      (n_readings,) optional hv_monitor.HV_READING_DTYPE
+                               rows polled while the step was acquired
+
+Runs written with append_features() hold a per-event feature table instead
+of the waveforms:
+
+    /step_000/CH0_features    (n_events,) features.FEATURE_DTYPE rows
+    /step_000/CH0             (n_waveforms, record_length) prescaled waveforms
+    /step_000/waveform_events (n_waveforms,) event numbers of those waveforms
+    /step_000                 attrs: n_events (all events), n_waveforms
+
+and runs written with append_roi() only the region of interest of every
+event and channel (see features.RegionOfInterest):
+
+    /                      attrs: roi_pedestal_window, roi_signal_window,
+                                  roi_trigger_sample, roi_threshold
+    /step_000/CH0_roi      (n_kept, n_pedestal + n_signal) pedestal window
+                           then signal window samples
+    /step_000/CH0_roi_start   (n_kept,) first sample of the signal window
+    /step_000/CH0_roi_events  (n_kept,) event numbers, events whose channel
+                              was zero suppressed are missing
+"""
+
+import time
+import h5py
+import numpy as np
+import pandas as pd
+from event_builder import EventBuilder, to_volts, sample_times
+from features import extract_features, RegionOfInterest
+from hv_monitor import HV_READING_DTYPE
+
+CHUNK_EVENTS = 128 # events per HDF5 chunk
+COMPRESSION = 'gzip'
+COMPRESSION_LEVEL = 4
+QUANTIZATION_TOLERANCE = 0.01 #ADC counts, warn if the samples are further off the ADC grid
+
+
+class RunWriter:
+    """
+    Write one run file, one group per voltage step. Steps grow batch by batch,
+    so nothing has to be held in memory until the end of the scan.
+
+    append_waveforms() keeps the samples as uint16 ADC counts unless
+    adc=False; the readers below convert them back to volts.
+    append_features() is the reduced mode: it stores the features of every
+    event and the waveforms of one event in `prescale` (none for prescale=0).
+    append_roi() stores only the samples of the RegionOfInterest `roi`.
+
+    resume_steps=n reopens an interrupted run instead of overwriting it: the
+    first n steps are kept, later (incomplete) ones are deleted and the next
+    begin_step() starts step n again.
+    """
+
+    def __init__(self, filename, channels=None, store=None, metrics=None, adc=True, prescale=100, roi:RegionOfInterest=None,
+                 resume_steps=None, **attrs):
+        self.filename = filename
+        self.channels = channels
+        self.adc = adc
+        self.prescale = int(prescale)
+        self.roi = roi
+        self.store = store #optional waveform_store.WaveformStoreWriter that mirrors every batch
+        self.metrics = metrics #optional metrics.AcquisitionMetrics, gets the conversion and write time
+        self.file = h5py.File(filename, 'w' if resume_steps is None else 'a')
+        self.n_steps = 0 if resume_steps is None else int(resume_steps)
+        for name in [name for name in self.file if name.startswith('step_') and int(name[5:]) >= self.n_steps]:
+            del self.file[name] #the space is only reclaimed by h5repack, but the run reads as if the step was never begun
+        for key, value in attrs.items():
+            if value is not None:
+                self.file.attrs[key] = value
+        if roi is not None:
+            self.file.attrs.update(roi.attrs())
+        self._step = None
+        self._builder = None
+        self._warned = False
+        self._features = None
+
+    def begin_step(self, voltage, **attrs):
+        """
+        Start a new voltage step. Extra keyword arguments (e.g. VMON, IMON)
+        are stored as step attributes. Events are added with append().
+        """
+        group = self.file.create_group(f'step_{self.n_steps:03d}')
+        group.attrs['voltage'] = voltage
+        group.attrs['n_events'] = 0
+        for key, value in attrs.items():
+            if value is not None:
+                group.attrs[key] = value
+        self.n_steps += 1
+        self._step = group
+        if self.store is not None:
+            self.store.begin_step(voltage)
+        return group
+
+    def set_step_attrs(self, **attrs):
+        """Add attributes to the current step, e.g. results known only once it is complete."""
+        for key, value in attrs.items():
+            if value is not None:
+                self._step.attrs[key] = value
+
+    def append(self, builder:EventBuilder):
+        """
+        Append the events held by `builder` to the current step and flush, so
+        the caller can clear the builder and reuse it for the next batch.
+        """
+        if self._step is None:
+            raise RuntimeError('begin_step() must be called before append().')
+        if builder.n_events == 0:
+            return
+        self._write_calibration(builder)
+
+        group = self._step
+        n_old = len(group[builder.channels[0]]) if builder.channels[0] in group else 0
+        n_new = builder.n_events
+        for n_channel, channel in enumerate(builder.channels):
+            if channel not in group:
+                group.create_dataset(channel, shape=(0, builder.record_length), maxshape=(None, builder.record_length),
+                                     dtype=builder.counts.dtype, chunks=(CHUNK_EVENTS, builder.record_length),
+                                     compression=COMPRESSION, compression_opts=COMPRESSION_LEVEL, shuffle=True)
+            dataset = group[channel]
+            dataset.resize(n_old + n_new, axis=0)
+            dataset[n_old:] = builder.counts[:, n_channel, :]
+        group.attrs['n_events'] = n_old + n_new
+        self.file.flush()
+        if self.store is not None:
+            self.store.append(builder)
+
+    def _write_calibration(self, builder):
+        # how to get volts and times back, written with the first samples of the run
+        if builder.adc and 'adc_volts_per_count' not in self.file.attrs:
+            self.file.attrs['adc_volts_per_count'] = builder.volts_per_count
+            self.file.attrs['adc_volts_offset'] = builder.volts_offset
+            self.file.attrs['sampling_period_s'] = builder.sampling_period if builder.sampling_period is not None else builder.time[1] - builder.time[0]
+        elif not builder.adc and 'time' not in self.file and builder.time is not None:
+            self.file.create_dataset('time', data=builder.time)
+
+    def append_column(self, name, values):
+        """
+        Append one value per event (e.g. trigger_channel) to a 1D dataset of
+        the current step, or one row per event to a 2D dataset.
+        """
+        values = np.asarray(values)
+        group = self._step
+        if name not in group:
+            chunks = (CHUNK_EVENTS*64,) if values.ndim == 1 else (CHUNK_EVENTS,) + values.shape[1:]
+            group.create_dataset(name, shape=(0,) + values.shape[1:], maxshape=(None,) + values.shape[1:], dtype=values.dtype,
+                                 chunks=chunks, compression=COMPRESSION, compression_opts=COMPRESSION_LEVEL,
+                                 shuffle=values.ndim > 1)
+        dataset = group[name]
+        n_old = len(dataset)
+        dataset.resize(n_old + len(values), axis=0)
+        dataset[n_old:] = values
+
+    def append_hv_readings(self, readings):
+        """Append HVMonitor readings (drained with a batch) to the current step."""
+        self.append_column('hv_readings', readings)
+
+    @property
+    def last_batch(self):
+        """EventBuilder holding the batch last added by append_waveforms() or append_features()."""
+        return self._builder
+
+    @property
+    def last_features(self):
+        """(n_events, n_channels) features of the batch last added by append_features()."""
+        return self._features
+
+    def append_waveforms(self, waveforms, voltage):
+        """
+        Convert one get_waveforms() batch and append it to the current step.
+        A single EventBuilder is reused, so memory is bounded by one batch.
+        If the writer was opened with channels=None every channel is kept.
+        """
+        if len(waveforms) == 0:
+            return
+        start_time = time.perf_counter()
+        self._build(waveforms, voltage)
+        conversion_end = time.perf_counter()
+        self.append(self._builder)
+        if self.metrics is not None:
+            self.metrics.add_time('conversion', conversion_end - start_time, step=self.n_steps - 1)
+            self.metrics.add_time('write', time.perf_counter() - conversion_end, step=self.n_steps - 1)
+
+    def append_features(self, waveforms, voltage):
+        """
+        Reduced output: convert one get_waveforms() batch, append the
+        features of every event and channel to /step_XXX/CHn_features and
+        only the waveforms of events whose number is a multiple of
+        `prescale` to the step datasets.
+        """
+        if len(waveforms) == 0:
+            return
+        start_time = time.perf_counter()
+        builder = self._build(waveforms, voltage)
+        if builder.adc: #volts one channel at a time, never for the whole batch
+            self._features = extract_features(builder.counts, builder.time, builder.n_event,
+                                              calibration=(builder.volts_per_count, builder.volts_offset))
+        else:
+            self._features = extract_features(builder.amplitudes, builder.time, builder.n_event)
+        conversion_end = time.perf_counter()
+
+        group = self._step
+        n_events = int(group.attrs['n_events'])
+        for n_channel, channel in enumerate(builder.channels):
+            self.append_column(channel + '_features', self._features[:, n_channel])
+        keep = builder.n_event % self.prescale == 0 if self.prescale > 0 else np.zeros(builder.n_events, dtype=bool)
+        if np.any(keep):
+            calibration = {'volts_per_count': builder.volts_per_count, 'volts_offset': builder.volts_offset,
+                           'sampling_period': builder.sampling_period} if builder.adc else {}
+            prescaled = EventBuilder.from_arrays(builder.counts[keep], builder.time, voltage, builder.channels,
+                                                 n_event=builder.n_event[keep], **calibration)
+            self.append(prescaled)
+            self.append_column('waveform_events', prescaled.n_event)
+        group.attrs['n_waveforms'] = len(group['waveform_events']) if 'waveform_events' in group else 0
+        group.attrs['n_events'] = n_events + builder.n_events
+        self.file.flush()
+        if self.metrics is not None:
+            self.metrics.add_time('conversion', conversion_end - start_time, step=self.n_steps - 1)
+            self.metrics.add_time('write', time.perf_counter() - conversion_end, step=self.n_steps - 1)
+
+    def append_roi(self, waveforms, voltage):
+        """
+        Region-of-interest mode: convert one get_waveforms() batch and append
+        only the pedestal and signal windows of every event and channel that
+        passes the zero suppression to /step_XXX/CHn_roi.
+        """
+        if len(waveforms) == 0:
+            return
+        start_time = time.perf_counter()
+        builder = self._build(waveforms, voltage)
+        roi, start, keep = self.roi.select(builder.counts, builder.volts_per_count if builder.adc else None)
+        conversion_end = time.perf_counter()
+
+        self._write_calibration(builder)
+        group = self._step
+        for n_channel, channel in enumerate(builder.channels):
+            kept = keep[:, n_channel]
+            self.append_column(channel + '_roi', roi[kept, n_channel, :])
+            self.append_column(channel + '_roi_start', start[kept, n_channel])
+            self.append_column(channel + '_roi_events', builder.n_event[kept])
+        group.attrs['n_events'] = int(group.attrs['n_events']) + builder.n_events
+        self.file.flush()
+        if self.metrics is not None:
+            self.metrics.add_time('conversion', conversion_end - start_time, step=self.n_steps - 1)
+            self.metrics.add_time('write', time.perf_counter() - conversion_end, step=self.n_steps - 1)
+
+    def _build(self, waveforms, voltage):
+        # convert one batch into the reused EventBuilder
+        if self._builder is None:
+            channels = list(waveforms[0]) if self.channels is None else self.channels
+            record_length = len(waveforms[0][channels[0]]['Amplitude (V)'])
+            self._builder = EventBuilder(len(waveforms), channels, record_length, np.uint16 if self.adc else np.float64)
+        self._builder.clear()
+        self._builder.add(waveforms, voltage)
+        if self._builder.max_quantization_error > QUANTIZATION_TOLERANCE*self._builder.volts_per_count and not self._warned:
+            print(f'Warning: amplitudes are up to {self._builder.max_quantization_error:.3g} V off the ADC grid, '
+                  'the stored ADC counts are not exact. Use adc=False to store volts.')
+            self._warned = True
+        return self._builder
+
+    def write_step(self, builder:EventBuilder, voltage, **attrs):
+        """Write the events held by `builder` as a complete new step."""
+        self.begin_step(voltage, **attrs)
+        self.append(builder)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        if self.store is not None:
+            self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_run_attrs(filename):
+    with h5py.File(filename, 'r') as f:
+        return dict(f.attrs)
+
+
+def _calibration(f):
+    """EventBuilder keyword arguments for the ADC counts of an open run file."""
+    if 'adc_volts_per_count' not in f.attrs:
+        return {}
+    return {'volts_per_count': f.attrs['adc_volts_per_count'], 'volts_offset': f.attrs['adc_volts_offset'],
+            'sampling_period': f.attrs['sampling_period_s']}
+
+
+def _time(f, record_length):
+    if 'time' in f:
+        return f['time'][()]
+    if 'sampling_period_s' in f.attrs:
+        return sample_times(record_length, f.attrs['sampling_period_s'])
+    return None
+
+
+def _volts(f, samples):
+    # amplitudes in V whether the run stores ADC counts or volts
+    if not np.issubdtype(samples.dtype, np.integer):
+        return samples
+    return to_volts(samples, f.attrs['adc_volts_per_count'], f.attrs['adc_volts_offset'])
+
+
+def adc_calibration(filename):
+    """Calibration metadata of a run stored as ADC counts ({} for volts): volts_per_count, volts_offset, sampling_period."""
+    with h5py.File(filename, 'r') as f:
+        return _calibration(f)
+
+
+def has_features(filename):
+    """True if the run was written with RunWriter.append_features()."""
+    with h5py.File(filename, 'r') as f:
+        return any(name.endswith('_features') for step in f if step.startswith('step_') for name in f[step])
+
+
+def read_features(filename, step, channel='CH0'):
+    """(step attributes, FEATURE_DTYPE rows of `channel`, or None if the step has no feature table)."""
+    with h5py.File(filename, 'r') as f:
+        group = f[step if isinstance(step, str) else f'step_{step:03d}']
+        name = channel + '_features'
+        return dict(group.attrs), group[name][()] if name in group else None
+
+
+def read_hv_readings(filename, step):
+    """HV_READING_DTYPE rows of one step, empty if the run was taken without an HV monitor."""
+    with h5py.File(filename, 'r') as f:
+        group = f[step if isinstance(step, str) else f'step_{step:03d}']
+        return group['hv_readings'][()] if 'hv_readings' in group else np.empty(0, dtype=HV_READING_DTYPE)
+
+
+def has_trigger_channels(filename):
+    """True for a multi-PMT run (HV_scan_multi.py) whose events are labeled with the channel that triggered."""
+    with h5py.File(filename, 'r') as f:
+        return any('trigger_channel' in f[step] for step in f if step.startswith('step_'))
+
+
+def read_trigger_channels(filename, step):
+    """Number of the channel that triggered every event of one step, None if its events are not labeled."""
+    with h5py.File(filename, 'r') as f:
+        group = f[step if isinstance(step, str) else f'step_{step:03d}']
+        return group['trigger_channel'][()] if 'trigger_channel' in group else None
+
+
+def list_channels(filename):
+    """Waveform channels stored in any step of a run file, in channel order."""
+    with h5py.File(filename, 'r') as f:
+        channels = {channel for step in f if step.startswith('step_') for channel in _step_channels(f[step])}
+    return sorted(channels, key=lambda channel: int(channel[2:]))
+
+
+def has_roi(filename):
+    """True if the run was written with RunWriter.append_roi()."""
+    with h5py.File(filename, 'r') as f:
+        return 'roi_signal_window' in f.attrs
+
+
+def read_roi(filename, step, channel='CH0'):
+    """
+    (step attributes, (n_kept, n_pedestal + n_signal) samples in V, first
+    sample of every signal window, event numbers, n_pedestal, sampling
+    period) of one channel of a region-of-interest run, or None for the
+    samples if the step has none.
+    """
+    with h5py.File(filename, 'r') as f:
+        group = f[step if isinstance(step, str) else f'step_{step:03d}']
+        pedestal_window = f.attrs['roi_pedestal_window']
+        sampling_period = f.attrs['sampling_period_s'] if 'sampling_period_s' in f.attrs else f['time'][1] - f['time'][0]
+        if channel + '_roi' not in group:
+            return dict(group.attrs), None, None, None, pedestal_window[1] - pedestal_window[0], sampling_period
+        return (dict(group.attrs), _volts(f, group[channel + '_roi'][()]), group[channel + '_roi_start'][()],
+                group[channel + '_roi_events'][()], pedestal_window[1] - pedestal_window[0], sampling_period)
+
+
+def _step_channels(group, channels=None):
+    # waveform datasets are 2D (except the _roi samples), per-event columns such as trigger_channel are 1D
+    names = [name for name in group if group[name].ndim == 2 and not name.endswith('_roi')]
+    return names if channels is None else [ch for ch in channels if ch in names]
+
+
+def iter_steps(filename, channels=None):
+    """
+    Yield (step attributes, EventBuilder) for every voltage step in the file.
+    If `channels` is None every channel stored in the step is read. ADC
+    counts stay counts in the builder, its amplitudes are converted on use.
+    """
+    with h5py.File(filename, 'r') as f:
+        calibration = _calibration(f)
+        for name in sorted(key for key in f if key.startswith('step_')):
+            group = f[name]
+            step_channels = _step_channels(group, channels)
+            if len(step_channels) == 0:
+                continue
+            samples = np.stack([group[ch][()] for ch in step_channels], axis=1)
+            attrs = dict(group.attrs)
+            n_event = group['waveform_events'][()] if 'waveform_events' in group else None #prescaled waveforms
+            yield attrs, EventBuilder.from_arrays(samples, f['time'][()] if 'time' in f else None, attrs['voltage'],
+                                                  step_channels, n_event=n_event, **calibration)
+
+
+def list_steps(filename):
+    """Names of the step groups of a run file, in acquisition order."""
+    with h5py.File(filename, 'r') as f:
+        return sorted(key for key in f if key.startswith('step_'))
+
+
+def read_step(filename, step, channels=None, raw=False):
+    """
+    (step attributes, (n_events, n_channels, record_length) amplitudes in V,
+    time, channels) of one step, given by name or number, e.g. for one worker
+    process per step. raw=True returns the stored samples (ADC counts).
+    """
+    with h5py.File(filename, 'r') as f:
+        group = f[step if isinstance(step, str) else f'step_{step:03d}']
+        step_channels = _step_channels(group, channels)
+        if len(step_channels) == 0:
+            return dict(group.attrs), None, f['time'][()] if 'time' in f else None, step_channels
+        samples = np.stack([group[ch][()] for ch in step_channels], axis=1)
+        return dict(group.attrs), samples if raw else _volts(f, samples), _time(f, samples.shape[-1]), step_channels
+
+
+def read_run(filename, channels=None):
+    """Read a whole run into the long-format DataFrame used by analysis.py."""
+    data = [builder.to_data_frame() for _, builder in iter_steps(filename, channels)]
+    return pd.concat(data)
+
+
+def iter_blocks(filename, channels=None, block_events=CHUNK_EVENTS):
+    """
+    Yield (voltage, n_event, amplitudes, time, channels) for blocks of at
+    most `block_events` events, step by step, without reading a whole step.
+    `n_event` holds the event numbers of the block (those of the prescaled
+    waveforms in a features run). `amplitudes` has shape (n_events,
+    n_channels, record_length) and is in V, ADC counts are converted block
+    by block.
+    """
+    with h5py.File(filename, 'r') as f:
+        for name in sorted(key for key in f if key.startswith('step_')):
+            group = f[name]
+            step_channels = _step_channels(group, channels)
+            if len(step_channels) == 0:
+                continue
+            n_events, record_length = group[step_channels[0]].shape
+            time = _time(f, record_length)
+            for start in range(0, n_events, block_events):
+                amplitudes = np.stack([group[ch][start:start + block_events] for ch in step_channels], axis=1)
+                if 'waveform_events' in group: #prescaled waveforms
+                    n_event = group['waveform_events'][start:start + block_events]
+                else:
+                    n_event = np.arange(start, start + len(amplitudes))
+                yield group.attrs['voltage'], n_event, _volts(f, amplitudes), time, step_channels
+
+
+def export_csv(filename, csv_filename='out.csv', channels=None, block_events=CHUNK_EVENTS):
+    """
+    Write a run file out as the legacy out.csv, `block_events` events at a
+    time so the export never holds a whole step in memory.
+    """
+    header = True
+    for voltage, n_event, amplitudes, time, step_channels in iter_blocks(filename, channels, block_events):
+        builder = EventBuilder.from_arrays(amplitudes, time, voltage, step_channels, n_event=n_event)
+        builder.to_data_frame().to_csv(csv_filename, mode='w' if header else 'a', header=header)
+        header = False
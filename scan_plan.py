@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:25:44 2026
+
+@author: danielvalmassei
+
+Order of the voltage steps of a scan. A scan of n_passes passes over the
+n_steps voltages from low_HV to high_HV either starts every pass at the same
+end ('up', 'down') or turns around at each end ('serpentine'), which only
+ramps the whole range once per pass instead of twice.
+"""
+
+import numpy as np
+
+ORDERS = ('up', 'down', 'serpentine')
+
+
+def scan_voltages(low_HV, high_HV, n_steps, n_passes=1, order='up', start=None):
+    """
+    Voltages of every step in acquisition order. A serpentine scan starts at
+    the end closest to `start` (the voltage the HV is at, if known), 'up'
+    otherwise.
+    """
+    if order not in ORDERS:
+        raise ValueError(f'Unknown scan order {order!r}, choose one of {ORDERS}.')
+    voltages = np.linspace(low_HV, high_HV, int(n_steps), endpoint=True)
+    descending = order == 'down'
+    if order == 'serpentine' and start is not None:
+        descending = abs(start - voltages[-1]) < abs(start - voltages[0])
+    passes = []
+    for n_pass in range(int(n_passes)):
+        reverse = descending != (order == 'serpentine' and n_pass % 2 == 1)
+        passes.append(voltages[::-1] if reverse else voltages)
+    return np.concatenate(passes)
+
+
+def ramp_distance(voltages, start=0.0):
+    """Total V ramped to go from `start` through every step."""
+    return float(np.sum(np.abs(np.diff(np.concatenate([[start], voltages])))))
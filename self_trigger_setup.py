@@ -6,51 +6,30 @@ Created on Fri May 23 08:24:07 2025
 @author: danielvalmassei
 """
 
-from CAENpy.CAENDigitizer import CAEN_DT5742_Digitizer
-from CAENpy.CAENDesktopHighVoltagePowerSupply import CAENDesktopHighVoltagePowerSupply
+from hardware import open_hv_supply, open_digitizer, send_sw_trigger
+from acquisition import split_args
 from ctypes import CDLL
-import pandas as pd
+import sys
 import numpy as np
 import time
-from HV_scan_smaller_data import configure_digitizer, convert_dicitonaries_to_data_frame
+from HV_scan_smaller_data import convert_dicitonaries_to_data_frame
+from registers import configure_self_trigger
+from config_digitizer import configure_digitizer
 import matplotlib.pyplot as plt
 
-def edit_bit(hex_value, bit_position, set_bit=True):
-    """
-    Edit a single bit in a 32-bit hexadecimal value.
-
-    Args:
-        hex_value (str): A string representing the 32-bit hex value (e.g., '0x12345678').
-        bit_position (int): Bit position to modify (0 = least significant bit, 31 = most significant).
-        set_bit (bool): If True, set the bit to 1. If False, clear the bit to 0.
-
-    Returns:
-        str: New 32-bit hexadecimal value as a string (e.g., '0x123456F8').
-    """
-    if not (0 <= bit_position < 32):
-        raise ValueError("bit_position must be between 0 and 31")
-
-    value = hex_value
-
-    if set_bit:
-        value |= (1 << bit_position) #bitwise OR comparisson
-    else:
-        value &= ~(1 << bit_position) #bitwise AND comparisson
-
-    return value
-
 def check_error_code(code):
     if code != 0:
         raise RuntimeError(f'libCAENDigitizer has returned error code {code}.')
     
-def main():
+def main(backend='real'):
     try:
-        libCAENDigitizer = CDLL('/usr/lib/libCAENDigitizer.so')
+        libCAENDigitizer = CDLL('/usr/lib/libCAENDigitizer.so') if backend == 'real' else None
         
-        HV = CAENDesktopHighVoltagePowerSupply(port='/dev/ttyACM0') # Open the connection.
+        HV = open_hv_supply(backend, port='/dev/ttyACM0') # Open the connection. backend='sim' for simulated hardware
         print('HV connected with:',HV.idn)
-        digitizer = CAEN_DT5742_Digitizer(LinkNum=0)
-        configure_digitizer(digitizer)
+        digitizer = open_digitizer(backend, LinkNum=0, hv_supply=HV)
+        registers = configure_digitizer(digitizer)
+        registers.commit()
         digitizer.set_max_num_events_BLT(1024) # Override the maximum number of events to be stored in the digitizer's self buffer.
     
     
@@ -72,9 +51,8 @@ def main():
             print(f'Ch.0 DC Offset is {dc_offset}.')
             with digitizer:
                 time.sleep(1) # wait one second
-                code = libCAENDigitizer.CAEN_DGTZ_SendSWtrigger(digitizer._get_handle()) #trigger the digitizer with the software
+                send_sw_trigger(digitizer, libCAENDigitizer) #trigger the digitizer with the software
                 time.sleep(0.1)
-                check_error_code(code)
                 
             data = digitizer.get_waveforms()
             
@@ -109,17 +87,14 @@ def main():
                     print('Incorrect input. Please type "Y" or "n".')
             
         ########## Acquisition in Transparent Mode ##########
-        old_0x8000_value = digitizer.read_register(0x8000) #get the current register config
-        print(f'Old value of register 0x8000: {old_0x8000_value:08X}')
-        new_0x8000_value = edit_bit(old_0x8000_value, 13, set_bit=True) #edit the bit[13]=1 for Transparent mode
-        digitizer.write_register(0x8000,new_0x8000_value) #write the new value to the register
-        print(f'Set Transparent mode. Wrote {new_0x8000_value:08X} at register 0x8000' )
+        registers.set_field('transparent_mode', 1) #bit[13]=1 for Transparent mode
+        registers.commit()
+        print('Set Transparent mode.')
         
         with digitizer:
             time.sleep(1) # wait one second
-            code = libCAENDigitizer.CAEN_DGTZ_SendSWtrigger(digitizer._get_handle()) #trigger the digitizer with the software
+            send_sw_trigger(digitizer, libCAENDigitizer) #trigger the digitizer with the software
             time.sleep(0.1)
-            check_error_code(code)
         
         data = digitizer.get_waveforms()
         
@@ -134,31 +109,17 @@ def main():
         plt.show()
         
         ########## Set Self Trigger Threshold ##########
-        old_0x1080_value = digitizer.read_register(0x1080)
-        print(f'Old value of register 0x1080: {old_0x1080_value:08X}')
+        print(f'Old value of register 0x1080: {digitizer.read_register(0x1080):08X}') #the threshold of the channel in bits [15:12]
         adc_avg = np.mean((data['Amplitude (V)'][512:]+0.5)*4096)
         adc_std = np.std((data['Amplitude (V)'][512:]+0.5)*4096)
         print(f'Average ADC: {adc_avg}, ADC Standard Dev:{adc_std}')
         rec_trig_threshold = int(adc_avg - 2*adc_std)
         print(f'Recommended Trigger Threshold: {rec_trig_threshold}')
         self_trigger_threashold = int(input('Please input the threshold value in decimal [0:4095]:'))
-        digitizer.write_register(0x1080, self_trigger_threashold) #NOTE: this is a quick trick that we can use right now because we are only working with Ch.0 read register descriptions for more info
-        
-        
-        ########## Enable Self Trigger ##########
-        old_0x10A8_value = digitizer.read_register(0x10A8)
-        print(f'Old value of register 0x10A8: {old_0x10A8_value:08X}')
-        new_0x10A8_value = edit_bit(old_0x10A8_value, 0, set_bit=True)
-        print(f'Writing {new_0x10A8_value:08X} at register 0x10A8.')
-        digitizer.write_register(0x10A8,new_0x10A8_value)
-        print('Self trigger enabled for Ch.0')
         
-        ########## Revert to Output Mode ##########
-        old_0x8000_value = digitizer.read_register(0X8000)
-        print(f'Old value of register 0x8000: {old_0x8000_value:08X}')
-        new_0x8000_value = edit_bit(old_0x8000_value, 13, set_bit=False)
-        print(f'Writing {new_0x8000_value:08X} at register 0x8000.')
-        digitizer.write_register(0x8000, new_0x8000_value)
+        ########## Enable Self Trigger and revert to Output Mode ##########
+        configure_self_trigger(registers, self_trigger_threashold, transparent_mode=False)
+        registers.commit()
         print('Ready for Self-Triggered acquisition in Output Mode')
     
     except Exception as e:
@@ -173,4 +134,5 @@ def main():
     
     
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    args, options = split_args(sys.argv[1:])
+    main(**options)
\ No newline at end of file
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:06:03 2026
+
+@author: danielvalmassei
+
+Simulated CAEN DT5742 digitizer and DT1470 HV supply with the same methods
+as the CAENpy classes used by the scripts, so acquisition can be run and
+profiled without hardware. Select them with `--backend=sim` (see hardware.py).
+"""
+
+import time
+import numpy as np
+
+ELEMENTARY_CHARGE = 1.602e-19
+
+
+class SimulatedHVChannel:
+    """One HV output. VMON follows VSET at the ramp-up/ramp-down speed."""
+
+    def __init__(self, supply, channel):
+        self._supply = supply
+        self.channel = channel
+        self.on = False
+        self.vset = 0.0
+        self.rup = 50.0 #V/s
+        self.rdw = 50.0 #V/s
+        self.load_MOhm = 20.0 #PMT divider chain
+        self._v_start = 0.0
+        self._t_start = 0.0
+
+    def _v_now(self):
+        target = self.vset if self.on else 0.0
+        if target == self._v_start:
+            return target
+        sign = 1 if target > self._v_start else -1
+        rate = self.rup if sign > 0 else self.rdw
+        elapsed = self._supply.clock() - self._t_start
+        ramp_time = abs(target - self._v_start)/rate
+        if elapsed < ramp_time:
+            return self._v_start + sign*rate*elapsed
+        # overshoot at the end of the ramp that decays with settle_tau
+        return target + sign*self._supply.overshoot_V*np.exp(-(elapsed - ramp_time)/self._supply.settle_tau)
+
+    def _restart_ramp(self):
+        self._v_start = self._v_now()
+        self._t_start = self._supply.clock()
+
+    def set_vset(self, value):
+        self._restart_ramp()
+        self.vset = float(value)
+
+    def set_on(self, on):
+        self._restart_ramp()
+        self.on = on
+
+    def set_ramp_speed(self, rup=None, rdw=None):
+        self._restart_ramp()
+        if rup is not None:
+            self.rup = float(rup)
+        if rdw is not None:
+            self.rdw = float(rdw)
+
+    @property
+    def V_mon(self):
+        return self._v_now() + self._supply.rng.normal(0, self._supply.vmon_noise)
+
+    @property
+    def I_mon(self):
+        return self._v_now()/self.load_MOhm + self._supply.rng.normal(0, self._supply.imon_noise) #uA
+
+    def ramp_voltage(self, voltage, ramp_speed_VperSec=5, timeout=10):
+        """Ramp to `voltage` and block until VMON gets there, like CAENpy."""
+        self.set_ramp_speed(ramp_speed_VperSec, ramp_speed_VperSec)
+        self.set_on(True)
+        self.set_vset(voltage)
+        ramp_time = abs(voltage - self._v_start)/ramp_speed_VperSec
+        if ramp_time > timeout:
+            self._supply.sleep(timeout)
+            raise RuntimeError(f'Timeout while ramping channel {self.channel} to {voltage} V.')
+        self._supply.sleep(ramp_time)
+
+
+class SimulatedDT1470:
+    """
+    Simulated CAEN desktop HV supply. `speedup` > 1 runs the simulated clock
+    (ramps, settling) faster than wall time. At the end of a ramp VMON
+    overshoots by overshoot_V and settles with a time constant settle_tau.
+    """
+
+    def __init__(self, port=None, n_channels=4, speedup=1.0, overshoot_V=1.0, settle_tau=2.0, vmon_noise=0.05, imon_noise=0.01, seed=None):
+        self.idn = 'Simulated CAEN DT1470'
+        self.port = port
+        self.speedup = speedup
+        self.overshoot_V = overshoot_V
+        self.settle_tau = settle_tau
+        self.vmon_noise = vmon_noise
+        self.imon_noise = imon_noise
+        self.rng = np.random.default_rng(seed)
+        self._t0 = time.time()
+        self.channels = [SimulatedHVChannel(self, ch) for ch in range(n_channels)]
+
+    def clock(self):
+        return (time.time() - self._t0)*self.speedup
+
+    def sleep(self, seconds):
+        time.sleep(seconds/self.speedup)
+
+    def send_command(self, CMD, PAR, CH=None, VAL=None):
+        channel = self.channels[CH] if CH is not None else None
+        if CMD == 'SET':
+            if PAR == 'VSET':
+                channel.set_vset(VAL)
+            elif PAR == 'ON':
+                channel.set_on(True)
+            elif PAR == 'OFF':
+                channel.set_on(False)
+            elif PAR == 'RUP':
+                channel.set_ramp_speed(rup=VAL)
+            elif PAR == 'RDW':
+                channel.set_ramp_speed(rdw=VAL)
+            else:
+                raise ValueError(f'Parameter {PAR} is not simulated.')
+            return
+        if CMD == 'MON':
+            return self.get_single_channel_parameter(PAR, CH)
+        raise ValueError(f'Command {CMD} is not simulated.')
+
+    def get_single_channel_parameter(self, parameter, channel):
+        channel = self.channels[channel]
+        if parameter == 'VMON':
+            return channel.V_mon
+        if parameter == 'IMON':
+            return channel.I_mon
+        if parameter == 'VSET':
+            return channel.vset
+        if parameter == 'RUP':
+            return channel.rup
+        if parameter == 'RDW':
+            return channel.rdw
+        if parameter == 'STAT':
+            ramping = abs(channel._v_now() - (channel.vset if channel.on else 0)) > 0.5
+            return int(channel.on) | (int(ramping and channel.on) << 1) | (int(ramping and not channel.on) << 2)
+        raise ValueError(f'Parameter {parameter} is not simulated.')
+
+
+class SimulatedDT5742Digitizer:
+    """
+    Simulated DT5742. Triggers arrive as a Poisson process at trigger_rate_Hz
+    while acquiring and wait in an on-board buffer of buffer_size events;
+    triggers arriving with a full buffer are lost (dead time). Each
+    get_waveforms() reads at most max_num_events_BLT events.
+
+    The pulse is a Gaussian of pulse_sigma_s whose charge is n_pe * gain * e,
+    with n_pe ~ Poisson(mean_pe) (at least 1) and the gain following
+    gain_at_1000V*(HV/1000 V)**gain_exponent for the HV of the linked supply
+    channel. By default only CH0 has a PMT, on HV channel hv_channel;
+    pmt_channels={digitizer channel: HV channel} adds more, each trigger then
+    comes from one of them at random. Other channels only carry noise.
+    """
+
+    def __init__(self, LinkNum=0, trigger_rate_Hz=1000, buffer_size=1024, hv_supply=None, hv_channel=0,
+                 mean_pe=1.0, gain_at_1000V=1e7, gain_exponent=7, pulse_sigma_s=2e-9, trigger_position=0.3,
+                 noise_V=0.001, seed=None, pmt_channels=None):
+        self.idn = 'Simulated CAEN DT5742'
+        self.LinkNum = LinkNum
+        self.trigger_rate_Hz = trigger_rate_Hz
+        self.buffer_size = buffer_size
+        self.hv_supply = hv_supply
+        self.hv_channel = hv_channel
+        self.pmt_channels = {0: hv_channel} if pmt_channels is None else dict(pmt_channels)
+        self.mean_pe = mean_pe
+        self.gain_at_1000V = gain_at_1000V
+        self.gain_exponent = gain_exponent
+        self.pulse_sigma_s = pulse_sigma_s
+        self.trigger_position = trigger_position
+        self.noise_V = noise_V
+        self.rng = np.random.default_rng(seed)
+
+        self.sampling_frequency_MHz = 2500
+        self.record_length = 1024
+        self.max_num_events_BLT = 1024
+        self.groups = {1: True, 2: False}
+        self.dc_offsets = {}
+        self.registers = {}
+        self.acquiring = False
+        self.n_triggers = 0
+        self.n_lost_events = 0
+        self._pending = 0
+        self._last_update = None
+        self._sw_triggers = 0
+
+    ##### Configuration #####
+    def set_sampling_frequency(self, MHz):
+        self.sampling_frequency_MHz = MHz
+
+    def set_record_length(self, length):
+        self.record_length = int(length)
+
+    def set_max_num_events_BLT(self, max_num_events):
+        self.max_num_events_BLT = int(max_num_events)
+
+    def set_acquisition_mode(self, mode):
+        self.acquisition_mode = mode
+
+    def set_ext_trigger_input_mode(self, mode):
+        self.ext_trigger_input_mode = mode
+
+    def set_fast_trigger_mode(self, enabled):
+        self.fast_trigger_mode = enabled
+
+    def set_fast_trigger_digitizing(self, enabled):
+        self.fast_trigger_digitizing = enabled
+
+    def set_fast_trigger_threshold(self, threshold):
+        self.fast_trigger_threshold = threshold
+
+    def set_fast_trigger_DC_offset(self, V=None, DAC=None):
+        self.fast_trigger_DC_offset = V
+
+    def set_post_trigger_size(self, post_trigger_size):
+        self.post_trigger_size = post_trigger_size
+
+    def set_trigger_polarity(self, channel, edge):
+        self.trigger_polarity = edge
+
+    def enable_channels(self, group_1, group_2):
+        self.groups = {1: group_1, 2: group_2}
+
+    def set_channel_DC_offset(self, channel, V):
+        self.dc_offsets[channel] = V
+
+    def get_channel_DC_offset(self, channel):
+        return int((self.dc_offsets.get(channel, 0) + 1)/2*0xFFFF)
+
+    def read_register(self, address):
+        return self.registers.get(address, 0)
+
+    def write_register(self, address, data):
+        self.registers[address] = int(data) & 0xFFFFFFFF
+
+    def _get_handle(self):
+        return self.LinkNum
+
+    ##### Acquisition #####
+    def __enter__(self):
+        self.acquiring = True
+        self._pending = 0
+        self._last_update = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._update_buffer()
+        self.acquiring = False
+
+    def send_sw_trigger(self):
+        self._sw_triggers += 1
+
+    def _update_buffer(self):
+        if not self.acquiring:
+            return
+        now = time.time()
+        n_new = self.rng.poisson(self.trigger_rate_Hz*(now - self._last_update)) + self._sw_triggers
+        self._sw_triggers = 0
+        self._last_update = now
+        self.n_triggers += n_new
+        self._pending += n_new
+        if self._pending > self.buffer_size:
+            self.n_lost_events += self._pending - self.buffer_size
+            self._pending = self.buffer_size
+
+    def _channels(self):
+        channels = []
+        if self.groups.get(1):
+            channels += list(range(8))
+        if self.groups.get(2):
+            channels += list(range(8, 16))
+        return channels
+
+    def _hv(self, hv_channel):
+        if self.hv_supply is None:
+            return 1000.0
+        return max(self.hv_supply.channels[hv_channel]._v_now(), 0.0)
+
+    def _baseline(self, channel):
+        return 0.1 - self.dc_offsets.get(channel, 0.0)
+
+    def get_waveforms(self):
+        self._update_buffer()
+        n_events = min(self._pending, self.max_num_events_BLT)
+        self._pending -= n_events
+        if n_events == 0:
+            return []
+
+        channels = self._channels()
+        n_samples = self.record_length
+        time_axis = np.arange(n_samples)/(self.sampling_frequency_MHz*1e6)
+        amplitudes = self.noise_V*self.rng.standard_normal((n_events, len(channels), n_samples))
+        amplitudes += np.array([self._baseline(ch) for ch in channels])[None, :, None]
+
+        pmts = [channel for channel in self.pmt_channels if channel in channels]
+        pmt = self.rng.choice(pmts, n_events) if len(pmts) > 0 else np.empty(0, dtype=int)
+        for digitizer_channel in pmts:
+            events = np.flatnonzero(pmt == digitizer_channel)
+            gain = self.gain_at_1000V*(self._hv(self.pmt_channels[digitizer_channel])/1000)**self.gain_exponent
+            n_pe = np.maximum(self.rng.poisson(self.mean_pe, len(events)), 1)
+            charge = n_pe*gain*ELEMENTARY_CHARGE*self.rng.normal(1, 0.3, len(events)).clip(0.1)
+            peak_V = charge*50/(self.pulse_sigma_s*np.sqrt(2*np.pi))
+            t_peak = self.trigger_position*n_samples/(self.sampling_frequency_MHz*1e6)
+            shape = np.exp(-0.5*((time_axis - t_peak)/self.pulse_sigma_s)**2)
+            amplitudes[events, channels.index(digitizer_channel), :] -= peak_V[:, None]*shape[None, :]
+        amplitudes = np.clip(np.round((amplitudes + 0.5)*4096), 0, 4095)/4096 - 0.5 #12 bit ADC, 1 Vpp
+
+        return [{f'CH{channel}': {'Time (s)': time_axis, 'Amplitude (V)': amplitudes[n_event, n_channel]}
+                 for n_channel, channel in enumerate(channels)} for n_event in range(n_events)]
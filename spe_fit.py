@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:34:09 2026
+
+@author: danielvalmassei
+
+Single photoelectron spectrum fits of every voltage step at once. The charge
+spectrum of a step is modelled as a pedestal and the 1, 2 and 3 p.e. peaks,
+
+    f(q) = sum_n A_n * Gauss(q; Q0 + n*G, sqrt(sigma0**2 + n*sigma1**2 + n**2*sigma2**2)),   n = 0..3
+
+so the fitted gain G is the spacing of the peaks instead of the mean charge
+(which also counts the multi-p.e. events). sigma1 is the spread of the
+single p.e. response, sigma2 that of a gain common to all p.e. of an event.
+All steps are histogrammed with one np.bincount and fitted together by a
+batched Levenberg-Marquardt with an analytic Jacobian; then every step is
+fitted again starting from the result of the step before it (warm start),
+scaled to its charge, and keeps the better of both fits. Fits that did not
+converge, describe the spectrum badly or leave the gain undetermined are
+marked invalid (SPEFit.valid).
+"""
+
+import numpy as np
+
+N_PE = 3 #highest p.e. peak in the model
+FIT_BINS = 100
+FIT_MAX_ITERATIONS = 300
+FIT_TOLERANCE = 0.01 #chi2 change at which a fit has converged, far below a significant difference
+PEDESTAL_MIN_FRACTION = 0.02 #below this fraction of pedestal events (self trigger) the pedestal peak is left out
+# a fitted gain is only reported if the fit converged and
+FIT_MAX_CHI2_NDF = 5.0 #describes the spectrum,
+FIT_MAX_RELATIVE_ERROR = 0.05 #determines the gain to 5%
+FIT_MIN_RESOLUTION = 2.0 #and the 1 p.e. peak is at least two of its widths away from 0
+PARAMETERS = tuple(f'A{n}' for n in range(N_PE + 1)) + ('Q0', 'G', 'sigma0', 'sigma1', 'sigma2')
+_AMPLITUDES = slice(0, N_PE + 1)
+_Q0, _G, _SIGMA0, _SIGMA1, _SIGMA2 = range(N_PE + 1, N_PE + 6)
+_N = np.arange(N_PE + 1)
+
+
+def charge_summary(charges):
+    """
+    (n_steps, 4) median, 0.5 and 99.5 percentiles and RMS of the negative
+    charges (the pedestal width, NaN with 10 or fewer) of every step, which
+    the fit ranges and starting points are estimated from.
+    """
+    summary = np.full((len(charges), 4), np.nan)
+    for n_step, step_charges in enumerate(charges):
+        if len(step_charges) == 0:
+            continue
+        summary[n_step, :3] = np.percentile(step_charges, [50, 0.5, 99.5])
+        negative = step_charges[step_charges < 0]
+        if len(negative) > 10:
+            summary[n_step, 3] = np.sqrt(np.mean(negative**2))
+    return summary
+
+
+def histogram_summary(counts, edges):
+    """charge_summary() of fine (n_steps, n_bins) charge histograms with (n_bins + 1) common edges."""
+    counts = np.asarray(counts, dtype=float)
+    summary = np.full((len(counts), 4), np.nan)
+    centers = (edges[1:] + edges[:-1])/2
+    cumulative = np.cumsum(counts, axis=1)
+    for n_step in np.flatnonzero(cumulative[:, -1] > 0):
+        # linear interpolation of the cumulative distribution between the bin edges
+        summary[n_step, :3] = np.interp(np.array([0.5, 0.005, 0.995])*cumulative[n_step, -1], cumulative[n_step], edges[1:])
+        negative = counts[n_step, centers < 0]
+        if negative.sum() > 10:
+            summary[n_step, 3] = np.sqrt(np.sum(negative*centers[centers < 0]**2)/negative.sum())
+    return summary
+
+
+def fit_ranges(summary):
+    """(n_steps, 2) histogram range of every step: the pedestal up to about 3.5 p.e."""
+    median, low, high = (np.nan_to_num(summary[:, n], nan=default) for n, default in ((0, 1.0), (1, -1.0), (2, 1.0)))
+    return np.column_stack([np.minimum(low, -0.5*np.abs(median)), np.where(median != 0, np.minimum(high, 3.5*np.abs(median)), high)])
+
+
+def _degenerate(ranges):
+    # all charges of a step equal (a single event, a saturated or empty region of interest): a range around them
+    ranges = np.array(ranges, dtype=float).reshape(-1, 2)
+    degenerate = ~(ranges[:, 1] > ranges[:, 0])
+    center = np.nan_to_num(ranges[degenerate].mean(axis=1))
+    half = np.maximum(0.5*np.abs(center), 1.0)
+    ranges[degenerate] = np.column_stack([center - half, center + half])
+    return ranges
+
+
+def charge_histograms(charges, bins=FIT_BINS, ranges=None):
+    """
+    Histogram every step's charges in its own range with a single bincount.
+    Returns the (n_steps, bins) counts and (n_steps, bins + 1) bin edges.
+    """
+    ranges = _degenerate(fit_ranges(charge_summary(charges)) if ranges is None else ranges)
+    n_steps = len(charges)
+    lengths = np.array([len(step_charges) for step_charges in charges], dtype=np.int64)
+    values = np.concatenate(charges) if n_steps > 0 else np.empty(0)
+    step = np.repeat(np.arange(n_steps), lengths)
+    width = (ranges[:, 1] - ranges[:, 0])/bins
+    position = (values - ranges[step, 0])/width[step]
+    inside = (position >= 0) & (position <= bins) #also drops NaN charges
+    index = np.minimum(position[inside].astype(np.int64), bins - 1) #the last bin includes the upper edge, as in np.histogram
+    counts = np.bincount(step[inside]*bins + index, minlength=n_steps*bins).reshape(n_steps, bins)
+    edges = ranges[:, :1] + width[:, None]*np.arange(bins + 1)
+    return counts.astype(float), edges
+
+
+def rebin(counts, edges, bins=FIT_BINS, ranges=None):
+    """
+    Merge fine (n_steps, n_bins) histograms with common edges into `bins`
+    bins per step covering about its range. Every bin is a whole number of
+    fine bins, so no fine bin is split between two. Returns the counts and
+    edges as charge_histograms() does.
+    """
+    counts = np.asarray(counts, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+    ranges = _degenerate(fit_ranges(histogram_summary(counts, edges)) if ranges is None else ranges)
+    fine_width = edges[1] - edges[0]
+    merge = np.maximum(np.round((ranges[:, 1] - ranges[:, 0])/bins/fine_width), 1).astype(np.int64)
+    first = np.floor((ranges[:, 0] - edges[0])/fine_width).astype(np.int64)
+    index = first[:, None] + merge[:, None]*np.arange(bins + 1)
+    cumulative = np.concatenate([np.zeros((len(counts), 1)), np.cumsum(counts, axis=1)], axis=1)
+    merged = np.diff(np.take_along_axis(cumulative, np.clip(index, 0, counts.shape[1]), axis=1), axis=1)
+    return merged, edges[0] + fine_width*index
+
+
+def _model(parameters, x, width):
+    """f (n_steps, bins) and the pieces the Jacobian is built from."""
+    amplitudes = parameters[:, _AMPLITUDES]
+    mean = parameters[:, _Q0, None] + _N*parameters[:, _G, None] #(n_steps, n_peaks)
+    sigma = np.sqrt(parameters[:, _SIGMA0, None]**2 + _N*parameters[:, _SIGMA1, None]**2 + (_N*parameters[:, _SIGMA2, None])**2)
+    z = (x[:, None, :] - mean[:, :, None])/sigma[:, :, None] #(n_steps, n_peaks, bins)
+    peaks = np.exp(-0.5*z**2)/(np.sqrt(2*np.pi)*sigma[:, :, None])*width[:, None, None]
+    return np.einsum('sn,snb->sb', amplitudes, peaks), peaks, z, sigma
+
+
+def _jacobian(parameters, peaks, z, sigma):
+    """(n_steps, bins, n_parameters) derivatives of the model."""
+    weighted = parameters[:, _AMPLITUDES, None]*peaks
+    d_mean = weighted*z/sigma[:, :, None]
+    d_sigma = weighted*(z**2 - 1)/sigma[:, :, None]
+    jacobian = np.empty(peaks.shape[:1] + peaks.shape[2:] + (len(PARAMETERS),))
+    jacobian[:, :, _AMPLITUDES] = peaks.transpose(0, 2, 1)
+    jacobian[:, :, _Q0] = d_mean.sum(axis=1)
+    jacobian[:, :, _G] = np.einsum('snb,n->sb', d_mean, _N)
+    jacobian[:, :, _SIGMA0] = np.einsum('snb,sn->sb', d_sigma, parameters[:, _SIGMA0, None]/sigma)
+    jacobian[:, :, _SIGMA1] = np.einsum('snb,sn->sb', d_sigma, _N*parameters[:, _SIGMA1, None]/sigma)
+    jacobian[:, :, _SIGMA2] = np.einsum('snb,sn->sb', d_sigma, _N**2*parameters[:, _SIGMA2, None]/sigma)
+    return jacobian
+
+
+def _chi2(counts, model, weights):
+    return np.sum(weights*(counts - model)**2, axis=1)
+
+
+def _physical(parameters):
+    # amplitudes and widths stay positive, the gain stays above the 1 p.e. width/10
+    parameters[:, _AMPLITUDES] = np.maximum(parameters[:, _AMPLITUDES], 0.0)
+    parameters[:, _SIGMA0] = np.maximum(np.abs(parameters[:, _SIGMA0]), 1e-3*np.abs(parameters[:, _G]))
+    parameters[:, _SIGMA1] = np.maximum(np.abs(parameters[:, _SIGMA1]), 1e-3*np.abs(parameters[:, _G]))
+    parameters[:, _SIGMA2] = np.maximum(np.abs(parameters[:, _SIGMA2]), 1e-3*np.abs(parameters[:, _G]))
+    parameters[:, _G] = np.maximum(parameters[:, _G], 0.1*parameters[:, _SIGMA0])
+    return parameters
+
+
+def _linear_amplitudes(parameters, counts, x, width, weights):
+    """Best amplitudes for the other (fixed) parameters, a batched linear least squares fit."""
+    trial = parameters.copy()
+    trial[:, _AMPLITUDES] = 1.0
+    _, peaks, _, _ = _model(trial, x, width)
+    normal = np.einsum('snb,smb,sb->snm', peaks, peaks, weights) + 1e-12*np.eye(N_PE + 1)
+    projection = np.einsum('snb,sb->sn', peaks, weights*counts)
+    parameters[:, _AMPLITUDES] = np.maximum(np.linalg.solve(normal, projection[:, :, None])[:, :, 0], 0.0)
+    return parameters
+
+
+def initial_parameters(summary, counts, edges):
+    """
+    Starting point of every step from its charge_summary(): the median charge
+    as the gain (most events of a self-triggered run are single p.e.), the
+    spread of the charges below zero as the pedestal width and linear least
+    squares peak amplitudes.
+    """
+    gain = np.abs(np.nan_to_num(summary[:, 0]))
+    gain = np.where(gain > 0, gain, 1.0)
+    parameters = np.zeros((len(summary), len(PARAMETERS)))
+    parameters[:, _G] = gain
+    parameters[:, _SIGMA0] = np.where(np.isnan(summary[:, 3]), 0.1*gain, summary[:, 3])
+    parameters[:, _SIGMA1] = 0.3*gain
+    parameters[:, _SIGMA2] = 0.1*gain
+    x = (edges[:, 1:] + edges[:, :-1])/2
+    width = edges[:, 1] - edges[:, 0]
+    return _linear_amplitudes(_physical(parameters), counts, x, width, 1/np.maximum(counts, 1))
+
+
+def _levenberg_marquardt(parameters, counts, x, width, weights, free, max_iterations):
+    """
+    Fit every step at once; each keeps its own damping and stops on its own.
+    Parameters where `free` is False keep their starting value.
+    """
+    n_steps = len(parameters)
+    damping = np.full(n_steps, 1e-3)
+    model = _model(parameters, x, width)
+    chi2 = _chi2(counts, model[0], weights)
+    active = np.ones(n_steps, dtype=bool)
+    converged = np.zeros(n_steps, dtype=bool)
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        index = np.flatnonzero(active)
+        jacobian = _jacobian(parameters[index], model[1][index], model[2][index], model[3][index])*free[index, None, :]
+        residuals = counts[index] - model[0][index]
+        curvature = np.einsum('sbp,sbq,sb->spq', jacobian, jacobian, weights[index])
+        gradient = np.einsum('sbp,sb->sp', jacobian, weights[index]*residuals)
+        diagonal = np.diagonal(curvature, axis1=1, axis2=2)
+        damped = curvature + (damping[index, None]*diagonal + 1e-12*diagonal.max(axis=1, keepdims=True))[:, :, None]*np.eye(len(PARAMETERS))
+        try:
+            step = np.linalg.solve(damped, gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError: #e.g. sigma1 = 0, whose derivative vanishes
+            step = np.einsum('spq,sq->sp', np.linalg.pinv(damped), gradient)
+        trial = _physical(parameters[index] + step)
+        trial_model = _model(trial, x[index], width[index])
+        trial_chi2 = _chi2(counts[index], trial_model[0], weights[index])
+        better = trial_chi2 < chi2[index]
+        accepted = index[better]
+        improvement = chi2[accepted] - trial_chi2[better]
+        parameters[accepted] = trial[better]
+        chi2[accepted] = trial_chi2[better]
+        for full, part in zip(model, trial_model):
+            full[accepted] = part[better]
+        damping[accepted] /= 10
+        damping[index[~better]] *= 10
+        # converged once chi2 stops improving, or when no step however small improves it any more
+        done = np.concatenate([accepted[improvement < FIT_TOLERANCE], index[~better][damping[index[~better]] > 1e10]])
+        converged[done] = True
+        active[done] = False
+    return parameters, chi2, converged, model
+
+
+class SPEFit:
+    """Fitted parameters, errors and goodness of fit of every step, in the order the charges were given."""
+
+    def __init__(self, voltages, counts, edges, parameters, errors, chi2, ndf, converged):
+        self.voltages = voltages
+        self.counts = counts
+        self.edges = edges
+        self.parameters = parameters
+        self.errors = errors
+        self.chi2 = chi2
+        self.ndf = ndf
+        self.converged = converged
+
+    @property
+    def gain(self):
+        return self.parameters[:, _G]
+
+    @property
+    def gain_err(self):
+        return self.errors[:, _G]
+
+    @property
+    def chi2_ndf(self):
+        return np.where(self.ndf > 0, self.chi2/np.maximum(self.ndf, 1), np.nan) #an empty spectrum has nothing to fit
+
+    def model(self, n_step, x=None):
+        """Fitted spectrum of one step (counts per bin) at the bin centers or at x."""
+        edges = self.edges[n_step]
+        x = (edges[1:] + edges[:-1])/2 if x is None else np.asarray(x, dtype=float)
+        return _model(self.parameters[n_step:n_step + 1], x[None, :], np.array([edges[1] - edges[0]]))[0][0]
+
+    @property
+    def valid(self):
+        """Steps whose fitted gain can be trusted, see FIT_MAX_CHI2_NDF and below."""
+        return (self.converged & (self.ndf > 0) & (self.chi2_ndf <= FIT_MAX_CHI2_NDF)
+                & (self.gain_err <= FIT_MAX_RELATIVE_ERROR*self.gain)
+                & (self.gain >= FIT_MIN_RESOLUTION*np.sqrt(np.sum(self.parameters[:, _SIGMA0:]**2, axis=1))))
+
+    def table(self):
+        """(n_steps, 6) array of voltage, fitted gain, its error, sigma1, chi2/ndf and valid."""
+        return np.column_stack([self.voltages, self.gain, self.gain_err, self.parameters[:, _SIGMA1], self.chi2_ndf, self.valid])
+
+
+def _warm_start(parameters, n_step, summary, counts, scale):
+    """Starting point of step n_step from the fitted parameters of step n_step - 1."""
+    previous = parameters[n_step - 1:n_step].copy()
+    ratio = summary[n_step, 0]/summary[n_step - 1, 0]
+    ratio = ratio if np.isfinite(ratio) and ratio > 0 else 1.0
+    previous[:, N_PE + 1:] *= scale[n_step - 1]/scale[n_step]
+    # the pedestal does not change with the HV, the p.e. peaks move with the gain
+    previous[:, _G] *= ratio
+    previous[:, [_SIGMA1, _SIGMA2]] *= ratio
+    previous[:, _AMPLITUDES] *= counts[n_step].sum()/max(counts[n_step - 1].sum(), 1)
+    return _physical(previous)
+
+
+def fit_spectra(charges, voltages=None, bins=FIT_BINS, initial=None, warm_start=True, max_iterations=FIT_MAX_ITERATIONS):
+    """
+    Fit the charge spectra of all steps (a list of 1D charge arrays, in
+    order of increasing voltage for the warm starts). Every step is fitted
+    from a start estimated from its own charges, all at once, and with
+    warm_start=True again from the result of the step before it; the better
+    of the two fits is kept. `initial` replaces the estimated start, e.g.
+    the parameters of an earlier SPEFit of the same steps, so an interactive
+    refit starts where the last one ended. Returns an SPEFit.
+    """
+    charges = [np.asarray(step_charges, dtype=float) for step_charges in charges]
+    summary = charge_summary(charges)
+    counts, edges = charge_histograms(charges, bins, fit_ranges(summary))
+    return _fit(counts, edges, summary, voltages, initial, warm_start, max_iterations)
+
+
+def fit_histograms(counts, edges, voltages=None, bins=FIT_BINS, initial=None, warm_start=True, max_iterations=FIT_MAX_ITERATIONS):
+    """
+    fit_spectra() of fine (n_steps, n_bins) charge histograms with common
+    edges instead of the charges, e.g. those accumulated in streaming mode.
+    The fine bins (about 1/100 of the gain or smaller) are merged into
+    `bins` bins per step.
+    """
+    summary = histogram_summary(counts, edges)
+    counts, edges = rebin(counts, edges, bins, fit_ranges(summary))
+    return _fit(counts, edges, summary, voltages, initial, warm_start, max_iterations)
+
+
+def _fit(counts, edges, summary, voltages, initial, warm_start, max_iterations):
+    voltages = np.arange(len(counts)) if voltages is None else np.asarray(voltages, dtype=float)
+    # fit in units of the starting gain, so all parameters are of order 1 (amplitudes of order the counts)
+    parameters = initial_parameters(summary, counts, edges) if initial is None else np.array(initial, dtype=float)
+    scale = np.where(parameters[:, _G] > 0, parameters[:, _G], 1.0)
+    units = np.ones_like(parameters)
+    units[:, N_PE + 1:] = scale[:, None]
+    x = (edges[:, 1:] + edges[:, :-1])/2/scale[:, None]
+    width = (edges[:, 1] - edges[:, 0])/scale
+    weights = 1/np.maximum(counts, 1) #Neyman chi2, empty bins count as one
+    # without pedestal events (self trigger) there is no pedestal peak to fit and
+    # the charges are pedestal subtracted, so the 0 p.e. position stays at 0
+    free = np.ones(parameters.shape, dtype=bool)
+    no_pedestal = parameters[:, 0] < PEDESTAL_MIN_FRACTION*np.maximum(parameters[:, _AMPLITUDES].sum(axis=1), 1)
+    free[no_pedestal, 0] = free[no_pedestal, _Q0] = False
+    parameters[no_pedestal, 0] = parameters[no_pedestal, _Q0] = 0.0
+    parameters, chi2, converged, model = _levenberg_marquardt(parameters/units, counts, x, width, weights, free, max_iterations)
+
+    if warm_start:
+        for n_step in range(1, len(counts)):
+            one = slice(n_step, n_step + 1)
+            start = _warm_start(parameters, n_step, summary, counts, scale)
+            start[~free[one]] = parameters[one][~free[one]]
+            refit = _levenberg_marquardt(start, counts[one], x[one], width[one], weights[one], free[one], max_iterations)
+            # a converged fit beats an unconverged one, otherwise the lower chi2 wins
+            if (refit[2][0], -refit[1][0]) > (converged[n_step], -chi2[n_step]):
+                parameters[n_step], chi2[n_step], converged[n_step] = refit[0][0], refit[1][0], refit[2][0]
+                for full, part in zip(model, refit[3]):
+                    full[n_step] = part[0]
+
+    ndf = np.sum(counts > 0, axis=1) - free.sum(axis=1)
+    jacobian = _jacobian(parameters, *model[1:])*free[:, None, :]
+    curvature = np.einsum('sbp,sbq,sb->spq', jacobian, jacobian, weights)
+    covariance = np.linalg.pinv(curvature) #pinv: an empty peak leaves its width unconstrained
+    errors = np.sqrt(np.abs(np.diagonal(covariance, axis1=1, axis2=2)))*np.sqrt(np.maximum(chi2/np.maximum(ndf, 1), 1))[:, None]
+    errors[~free] = 0.0
+    return SPEFit(voltages, counts, edges, parameters*units, errors*units, chi2, ndf, converged)
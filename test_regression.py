@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:59:31 2026
+
+@author: danielvalmassei
+
+Fast regression checks of the vectorized code against the reference copies
+of the original per-event code kept in benchmark.py, on a few hundred
+synthetic events, of the charge integration of out.csv files and of steps
+without events, and of the scan checkpoint on the simulated digitizer.
+Run with `python -m pytest test_regression.py`.
+"""
+
+from functools import partial
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import make_waveforms, legacy_convert_dicitonaries_to_data_frame, legacy_charges, vectorized_charges
+from event_builder import EventBuilder, build_data_frame
+from analysis import analyze_in_memory, analyze_streaming, compute_charges
+from acquisition import AcquisitionEngine
+from checkpoint import ScanCheckpoint
+from run_format import RunWriter
+from simulated_hardware import SimulatedDT5742Digitizer
+
+
+def test_build_data_frame_matches_legacy_conversion():
+    waveforms = make_waveforms(20, n_channels=4, record_length=256)
+    pd.testing.assert_frame_equal(legacy_convert_dicitonaries_to_data_frame(waveforms, 1000.0),
+                                  build_data_frame(waveforms, 1000.0))
+
+
+def test_event_builder_batches_match_legacy_conversion():
+    waveforms = make_waveforms(30, n_channels=2, record_length=256, seed=1)
+    builder = EventBuilder(len(waveforms), list(waveforms[0]), 256)
+    for start in range(0, len(waveforms), 8): #several get_waveforms() batches
+        builder.add(waveforms[start:start + 8], 1100.0)
+    pd.testing.assert_frame_equal(legacy_convert_dicitonaries_to_data_frame(waveforms, 1100.0), builder.to_data_frame())
+
+
+def test_vectorized_charges_match_legacy_loop():
+    data = build_data_frame(make_waveforms(200, n_channels=1, seed=2), 1000.0).reset_index()
+    np.testing.assert_allclose(vectorized_charges(data), legacy_charges(data), rtol=1e-9, atol=1e-3)
+
+
+@pytest.mark.parametrize('analyze', [analyze_in_memory, analyze_streaming])
+def test_csv_signal_window_matches_waveform_charges(tmp_path, analyze):
+    waveforms = make_waveforms(50, n_channels=1, seed=3)
+    build_data_frame(waveforms, 1000.0).to_csv(tmp_path/'out.csv') #the legacy out.csv, with (events, samples) times
+    amplitudes = np.stack([event['CH0']['Amplitude (V)'] for event in waveforms])
+    charges = compute_charges(amplitudes, waveforms[0]['CH0']['Time (s)'], signal_window=(300, 500))
+    _, steps = analyze(str(tmp_path/'out.csv'), signal_window=(300, 500))
+    assert steps[1000.0].n == 50
+    np.testing.assert_allclose(steps[1000.0].mean, charges.mean(), rtol=1e-9)
+
+
+def test_step_without_events_has_no_gain(tmp_path):
+    output = str(tmp_path/'out.h5')
+    with RunWriter(output, record_length=1024) as writer:
+        writer.begin_step(1000.0)
+        writer.append_waveforms(make_waveforms(50, n_channels=1, seed=4), 1000.0)
+        writer.begin_step(1100.0) #every event suppressed
+    _, steps = analyze_in_memory(output)
+    assert steps[1000.0].n == 50 and steps[1100.0].n == 0
+    assert np.isnan(steps[1100.0].mean) #not a gain 0 point in gain_table.txt
+
+def _scan_step(output, handler=None):
+    # one scan step the way HV_scan.py takes it, with an optional extra handler
+    checkpoint = ScanCheckpoint(output, {})
+    checkpoint.save()
+    writer = RunWriter(output, record_length=1024)
+    engine = AcquisitionEngine(SimulatedDT5742Digitizer(), poll_interval=0.01)
+    engine.start()
+    try:
+        engine.submit(writer.begin_step, 1000.0)
+        handlers = [partial(writer.append_waveforms, voltage=1000.0)] + ([handler] if handler is not None else [])
+        collected_events = engine.acquire(handlers, 100, timeout=5)
+        engine.submit(checkpoint.complete_step, 0, 1000.0, collected_events, writer)
+        engine.join()
+    finally:
+        try:
+            engine.stop()
+        finally:
+            writer.close()
+
+
+def test_completed_step_is_checkpointed(tmp_path):
+    output = str(tmp_path/'out.h5')
+    _scan_step(output)
+    assert ScanCheckpoint.load(output).n_completed == 1
+
+
+def test_failed_write_is_not_checkpointed(tmp_path):
+    def fail(waveforms):
+        raise OSError('No space left on device')
+
+    output = str(tmp_path/'out.h5')
+    with pytest.raises(OSError):
+        _scan_step(output, fail)
+    assert ScanCheckpoint.load(output).n_completed == 0 #--resume takes the step again
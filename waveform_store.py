@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:02:51 2026
+
+@author: danielvalmassei
+
+Memory-mapped waveform store for random access to single events. A store is
+a directory (e.g. out.wfs/) holding:
+
+    samples.dat  raw samples (ADC counts or amplitudes in V), one
+                 fixed-stride record of record_length samples per
+                 (event, channel), appended in acquisition order
+    index.dat    one INDEX_DTYPE entry per record: step, voltage, n_event,
+                 channel and the record offset in samples.dat
+    meta.json    dtype, record_length, channels and the sample times, or for
+                 ADC counts volts_per_count, volts_offset and sampling_period
+"""
+
+import json
+import os
+import numpy as np
+from event_builder import to_volts, sample_times
+
+INDEX_DTYPE = np.dtype([('step', '<i4'), ('voltage', '<f8'), ('n_event', '<i8'), ('channel', '<i2'), ('record', '<i8')])
+
+
+class WaveformStoreWriter:
+    """
+    Append EventBuilder batches to a waveform store. Has the same
+    begin_step()/append() interface as run_format.RunWriter.
+
+    resume_steps=n reopens the store of an interrupted scan like
+    RunWriter(resume_steps=n): the records of the first n steps are kept,
+    the files are truncated after them and the next begin_step() starts
+    step n again.
+    """
+
+    def __init__(self, path, resume_steps=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        mode = 'wb' if resume_steps is None else 'ab'
+        self._samples = open(os.path.join(path, 'samples.dat'), mode)
+        self._index = open(os.path.join(path, 'index.dat'), mode)
+        self.n_steps = 0 if resume_steps is None else int(resume_steps)
+        self.n_records = 0
+        self._voltage = None
+        self._meta = None
+        if resume_steps is not None:
+            self._truncate()
+
+    def _truncate(self):
+        # index.dat is ordered by step, keep the records of the steps before n_steps
+        index_filename = os.path.join(self.path, 'index.dat')
+        index = np.fromfile(index_filename, dtype=INDEX_DTYPE, count=os.path.getsize(index_filename)//INDEX_DTYPE.itemsize)
+        self.n_records = int(np.searchsorted(index['step'], self.n_steps))
+        if self.n_records > 0:
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                self._meta = json.load(f)
+            record_size = np.dtype(self._meta['dtype']).itemsize*self._meta['record_length']
+            if os.path.getsize(os.path.join(self.path, 'samples.dat')) < self.n_records*record_size:
+                raise ValueError(f'{self.path} holds fewer samples than its index, it cannot be resumed.')
+        else:
+            record_size = 0
+        self._index.truncate(self.n_records*INDEX_DTYPE.itemsize)
+        self._samples.truncate(self.n_records*record_size)
+
+    def begin_step(self, voltage, **attrs):
+        self.n_steps += 1
+        self._voltage = voltage
+
+    def _write_meta(self, builder):
+        self._meta = {'dtype': builder.counts.dtype.str, 'record_length': builder.record_length,
+                      'channels': builder.channels,
+                      'time': builder.time.tolist() if builder.time is not None and not builder.adc else None}
+        if builder.adc:
+            self._meta.update(volts_per_count=builder.volts_per_count, volts_offset=builder.volts_offset,
+                              sampling_period=builder.sampling_period if builder.sampling_period is not None
+                              else builder.time[1] - builder.time[0])
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self._meta, f)
+
+    def append(self, builder):
+        if self.n_steps == 0:
+            raise RuntimeError('begin_step() must be called before append().')
+        if builder.n_events == 0:
+            return
+        if self._meta is None:
+            self._write_meta(builder)
+        elif builder.channels != self._meta['channels'] or builder.record_length != self._meta['record_length']:
+            raise ValueError('All batches in a waveform store must have the same channels and record length.')
+
+        n_channels = len(builder.channels)
+        n_records = builder.n_events*n_channels
+        index = np.empty(n_records, dtype=INDEX_DTYPE)
+        index['step'] = self.n_steps - 1
+        index['voltage'] = self._voltage
+        index['n_event'] = np.repeat(builder.n_event, n_channels)
+        index['channel'] = np.tile(np.arange(n_channels), builder.n_events)
+        index['record'] = np.arange(self.n_records, self.n_records + n_records)
+
+        self._samples.write(np.ascontiguousarray(builder.counts).tobytes())
+        self._index.write(index.tobytes())
+        self._samples.flush()
+        self._index.flush()
+        self.n_records += n_records
+
+    def close(self):
+        self._samples.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class WaveformStore:
+    """
+    Read-only view of a waveform store. Nothing is loaded up front: event(),
+    step() and channel() return views into the memory-mapped samples, or for
+    ADC counts the amplitudes in V computed from them (raw=True for the
+    counts).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.channels = meta['channels']
+        self.record_length = meta['record_length']
+        self.adc = 'volts_per_count' in meta
+        if self.adc:
+            self.volts_per_count = meta['volts_per_count']
+            self.volts_offset = meta['volts_offset']
+            self.time = sample_times(self.record_length, meta['sampling_period'])
+        else:
+            self.time = np.array(meta['time']) if meta['time'] is not None else None
+        self.index = np.memmap(os.path.join(path, 'index.dat'), dtype=INDEX_DTYPE, mode='r')
+        n_records = len(self.index)
+        if n_records == 0:
+            self.samples = np.empty((0, self.record_length), dtype=np.dtype(meta['dtype']))
+        else:
+            self.samples = np.memmap(os.path.join(path, 'samples.dat'), dtype=np.dtype(meta['dtype']), mode='r',
+                                     shape=(n_records, self.record_length))
+
+        # index.dat is ordered by record, so each step is one contiguous range of records
+        steps, first_records = np.unique(self.index['step'], return_index=True)
+        last_records = np.append(first_records[1:], n_records)
+        self._steps = {int(step): (int(first), int(last)) for step, first, last in zip(steps, first_records, last_records)}
+        self.voltages = {int(step): float(self.index['voltage'][first]) for step, first in zip(steps, first_records)}
+
+    @property
+    def steps(self):
+        return list(self._steps)
+
+    def n_events(self, step):
+        first, last = self._steps[step]
+        return (last - first)//len(self.channels)
+
+    def _volts(self, samples, raw=False):
+        return to_volts(samples, self.volts_per_count, self.volts_offset) if self.adc and not raw else samples
+
+    def step(self, step, raw=False):
+        """(n_events, n_channels, record_length) view of one voltage step."""
+        first, last = self._steps[step]
+        return self._volts(self.samples[first:last].reshape(-1, len(self.channels), self.record_length), raw)
+
+    def channel(self, step, channel, raw=False):
+        """(n_events, record_length) view of one channel ('CH0' or its position) in one step."""
+        if isinstance(channel, str):
+            channel = self.channels.index(channel)
+        first, last = self._steps[step]
+        samples = self.samples[first:last].reshape(-1, len(self.channels), self.record_length)[:, channel, :]
+        return self._volts(samples, raw)
+
+    def event(self, step, n_event, channel, raw=False):
+        """Samples of one event and channel, e.g. store.event(3, 5123, 'CH0')."""
+        if isinstance(channel, str):
+            channel = self.channels.index(channel)
+        first, last = self._steps[step]
+        first_n_event = self.index['n_event'][first]
+        record = first + (n_event - first_n_event)*len(self.channels) + channel
+        if not first <= record < last or self.index['n_event'][record] != n_event or self.index['channel'][record] != channel:
+            # events are not consecutive in a store of prescaled waveforms, look the record up
+            step_index = self.index[first:last]
+            records = np.flatnonzero((step_index['n_event'] == n_event) & (step_index['channel'] == channel))
+            if len(records) == 0:
+                raise KeyError(f'No event {n_event} for channel {self.channels[channel]} in step {step}.')
+            record = first + records[0]
+        return self._volts(self.samples[record], raw)
+
+    def step_at(self, voltage):
+        """Step number of the first step taken at `voltage`."""
+        for step, step_voltage in self.voltages.items():
+            if np.isclose(step_voltage, voltage):
+                return step
+        raise KeyError(f'No step at {voltage} V.')
+
+    def iter_blocks(self, channels=None, block_events=1024):
+        """Same blocks as run_format.iter_blocks, read straight from the memory map."""
+        positions = list(range(len(self.channels))) if channels is None else [self.channels.index(ch) for ch in channels if ch in self.channels]
+        step_channels = [self.channels[position] for position in positions]
+        for step in self.steps:
+            samples = self.step(step, raw=True)
+            first, last = self._steps[step]
+            n_event = self.index['n_event'][first:last:len(self.channels)]
+            for start in range(0, len(samples), block_events):
+                yield (self.voltages[step], n_event[start:start + block_events],
+                       self._volts(samples[start:start + block_events, positions, :]), self.time, step_channels)